@@ -0,0 +1,18 @@
+"""
+Run every benchmark with its default settings
+
+Run from the repository root with ``python -m benchmarks``. The embed and
+collection benchmarks import the cogs, so Red-DiscordBot has to be
+installed; the others only need fflib's requirements.
+"""
+import sys
+
+from . import collection, embed, listings, parsers, sharedcache, urls
+
+if __name__ == "__main__":
+    print("== parsers ==")
+    mismatches = parsers.main()
+    for bench in (urls, embed, listings, collection, sharedcache):
+        print(f"\n== {bench.__name__.rsplit('.', 1)[-1]} ==")
+        mismatches += bench.main() or 0
+    sys.exit(mismatches)
@@ -0,0 +1,132 @@
+"""
+Measure FFPicker's listing, stats and add cost as a server's collection
+grows
+
+Stories are written through each story store, Red's Config (using the JSON
+backend) and SQLite, in a throwaway data directory, so adds include the
+cost of saving.
+
+Run from the repository root with ``python -m benchmarks.collection``.
+"""
+import asyncio
+import time
+
+from fflib import make_soup, parse_story
+
+from .common import FIXTURES, PAGES, PeakMemory, load_cogs
+from .fakes import FakeBot, FakeGuild, FakeUser
+
+SIZES = (100, 1000, 10000, 100000)
+ADDERS = 20  # Members the stories are spread over
+
+
+def template():
+    name = "ffn_story.html"
+    return parse_story(make_soup((FIXTURES / name).read_text()), PAGES[name])
+
+
+def stories(cog, count, start=0):
+    metadata = template()
+    users = [FakeUser() for _ in range(ADDERS)]
+    for n in range(start, start + count):
+        link = f"https://www.fanfiction.net/s/{n}/1/"
+        story = dict(metadata, title=f"{metadata['title']} {n}", link=link)
+        yield cog.new_story(f"ffn:{n}", story, users[n % ADDERS])
+
+
+async def timed_async(func, rounds=1):
+    start = time.perf_counter()
+    for _ in range(rounds):
+        result = await func()
+    return (time.perf_counter() - start) / rounds * 1000, result
+
+
+async def measure(cog, size, adds):
+    from ffpicker.pages import StoryPages
+
+    guild = FakeGuild()
+    await cog.store.append(guild, list(stories(cog, size)))
+    for state in (cog._index, cog._pages, cog._search, cog._stats):
+        state.pop(guild.id, None)
+
+    async def first_page():
+        pages = await cog.listing_pages(guild)
+        await pages.load_page(0)
+        return pages[0]
+
+    async def last_page():
+        pages = await cog.listing_pages(guild)
+        await pages.load_page(len(pages) - 1)
+        return pages[len(pages) - 1]
+
+    async def search():
+        return (await cog.search_index(guild)).search("quiet year")
+
+    async def stats():
+        return (await cog.collection_stats(guild)).top_users(5)
+
+    async def by_member():
+        stats = await cog.collection_stats(guild)
+        user_id = stats.top_users(1)[0][0]
+        pages = await cog.listing_pages(guild)
+        found = sorted([await pages.position(key) for key in stats.by_user(user_id)])
+        return StoryPages(guild, [await pages.story(pos) for pos in found[:10]])[0]
+
+    new = iter(list(stories(cog, adds, start=size)))
+
+    async def add():
+        story = next(new)
+        if not (await cog.story_index(guild))[story["key"]]:
+            await cog.append_stories(guild, [story])
+
+    with PeakMemory() as memory:
+        results = [
+            (await timed_async(first_page))[0],
+            (await timed_async(first_page, 10))[0],
+            (await timed_async(last_page))[0],
+            (await timed_async(search))[0],
+            (await timed_async(stats))[0],
+            (await timed_async(stats, 10))[0],
+            (await timed_async(by_member))[0],
+            (await timed_async(add, adds))[0],
+        ]
+    await cog.store.clear(guild)
+    return results, memory
+
+
+async def run(adds):
+    load_cogs()
+    from ffpicker.ffpicker import FFPicker
+    from ffpicker.store import ENGINES
+
+    cog = FFPicker(FakeBot())
+    await cog.initialize()
+    columns = (
+        "first page",
+        "again",
+        "last page",
+        "search",
+        "stats",
+        "again",
+        "by member",
+        "add",
+    )
+    for engine in ENGINES:
+        cog.store.close()
+        cog.store = cog.open_store(engine)
+        print(f"\n{engine} store")
+        print(f"{'stories':>8}" + "".join(f"{c:>12}" for c in columns) + "  (ms)")
+        for size in SIZES:
+            results, memory = await measure(cog, size, adds)
+            row = "".join(f"{r:>12.2f}" for r in results)
+            print(f"{size:>8,}{row}  {memory}")
+    cog.cog_unload()
+    await asyncio.sleep(0)  # Let the unload tasks finish
+
+
+def main(adds=5):
+    asyncio.get_event_loop().run_until_complete(run(adds))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+"""
+Fixtures and helpers shared by the benchmarks
+"""
+import tempfile
+import time
+import tracemalloc
+
+from pathlib import Path
+
+FIXTURES = Path(__file__).parent / "fixtures"
+
+# Fixture name -> the link it stands in for. The fixtures are synthetic:
+# hand-written pages that follow each site's markup, filled with placeholder
+# text, not pages captured from the sites
+PAGES = {
+    "ffn_story.html": "https://www.fanfiction.net/s/5782108/1/The-Quiet-Year",
+    "ffn_author.html": "https://www.fanfiction.net/u/2173458/inkwell-and-ash",
+    "ao3_work.html": "https://archiveofourown.org/works/1234567",
+    "siye_story.html": "http://siye.co.uk/siye/viewstory.php?sid=12345",
+}
+
+# Mobile pages for the same links, read by the mobile fetch strategy
+MOBILE_PAGES = {
+    "ffn_story_mobile.html": PAGES["ffn_story.html"],
+    "ffn_author_mobile.html": PAGES["ffn_author.html"],
+}
+
+# A work whose first page is the adult content warning, see ao3_adult.html
+ADULT_WORK = "https://archiveofourown.org/works/7654321"
+
+
+def timed(func, rounds):
+    start = time.perf_counter()
+    for _ in range(rounds):
+        result = func()
+    return (time.perf_counter() - start) / rounds * 1000, result
+
+
+def percentiles(samples):
+    """
+    Return the 50th, 90th and 99th percentile and the maximum of samples
+    """
+    ordered = sorted(samples)
+    last = len(ordered) - 1
+    return tuple(ordered[round(last * q)] for q in (0.5, 0.9, 0.99, 1))
+
+
+class PeakMemory:
+    """
+    Context manager recording the most memory Python allocated inside it
+    """
+
+    def __enter__(self):
+        tracemalloc.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+    def __str__(self):
+        return f"peak memory {self.peak / 2 ** 20:,.1f} MiB"
+
+
+def load_cogs():
+    """
+    Give Red's Config a throwaway data directory, so the cogs can be
+    imported from a checkout. Red and discord.py must be installed.
+    """
+    from redbot.core import data_manager
+
+    data_manager.basic_config = dict(
+        data_manager.basic_config_default,
+        DATA_PATH=tempfile.mkdtemp(prefix="ffbench-"),
+        STORAGE_TYPE="JSON",
+        STORAGE_DETAILS={},
+    )
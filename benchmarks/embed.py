@@ -0,0 +1,98 @@
+"""
+Time story fetches per site and FFEmbed's on_message end to end, against
+the local stand-in server, and how soon progressive embeds first respond
+
+Run from the repository root with ``python -m benchmarks.embed [latency]``.
+"""
+import aiohttp
+import asyncio
+import sys
+import time
+
+from .common import ADULT_WORK, PAGES, PeakMemory, load_cogs, percentiles
+from .fakes import FakeBot, FakeChannel, FakeGuild, FakeMessage
+from .server import FixtureServer, LocalClient, LocalSession
+from .urls import messages
+
+
+async def fetch_times(session, rounds):
+    from fflib import STRATEGIES, fetch_story, metrics, set_strategy, site_of
+
+    links = dict(PAGES)
+    links["ao3_adult.html"] = ADULT_WORK
+    print(f"{'fixture':<18}{'strategy':<10}{'fetch ms':>10}{'KiB read':>10}")
+    for name, url in links.items():
+        site = site_of(url)
+        for strategy in STRATEGIES[site]:
+            set_strategy(site, strategy)
+            read = metrics.counters["page_bytes", site, strategy]
+            start = time.perf_counter()
+            for _ in range(rounds):
+                await fetch_story(session, url)
+            elapsed = (time.perf_counter() - start) / rounds * 1000
+            read = (metrics.counters["page_bytes", site, strategy] - read) / rounds
+            print(f"{name:<18}{strategy:<10}{elapsed:>10.1f}{read / 1024:>10.1f}")
+        set_strategy(site, "desktop")
+
+
+async def message_latency(cog, corpus, cold, progressive=False):
+    guild = FakeGuild()
+    await cog.config.guild(guild).progressive.set(progressive)
+    samples = []
+    for content in corpus:
+        if cold:
+            cog.cache.clear()
+        # A new channel each time, so no link counts as a repeat
+        message = FakeMessage(content, FakeChannel(guild))
+        start = time.perf_counter()
+        await cog.on_message(message)
+        samples.append((time.perf_counter() - start) * 1000)
+    return samples
+
+
+async def run(latency, rounds, count):
+    load_cogs()
+    from ffembed.ffembed import FFEmbed
+    from fflib import host_limits, http_client, metrics
+
+    async with FixtureServer(latency=latency) as server:
+        async with aiohttp.ClientSession() as session:
+            await fetch_times(LocalSession(session, server), rounds)
+
+            cog = FFEmbed(FakeBot())
+            await cog.initialize()
+            host_limits.configure(1e6, 1e6)  # The stand-in needs no throttling
+            cog.http = LocalClient(session, server)
+            corpus = [m for m in messages(count, link_ratio=1) if "://" in m]
+            print(f"\n{'on_message':<18}{'p50':>8}{'p90':>8}{'p99':>8}{'max':>8}")
+            for label, cold in (("cold cache", True), ("warm cache", False)):
+                with PeakMemory() as memory:
+                    samples = await message_latency(cog, corpus, cold)
+                p50, p90, p99, worst = percentiles(samples)
+                print(
+                    f"{label:<18}{p50:>8.1f}{p90:>8.1f}{p99:>8.1f}{worst:>8.1f}  "
+                    f"ms, {memory}"
+                )
+            # Progressive embeds post placeholders first, then fill them in
+            for stage in ("skeleton", "complete"):
+                metrics.histograms.pop((stage, "ffembed"), None)
+            await message_latency(cog, corpus, True, progressive=True)
+            print(f"\n{'progressive':<18}{'p50':>8}{'p90':>8}{'p99':>8}{'max':>8}")
+            for stage in ("skeleton", "complete"):
+                h = metrics.histograms[stage, "ffembed"]
+                p50, p90, p99 = (h.percentile(q) * 1000 for q in (50, 90, 99))
+                print(
+                    f"{stage:<18}{p50:>8.1f}{p90:>8.1f}{p99:>8.1f}{h.max * 1000:>8.1f}"
+                    "  ms, bucket upper bounds"
+                )
+            print(f"\n{server.requests:,} requests, {server.bytes_sent:,} bytes sent")
+            cog.http = http_client
+            cog.cog_unload()
+
+
+def main(latency=0.05, rounds=10, count=200):
+    asyncio.get_event_loop().run_until_complete(run(latency, rounds, count))
+
+
+if __name__ == "__main__":
+    main(float(sys.argv[1]) if len(sys.argv) > 1 else 0.05)
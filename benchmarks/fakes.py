@@ -0,0 +1,105 @@
+"""
+Just enough of a bot, server, channel and message to drive the cogs
+without connecting to Discord
+"""
+import asyncio
+import fnmatch
+import itertools
+import time
+
+_ids = itertools.count(1000)
+
+
+class FakeUser:
+    def __init__(self, bot=False):
+        self.id = next(_ids)
+        self.bot = bot
+        self.avatar_url = ""
+
+
+class FakeGuild:
+    def __init__(self, name="Benchmarks"):
+        self.id = next(_ids)
+        self.name = name
+        self.icon_url = ""
+
+
+class FakeChannel:
+    """
+    Records what the cog sends, and when
+    """
+
+    def __init__(self, guild):
+        self.id = next(_ids)
+        self.guild = guild
+        self.sent = []
+
+    async def send(self, content=None, **kwargs):
+        self.sent.append((asyncio.get_event_loop().time(), content, kwargs))
+        return FakeSentMessage()
+
+
+class FakeSentMessage:
+    def __init__(self):
+        self.id = next(_ids)
+
+
+class FakeMessage:
+    def __init__(self, content, channel, author=None):
+        self.content = content
+        self.channel = channel
+        self.guild = channel.guild
+        self.author = author or FakeUser()
+
+
+class FakeHTTP:
+    def __init__(self):
+        self.requests = []
+
+    async def request(self, route, **kwargs):
+        self.requests.append((route, kwargs))
+        return {"id": str(next(_ids))}
+
+
+class FakeBot:
+    def __init__(self, prefixes=("!",)):
+        self.loop = asyncio.get_event_loop()
+        self.user = FakeUser(bot=True)
+        self.http = FakeHTTP()
+        self.prefixes = list(prefixes)
+
+    async def get_valid_prefixes(self, guild=None):
+        return self.prefixes
+
+    async def wait_until_ready(self):
+        await asyncio.Event().wait()  # Keeps background tasks idle
+
+
+class FakeRedis:
+    """
+    The few Redis commands the shared story cache uses, kept in memory
+    """
+
+    def __init__(self):
+        self.data = {}
+
+    async def get(self, key):
+        value, expires = self.data.get(key, (None, 0))
+        if expires and time.monotonic() >= expires:
+            del self.data[key]
+            return None
+        return value
+
+    async def set(self, key, value, ex=None):
+        self.data[key] = (value, time.monotonic() + ex if ex else 0)
+
+    async def delete(self, *keys):
+        return sum(self.data.pop(key, None) is not None for key in keys)
+
+    async def scan_iter(self, match="*"):
+        for key in list(self.data):
+            if fnmatch.fnmatchcase(key, match):
+                yield key
+
+    async def close(self):
+        pass
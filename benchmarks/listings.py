@@ -0,0 +1,81 @@
+"""
+Compare adding a whole AO3 series work by work with reading its listing
+
+Adding each work fetches that work's page, while the listing holds every
+work's blurb, 20 to a page. The stand-in server serves the fixture series,
+30 works over two pages, for any listing link and ao3_work.html for any
+work, so the work pages fetched are all the same size.
+
+Run from the repository root with ``python -m benchmarks.listings [latency]``.
+"""
+import aiohttp
+import asyncio
+import sys
+import time
+
+from fflib import fetch_listing, fetch_story, host_limits
+
+from .server import FixtureServer, LocalSession
+
+SERIES = "https://archiveofourown.org/series/424242"
+RATE, BURST = 2.0, 5  # FFEmbed's default rate limit per site
+
+# Fields a blurb has in common with the work page, see parse_AO3_blurb
+SAME_FIELDS = ("link", "author", "author_link", "title", "desc")
+
+
+async def measure(server, load):
+    requests, sent = server.requests, server.bytes_sent
+    start = time.perf_counter()
+    result = await load()
+    elapsed = (time.perf_counter() - start) * 1000
+    requests = server.requests - requests
+    # The least time the default rate limit allows that many requests
+    floor = max(0, requests - BURST) / RATE
+    return result, requests, server.bytes_sent - sent, elapsed, floor
+
+
+async def run(latency):
+    host_limits.configure(1e6, 1e6)  # Rate limited time is worked out instead
+    async with FixtureServer(latency=latency) as server:
+        async with aiohttp.ClientSession() as session:
+            session = LocalSession(session, server)
+
+            async def by_listing():
+                works, _ = await fetch_listing(session, SERIES)
+                return works
+
+            async def by_work():
+                return [await fetch_story(session, w["link"]) for w in listed]
+
+            listed, *listing = await measure(server, by_listing)
+            pages, *each = await measure(server, by_work)
+
+    print(f"{len(listed)} works in the series")
+    print(f"{'':<10}{'requests':>10}{'KiB sent':>10}{'ms':>10}{'rate limit s':>14}")
+    for label, (requests, sent, elapsed, floor) in (
+        ("by work", each),
+        ("listing", listing),
+    ):
+        print(
+            f"{label:<10}{requests:>10,}{sent / 1024:>10.1f}{elapsed:>10.1f}"
+            f"{floor:>14.1f}"
+        )
+    blurb, page = listed[0], pages[0]
+    mismatches = [field for field in SAME_FIELDS if blurb[field] != page[field]]
+    # The blurb's footer starts at the status, without the publishing date
+    if blurb["footer"].split(" ∙ ")[1:] != page["footer"].split(" ∙ ")[2:]:
+        mismatches.append("footer")
+    if mismatches:
+        print(f"\nThe first work's blurb differs in {', '.join(mismatches)}")
+    else:
+        print("\nThe first work's blurb matches its page")
+    return len(mismatches)
+
+
+def main(latency=0.05):
+    return asyncio.get_event_loop().run_until_complete(run(latency))
+
+
+if __name__ == "__main__":
+    sys.exit(main(float(sys.argv[1]) if len(sys.argv) > 1 else 0.05))
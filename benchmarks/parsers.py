@@ -0,0 +1,41 @@
+"""
+Time each parser backend on the synthetic fixtures and check that every
+backend produces the same metadata, and that mobile pages give the same
+metadata as the desktop ones
+
+Run from the repository root with ``python -m benchmarks.parsers``.
+"""
+import sys
+
+from fflib import parsers
+
+from .common import FIXTURES, MOBILE_PAGES, PAGES, timed
+
+
+def main(rounds=50):
+    mismatches = 0
+    desktop = {}
+    print(f"{'fixture':<24}{'backend':<14}{'build ms':>10}{'extract ms':>12}")
+    for pages, strategy in ((PAGES, "desktop"), (MOBILE_PAGES, "mobile")):
+        for name, url in pages.items():
+            html = (FIXTURES / name).read_text()
+            results = {}
+            for backend in parsers.BACKENDS:
+                build, page = timed(lambda: parsers.make_soup(html, backend), rounds)
+                extract, results[backend] = timed(
+                    lambda: parsers.parse_story(page, url, strategy), rounds
+                )
+                print(f"{name:<24}{backend:<14}{build:>10.2f}{extract:>12.2f}")
+            if len({repr(result) for result in results.values()}) > 1:
+                mismatches += 1
+                print(f"{name}: backends disagree")
+            if strategy == "desktop":
+                desktop[url] = results
+            elif results != desktop[url]:
+                mismatches += 1
+                print(f"{name}: differs from the desktop page")
+    return mismatches
+
+
+if __name__ == "__main__":
+    sys.exit(main())
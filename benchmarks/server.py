@@ -0,0 +1,136 @@
+"""
+Local stand-in for the story sites, serving the synthetic fixtures
+
+Requests are routed by the original host and path, so any story ID on a
+supported site gets the matching fixture. The server waits latency
+seconds before the first byte and streams the page in chunks, so
+partial downloads stop early the way they do against the real sites.
+
+Run it on its own with ``python -m benchmarks.server [port] [latency]``
+and point a session at it through ``LocalSession``.
+"""
+import asyncio
+import sys
+
+from aiohttp import web
+from urllib.parse import urlparse
+
+from fflib import story_ref
+
+from .common import ADULT_WORK, FIXTURES
+
+CHUNK_SIZE = 8 * 1024
+
+
+def fixture_for(host, path, query=""):
+    if "fanfiction.net" in host:
+        page = "ffn_author" if path.startswith("/u/") else "ffn_story"
+        return page + ("_mobile.html" if host.startswith("m.") else ".html")
+    elif "archiveofourown.org" in host:
+        ref = story_ref(f"https://{host}{path}")
+        if ref is not None and ref.listing:
+            # Every listing is the fixture series, whose second page is last
+            return "ao3_series_2.html" if "page=" in query else "ao3_series.html"
+        if path.rstrip("/") == urlparse(ADULT_WORK).path:
+            return "ao3_adult.html"
+        return "ao3_work.html"
+    elif "siye.co.uk" in host:
+        return "siye_story.html"
+    return None
+
+
+class FixtureServer:
+    """
+    Async context manager running the stand-in server on localhost
+    """
+
+    def __init__(self, port=0, latency=0.05):
+        self.port = port
+        self.latency = latency
+        self.requests = 0
+        self.bytes_sent = 0
+        self._pages = {p.name: p.read_bytes() for p in FIXTURES.glob("*.html")}
+        self._runner = None
+
+    @property
+    def base_url(self):
+        return f"http://127.0.0.1:{self.port}"
+
+    async def handle(self, request):
+        self.requests += 1
+        name = fixture_for(
+            request.match_info["host"],
+            "/" + request.match_info["path"],
+            request.query_string,
+        )
+        if name is None:
+            raise web.HTTPNotFound()
+        await asyncio.sleep(self.latency)
+        response = web.StreamResponse(
+            headers={"Content-Type": "text/html; charset=utf-8"}
+        )
+        await response.prepare(request)
+        page = self._pages[name]
+        try:
+            for start in range(0, len(page), CHUNK_SIZE):
+                await response.write(page[start : start + CHUNK_SIZE])
+                self.bytes_sent += min(CHUNK_SIZE, len(page) - start)
+            await response.write_eof()
+        except ConnectionResetError:
+            pass  # The client had read enough
+        return response
+
+    async def __aenter__(self):
+        app = web.Application()
+        app.router.add_get("/{host}/{path:.*}", self.handle)
+        self._runner = web.AppRunner(app)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, "127.0.0.1", self.port)
+        await site.start()
+        self.port = self._runner.addresses[0][1]
+        return self
+
+    async def __aexit__(self, *exc):
+        await self._runner.cleanup()
+
+
+class LocalSession:
+    """
+    Wraps an aiohttp session so requests for the story sites go to a
+    FixtureServer instead
+    """
+
+    def __init__(self, session, server):
+        self.session = session
+        self.server = server
+
+    def get(self, url, **kwargs):
+        parts = urlparse(url)
+        local = f"{self.server.base_url}/{parts.netloc}{parts.path}"
+        if parts.query:
+            local += "?" + parts.query
+        return self.session.get(local, **kwargs)
+
+
+class LocalClient:
+    """
+    Stands in for fflib's http_client on a cog, handing out a LocalSession
+    """
+
+    def __init__(self, session, server):
+        self.session = LocalSession(session, server)
+
+
+async def serve(port, latency):
+    async with FixtureServer(port, latency) as server:
+        print(f"Serving fixtures on {server.base_url} with {latency}s latency")
+        await asyncio.Event().wait()
+
+
+if __name__ == "__main__":
+    port = int(sys.argv[1]) if len(sys.argv) > 1 else 8080
+    latency = float(sys.argv[2]) if len(sys.argv) > 2 else 0.05
+    try:
+        asyncio.get_event_loop().run_until_complete(serve(port, latency))
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,93 @@
+"""
+Count the story fetches a shared metadata cache saves across processes
+
+Worker processes resolve the same links one after another through a
+SQLite cache file in a throwaway directory, then two caches in this
+process share the in-memory Redis stand-in. Fetches are simulated with a
+short sleep, so the times show what the shared cache saves rather than
+network time.
+
+Run from the repository root with ``python -m benchmarks.sharedcache [processes]``.
+"""
+import asyncio
+import sys
+import tempfile
+import time
+
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+from fflib import MetadataCache, RedisBackend, SQLiteBackend, make_soup, parse_story
+
+from .common import FIXTURES, PAGES
+from .fakes import FakeRedis
+
+LINKS = 500
+FETCH_TIME = 0.02  # Seconds a simulated fetch takes
+
+
+def template():
+    name = "ffn_story.html"
+    return parse_story(make_soup((FIXTURES / name).read_text()), PAGES[name])
+
+
+async def resolve(cache, metadata):
+    """
+    Resolve every link through cache, returning the fetches made and the
+    time taken in milliseconds
+    """
+    fetches = 0
+
+    async def load():
+        nonlocal fetches
+        fetches += 1
+        await asyncio.sleep(FETCH_TIME)
+        return metadata
+
+    start = time.perf_counter()
+    await asyncio.gather(
+        *(cache.get_or_load(("ffn", str(n)), load) for n in range(LINKS))
+    )
+    return fetches, (time.perf_counter() - start) * 1000
+
+
+def worker(path):
+    cache = MetadataCache()
+    cache.use_shared(SQLiteBackend(path))
+    loop = asyncio.new_event_loop()
+    fetches, elapsed = loop.run_until_complete(resolve(cache, template()))
+    loop.close()
+    cache.shared.close()
+    return fetches, cache.stats["shared_hits"], elapsed
+
+
+def print_row(label, fetches, hits, elapsed):
+    print(f"{label:<14}{fetches:>10,}{hits:>12,}{elapsed:>12.1f}")
+
+
+def main(processes=4):
+    header = f"{'':<14}{'fetches':>10}{'shared hits':>12}{'ms':>12}"
+    with tempfile.TemporaryDirectory() as tmp:
+        path = Path(tmp) / "metadata.db"
+        print(f"SQLite, {LINKS:,} links\n{header}")
+        for n in range(processes):
+            # A fresh process each time, so nothing is cached locally
+            with ProcessPoolExecutor(max_workers=1) as pool:
+                result = pool.submit(worker, path).result()
+            print_row(f"process {n + 1}", *result)
+
+    async def redis():
+        client = FakeRedis()
+        metadata = template()
+        print(f"\nRedis stand-in, {LINKS:,} links\n{header}")
+        for n in range(2):
+            cache = MetadataCache()
+            cache.use_shared(RedisBackend(client=client))
+            fetches, elapsed = await resolve(cache, metadata)
+            print_row(f"instance {n + 1}", fetches, cache.stats["shared_hits"], elapsed)
+
+    asyncio.get_event_loop().run_until_complete(redis())
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 4)
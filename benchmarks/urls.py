@@ -0,0 +1,109 @@
+"""
+Measure how fast story links are pulled out of chat messages
+
+The shared extractor is timed against the per-cog regex it replaced, on
+ordinary chat and on long messages packed with links.
+
+Run from the repository root with ``python -m benchmarks.urls``.
+"""
+import random
+import re
+import time
+
+from fflib import find_stories
+
+from .common import PAGES
+
+CHATTER = (
+    "has anyone read the new chapter yet",
+    "lol no, I'm still on the last one",
+    "see https://example.com/some/page for the schedule",
+    "the quiet year is so good",
+)
+
+LINKS = list(PAGES.values()) + [
+    "https://m.fanfiction.net/s/5782108/3/",
+    "https://archiveofourown.org/works/1234567/chapters/2345678",
+]
+
+# Links to fill in with a story ID, for messages where few links repeat
+TEMPLATES = (
+    "https://www.fanfiction.net/s/{}/4/The-Quiet-Year",
+    "https://m.fanfiction.net/s/{}/",
+    "https://www.fanfiction.net/u/{}/inkwell-and-ash",
+    "https://archiveofourown.org/works/{}",
+    "https://archiveofourown.org/works/{}/chapters/2345678",
+    "http://siye.co.uk/siye/viewstory.php?sid={}&chapter=2",
+)
+
+# FFEmbed's parse_url before the extractor was shared, for comparison
+LEGACY_RE = re.compile(
+    r"https?://(?:www.)?(?:(?:m.)?fanfiction.net/"
+    r"(?:(?:(?:s|u)/\d+/?)|~)(?:[a-zA-Z]|[0-9]|[$-_@.&+]|[!*\(\),])*|"
+    r"archiveofourown.org/works/\d+(?:/chapters/\d+)?|"
+    r"siye.co.uk/(?:siye/)?viewstory.php\?sid=\d+(?:&chapter=\d+)?)"
+)
+
+
+def legacy(message):
+    urls = LEGACY_RE.findall(message)
+    for i, url in enumerate(urls):
+        url = url.replace("//m.", "//")
+        url = url.replace("https", "http") if "siye" in url else url
+        if re.search(r"fanfiction.net/s/\d+", url):
+            sp = url.split("/")
+            url = "/".join(sp[:5] + ["1"] + sp[6:])
+        urls[i] = url
+    return urls
+
+
+def messages(count, link_ratio=0.2, seed=0):
+    """
+    Build a repeatable mix of ordinary chat and messages with story links
+    """
+    rng = random.Random(seed)
+    result = []
+    for _ in range(count):
+        words = rng.choice(CHATTER)
+        if rng.random() < link_ratio:
+            words += " " + " ".join(rng.sample(LINKS, rng.randint(1, 3)))
+        result.append(words)
+    return result
+
+
+def link_heavy(count, stories, links=40, seed=0):
+    """
+    Build long messages, such as pasted reading lists, full of links to
+    up to the given number of different stories
+    """
+    rng = random.Random(seed)
+    return [
+        "\n".join(
+            f"{n + 1}. {rng.choice(TEMPLATES).format(rng.randrange(stories))} "
+            f"- {rng.choice(CHATTER)}"
+            for n in range(links)
+        )
+        for _ in range(count)
+    ]
+
+
+def throughput(extract, corpus):
+    start = time.perf_counter()
+    found = sum(len(extract(message)) for message in corpus)
+    return len(corpus) / (time.perf_counter() - start), found
+
+
+def main(count=100000):
+    print(f"{'corpus':<14}{'extractor':<12}{'messages/s':>14}{'links':>10}")
+    for label, corpus in (
+        ("chat", messages(count)),
+        ("link heavy", link_heavy(count // 100, 100)),
+        ("all distinct", link_heavy(count // 100, 10 ** 9)),
+    ):
+        for name, extract in (("legacy", legacy), ("shared", find_stories)):
+            rate, found = throughput(extract, corpus)
+            print(f"{label:<14}{name:<12}{rate:>14,.0f}{found:>10,}")
+
+
+if __name__ == "__main__":
+    main()
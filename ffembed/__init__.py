@@ -1,5 +1,6 @@
 from .ffembed import FFEmbed
 
-def setup(bot):
+async def setup(bot):
     cog = FFEmbed(bot)
+    await cog.initialize()
     bot.add_cog(cog)
@@ -0,0 +1,107 @@
+import asyncio
+import time
+
+from collections import OrderedDict
+
+MAX_RECENT = 256  # Story keys remembered per channel
+
+
+class RecentLinks:
+    """
+    Stories embedded in each channel recently, and the message that
+    showed them
+    """
+
+    def __init__(self, clock=time.monotonic):
+        self._clock = clock
+        self._channels = {}
+
+    def get(self, channel_id, key, window):
+        """
+        Return the ID of the message that showed the story within the
+        last window seconds, None if it is still being sent, or False if
+        the story was not shown
+        """
+        seen = self._channels.get(channel_id, {}).get(key)
+        if seen is None or self._clock() - seen[0] > window:
+            return False
+        return seen[1]
+
+    def claim(self, channel_id, key):
+        """
+        Note that the story is about to be shown in the channel
+        """
+        seen = self._channels.setdefault(channel_id, OrderedDict())
+        seen.pop(key, None)
+        seen[key] = (self._clock(), None)
+        while len(seen) > MAX_RECENT:
+            seen.popitem(last=False)
+
+    def shown(self, channel_id, key, message_id):
+        seen = self._channels.get(channel_id, {})
+        if key in seen:
+            seen[key] = (seen[key][0], message_id)
+
+    def forget(self, channel_id, key):
+        self._channels.get(channel_id, {}).pop(key, None)
+
+
+class SendQueue:
+    """
+    Per-channel queue that merges embeds into as few messages as possible
+
+    The first embeds for a channel go out right away. Embeds from messages
+    that arrive while a send to the channel is still in flight wait for it
+    and then go out together, so a burst of links costs a handful of sends
+    rather than one per message.
+    """
+
+    def __init__(self, send, linger=0):
+        self._send = send
+        self.linger = linger
+        self._pending = {}
+        self._workers = {}
+
+    async def put(self, channel, embeds):
+        """
+        Queue embeds for a channel and return the ID of the message each
+        one was sent in
+        """
+        loop = asyncio.get_event_loop()
+        futures = [loop.create_future() for _ in embeds]
+        self._pending.setdefault(channel.id, []).extend(zip(embeds, futures))
+        if channel.id not in self._workers:
+            self._workers[channel.id] = asyncio.ensure_future(self._drain(channel))
+        return await asyncio.gather(*futures)
+
+    async def _drain(self, channel):
+        try:
+            if self.linger:
+                await asyncio.sleep(self.linger)
+            while self._pending.get(channel.id):
+                items = self._pending.pop(channel.id)
+                try:
+                    ids = await self._send(channel, [em for em, _ in items])
+                except asyncio.CancelledError:
+                    for _, future in items:
+                        future.cancel()
+                    raise
+                except Exception as e:
+                    for _, future in items:
+                        if not future.done():
+                            future.set_exception(e)
+                else:
+                    for (_, future), message_id in zip(items, ids):
+                        if not future.done():
+                            future.set_result(message_id)
+        finally:
+            self._workers.pop(channel.id, None)
+
+    def close(self):
+        for worker in self._workers.values():
+            worker.cancel()
+        for items in self._pending.values():
+            for _, future in items:
+                future.cancel()
+        self._workers.clear()
+        self._pending.clear()
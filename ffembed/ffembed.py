@@ -1,31 +1,122 @@
-import aiohttp
 import asyncio
 import discord
-import re
+import io
+import logging
+import sqlite3
+import time
 
-from bs4 import BeautifulSoup
+from collections import OrderedDict
+from discord.http import Route
+from fflib import (
+    SITE_ICONS,
+    SITE_NAMES,
+    STRATEGIES,
+    StoryNotFound,
+    fetch_listing,
+    fetch_story,
+    find_stories,
+    get_strategy,
+    host_limits,
+    http_client,
+    metadata_cache,
+    metrics,
+    open_backend,
+    parse_pool,
+    set_strategy,
+    story_key,
+    strategy_stats,
+)
 from redbot.core import checks, commands, Config
+from redbot.core.utils.chat_formatting import box, humanize_timedelta, pagify
+from urllib.parse import urlparse
 
-__version__ = "1.1.5"
+from .channels import RecentLinks, SendQueue
+
+__version__ = "1.13.2"
+
+log = logging.getLogger("red.ffembed")
 
 BaseCog = getattr(commands, "Cog", object)
 
+# Discord limits for a single message
+MAX_EMBEDS = 10
+MAX_EMBED_CHARS = 6000
+
+# Works shown for an AO3 listing link, leaving room for a note on the rest
+LISTING_EMBEDS = MAX_EMBEDS - 1
+
+# discord.py 1.x cannot send several embeds through Messageable.send
+MULTI_EMBED_SEND = discord.version_info.major >= 2
+
+# A message without one of these cannot hold a supported link
+HOSTS = ("fanfiction.net", "archiveofourown.org", "siye.co.uk")
+
+REPEAT_MODES = ("skip", "link")
+
 
 class FFEmbed(BaseCog):
     """
     Show FanFiction, AO3, and SIYE story info in an embed message
+
+    Links to AO3 series, collections and user's works show the first works
+    listed.
     """
 
     def __init__(self, bot):
         self.bot = bot
-        self.session = aiohttp.ClientSession()
+        self.http = http_client
+        self.http.acquire()
+        self.cache = metadata_cache
+        self.parse_pool = parse_pool
+        self.parse_pool.acquire()
         self.config = Config.get_conf(
             self, identifier=77232917, force_registration=True
         )
-        self.config.register_guild(enabled=True, disabled_channels=[])
+        self.config.register_global(
+            link_concurrency=5,
+            host_concurrency=2,
+            host_rate=2.0,
+            host_burst=5,
+            pool_kind="thread",
+            pool_workers=2,
+            http_settings={},
+            shared_cache={},
+            fetch_strategies={},
+        )
+        self.config.register_guild(
+            enabled=True,
+            disabled_channels=[],
+            repeat_window=300,
+            repeat_mode="link",
+            repeat_channels={},
+            progressive=False,
+        )
+        self._host_slots = {}
+        self._settings = {}
+        self.recent = RecentLinks()
+        self.send_queue = SendQueue(self.send_embeds)
+
+    async def initialize(self):
+        self.parse_pool.configure(
+            await self.config.pool_kind(), await self.config.pool_workers()
+        )
+        host_limits.configure(
+            await self.config.host_rate(), await self.config.host_burst()
+        )
+        self.http.configure(**await self.config.http_settings())
+        for site, strategy in (await self.config.fetch_strategies()).items():
+            set_strategy(site, strategy)
+        shared = await self.config.shared_cache()
+        if shared and self.cache.shared is None:
+            try:
+                self.cache.use_shared(open_backend(**shared))
+            except Exception:
+                log.exception("Opening the shared story cache failed")
 
     def cog_unload(self):
-        self.bot.loop.create_task(self.session.close())
+        self.send_queue.close()
+        self.http.release()
+        self.parse_pool.release()
 
     @checks.is_owner()
     @commands.guild_only()
@@ -48,6 +139,7 @@ class FFEmbed(BaseCog):
             await ctx.send("No confirmation received. No changes were made.")
         else:
             await self.config.guild(ctx.guild).clear()
+            self._settings.pop(ctx.guild.id, None)
             await ctx.send("FFEmbed's config for this server has been reset.")
 
     @checks.is_owner()
@@ -68,8 +160,10 @@ class FFEmbed(BaseCog):
         else:
             channels = "None"
 
+        progressive = await self.config.guild(ctx.guild).progressive()
         em = discord.Embed(description=desc, color=0x7289DA)
         em.add_field(name="Disabled In Channel(s)", value=channels)
+        em.add_field(name="Progressive Embeds", value="On" if progressive else "Off")
         em.set_author(name="FFEmbed Config", icon_url=self.bot.user.avatar_url)
         await ctx.send(embed=em)
 
@@ -81,6 +175,7 @@ class FFEmbed(BaseCog):
         """
         toggle = not await self.config.guild(ctx.guild).enabled()
         await self.config.guild(ctx.guild).enabled.set(toggle)
+        self._settings.pop(ctx.guild.id, None)
         if toggle:
             await ctx.send("FFEmbed is now enabled in this server.")
         else:
@@ -97,143 +192,467 @@ class FFEmbed(BaseCog):
             if channel.id in channels:
                 channels.remove(channel.id)
                 await self.config.guild(ctx.guild).disabled_channels.set(channels)
+                self._settings.pop(ctx.guild.id, None)
                 await ctx.send(f"FFEmbed is now enabled in {channel.mention}.")
             else:
                 channels.append(channel.id)
                 await self.config.guild(ctx.guild).disabled_channels.set(channels)
+                self._settings.pop(ctx.guild.id, None)
                 await ctx.send(f"FFEmbed is now disabled in {channel.mention}.")
         else:
             await ctx.send("Invalid channel. No changes were made.")
 
-    def parse_url(self, message):
-        url_regex = (
-            r"https?://(?:www.)?(?:(?:m.)?fanfiction.net/"
-            r"(?:(?:(?:s|u)/\d+/?)|~)(?:[a-zA-Z]|[0-9]|[$-_@.&+]|[!*\(\),])*|"
-            r"archiveofourown.org/works/\d+(?:/chapters/\d+)?|"
-            r"siye.co.uk/(?:siye/)?viewstory.php\?sid=\d+(?:&chapter=\d+)?)"
-        )
-        urls = re.findall(url_regex, message)
-        for i, url in enumerate(urls):
-            url = url.replace("//m.", "//")
-            # Handle invalid certificate for SIYE
-            url = url.replace("https", "http") if "siye" in url else url
-            # Redirect FanFiction stories to chapter 1
-            if re.search(r"fanfiction.net/s/\d+", url):
-                sp = url.split("/")
-                url = "/".join(sp[:5] + ["1"] + sp[6:])
-            urls[i] = url
-        return urls
-
-    async def fetch_url(self, url):
-        # AO3 presents warning page for NSFW-tagged stories
-        if "archiveofourown" in url:
-            url = url + "?view_adult=true"
-        async with self.session.get(url, timeout=8) as r:
-            html = await r.text()
-            page = BeautifulSoup(html, "html.parser")
-        if "archiveofourown" in url and page.select("p[class='message footnote']"):
-            chapter = page.select("ul[class='actions']")[0].find("a")["href"]
-            url = "https://archiveofourown.org" + chapter
-            async with self.session.get(url, timeout=8) as r:
-                html = await r.text()
-                page = BeautifulSoup(html, "html.parser")
-        return page
-
-    def parse_FanFiction_author(self, page, url):
-        div = page.find(id="content_wrapper_inner")
-        thumbnail = div.find(id="bio").img
-        author = div.span
-        desc = page.find("meta", attrs={"name": "description"})["content"]
-        footer = div.find_all("td", {"colspan": "2"})[2]
-        footer = footer.get_text().replace("id", "ID")
-        footer = footer[:6] + ":" + footer[6:]
-        return {
-            "link": None,
-            "icon": "https://i.imgur.com/0eUBQHu.png",
-            "thumbnail": "https:" + thumbnail["data-original"] if thumbnail else None,
-            "author": author.get_text(strip=True),
-            "author_link": url,
-            "title": None,
-            "desc": desc,
-            "footer": " ∙ ".join(footer.split(", ")),
-        }
-
-    def parse_FanFiction(self, page, url):
-        base = "https://fanfiction.net"
-        div = page.find(id="profile_top")
-        thumbnail = div.find("img", attrs={"class": "cimage"})
-        author = div.find("a", attrs={"class": "xcontrast_txt"})
-        title = div.find("b", attrs={"class": "xcontrast_txt"})
-        desc = div.find("div", attrs={"class": "xcontrast_txt"})
-        footer = div.find("span", attrs={"class": "xgray xcontrast_txt"})
-        footer = ": ".join(x.strip() for x in footer.get_text().split(":"))
-        return {
-            "link": url,
-            "icon": "https://i.imgur.com/0eUBQHu.png",
-            "thumbnail": "https:" + thumbnail["src"] if thumbnail else None,
-            "author": author.get_text(strip=True),
-            "author_link": base + author["href"],
-            "title": title.get_text(strip=True),
-            "desc": desc.get_text(strip=True),
-            "footer": " ∙ ".join(footer.split("-")[:-1]),
-        }
-
-    def parse_AO3(self, page, url):
-        base = "https://archiveofourown.org"
-        author = page.find("a", attrs={"rel": "author"})
-        title = page.find("h2", attrs={"class": "title heading"})
-        desc = page.find("div", attrs={"class": "summary module"})
-        desc = "Summary not specified." if desc is None else desc.p.get_text(strip=True)
-        date = " ".join(x.get_text() for x in page.find_all(class_="published"))
-        status = " ".join(x.get_text() for x in page.find_all(class_="status"))
-        chapters = " ".join(x.get_text() for x in page.find_all(class_="chapters"))
-        words = f"Words: {int(page.find_all(class_='words')[1].get_text()):,}"
-        kudos = f"Kudos: {int(page.find_all(class_='kudos')[1].get_text()):,}"
-        hits = f"Hits: {int(page.find_all(class_='hits')[1].get_text()):,}"
-        return {
-            "link": url,
-            "icon": "https://i.imgur.com/oJtk1Gp.png",
-            "thumbnail": None,
-            "author": author.get_text(strip=True),
-            "author_link": base + author["href"],
-            "title": title.get_text(strip=True),
-            "desc": desc,
-            "footer": f"{date} ∙ {status} ∙ {chapters} ∙ {words} ∙ {kudos} ∙ {hits}",
-        }
-
-    def parse_SIYE(self, page, url):
-        base = "http://siye.co.uk"
-        table_cell = page.find_all("td", attrs={"align": "left"})[1].get_text()
-        rows = table_cell.strip().split("\n")
-        rows = [row for row in rows if ":" in row]  # Handle completed story
-        author = page.find("font").next_sibling.next_sibling
-        title = page.find("h3")
-        desc = rows[6][9:]
-        category = rows[0]
-        characters = rows[1][:11] + " " + rows[1][11:]
-        genres = rows[2]
-        rating = rows[4]
-        return {
-            "link": url,
-            "icon": "https://i.imgur.com/TXRYIBN.jpg",
-            "thumbnail": None,
-            "author": author.get_text(strip=True),
-            "author_link": base + "/" + author["href"],
-            "title": title.get_text(strip=True),
-            "desc": desc,
-            "footer": f"{category} ∙ {characters} ∙ {genres} ∙ {rating}",
-        }
-
-    def parse(self, page, url):
-        if "fanfiction" in url:
-            if "/s/" in url:
-                return self.parse_FanFiction(page, url)
+    @commands.guild_only()
+    @toggle.command(name="progressive")
+    async def toggle_progressive(self, ctx):
+        """
+        Post a placeholder embed for each link straight away and fill it in
+        once the story info arrives
+        """
+        toggle = not await self.config.guild(ctx.guild).progressive()
+        await self.config.guild(ctx.guild).progressive.set(toggle)
+        self._settings.pop(ctx.guild.id, None)
+        if toggle:
+            await ctx.send("Progressive embeds are now on in this server.")
+        else:
+            await ctx.send("Progressive embeds are now off in this server.")
+
+    @checks.is_owner()
+    @commands.guild_only()
+    @commands.group(name="ffrepeat", invoke_without_command=True)
+    async def repeat(self, ctx):
+        """
+        Show how FFEmbed handles a story linked again soon after its embed
+        """
+        conf = await self.config.guild(ctx.guild).all()
+        window = conf["repeat_window"]
+        if window:
+            desc = (
+                f"A story linked again within {window:,} seconds of its embed "
+                "in the same channel is "
+            )
+            if conf["repeat_mode"] == "link":
+                desc += "answered with a link to the earlier embed."
             else:
-                return self.parse_FanFiction_author(page, url)
-        elif "archiveofourown" in url:
-            return self.parse_AO3(page, url)
-        elif "siye" in url:
-            return self.parse_SIYE(page, url)
+                desc += "skipped."
+        else:
+            desc = "Every story link gets an embed."
+
+        channels = []
+        for channel_id, seconds in conf["repeat_channels"].items():
+            channel = ctx.guild.get_channel(int(channel_id))
+            if channel:
+                channels.append(f"{channel.mention}: {seconds:,} seconds")
+
+        em = discord.Embed(description=desc, color=0x7289DA)
+        em.add_field(name="Channel Windows", value="\n".join(channels) or "None")
+        em.set_author(name="FFEmbed Repeats", icon_url=self.bot.user.avatar_url)
+        await ctx.send(embed=em)
+
+    @commands.guild_only()
+    @repeat.command(name="window")
+    async def repeat_window(
+        self, ctx, seconds: int, channel: discord.TextChannel = None
+    ):
+        """
+        Set how long a story's embed covers later links to it
+
+        Give a channel to set a window for that channel only. A window of 0
+        embeds every link.
+        """
+        if seconds < 0:
+            await ctx.send("Window cannot be negative.")
+            return
+        if channel is None:
+            await self.config.guild(ctx.guild).repeat_window.set(seconds)
+            where = "this server"
+        else:
+            async with self.config.guild(ctx.guild).repeat_channels() as windows:
+                windows[str(channel.id)] = seconds
+            where = channel.mention
+        self._settings.pop(ctx.guild.id, None)
+        await ctx.send(f"The repeat window in {where} is now {seconds:,} seconds.")
+
+    @commands.guild_only()
+    @repeat.command(name="clear")
+    async def repeat_clear(self, ctx, channel: discord.TextChannel):
+        """
+        Make a channel use the server's repeat window again
+        """
+        async with self.config.guild(ctx.guild).repeat_channels() as windows:
+            windows.pop(str(channel.id), None)
+        self._settings.pop(ctx.guild.id, None)
+        await ctx.send(f"{channel.mention} now uses the server's repeat window.")
+
+    @commands.guild_only()
+    @repeat.command(name="mode")
+    async def repeat_mode(self, ctx, mode: str):
+        """
+        Set whether repeated links are skipped or get a link to the earlier
+        embed (skip or link)
+        """
+        mode = mode.lower()
+        if mode not in REPEAT_MODES:
+            await ctx.send("Mode must be skip or link. No changes were made.")
+            return
+        await self.config.guild(ctx.guild).repeat_mode.set(mode)
+        self._settings.pop(ctx.guild.id, None)
+        await ctx.invoke(self.repeat)
+
+    @checks.is_owner()
+    @commands.group(name="fflimit", invoke_without_command=True)
+    async def limit(self, ctx):
+        """
+        Show how many story links FFEmbed resolves at once
+        """
+        links = await self.config.link_concurrency()
+        hosts = await self.config.host_concurrency()
+        em = discord.Embed(color=0x7289DA)
+        em.add_field(name="Links Per Message", value=f"{links:,}")
+        em.add_field(name="Requests Per Site", value=f"{hosts:,}")
+        em.add_field(
+            name="Site Rate",
+            value=f"{host_limits.rate:g}/s, bursts of {host_limits.burst:,}",
+        )
+        unhealthy = host_limits.unhealthy()
+        if unhealthy:
+            em.add_field(
+                name="Unhealthy Sites",
+                value="\n".join(f"{h} ({s})" for h, s in unhealthy.items()),
+                inline=False,
+            )
+        em.set_author(name="FFEmbed Limits", icon_url=self.bot.user.avatar_url)
+        await ctx.send(embed=em)
+
+    @checks.is_owner()
+    @limit.command(name="links")
+    async def limit_links(self, ctx, limit: int):
+        """
+        Set how many links in one message are resolved at once
+        """
+        if limit < 1:
+            await ctx.send("Limit must be a positive integer.")
+            return
+        await self.config.link_concurrency.set(limit)
+        await ctx.send(f"Up to {limit:,} links per message will be resolved at once.")
+
+    @checks.is_owner()
+    @limit.command(name="site")
+    async def limit_site(self, ctx, limit: int):
+        """
+        Set how many requests may be open to one site at once
+        """
+        if limit < 1:
+            await ctx.send("Limit must be a positive integer.")
+            return
+        await self.config.host_concurrency.set(limit)
+        self._host_slots.clear()
+        await ctx.send(f"Up to {limit:,} requests per site will be made at once.")
+
+    @checks.is_owner()
+    @limit.command(name="rate")
+    async def limit_rate(self, ctx, rate: float, burst: int = 5):
+        """
+        Set how many requests per second each site gets, shared with FFPicker
+        """
+        if rate <= 0 or burst < 1:
+            await ctx.send("Rate and burst must be positive.")
+            return
+        await self.config.host_rate.set(rate)
+        await self.config.host_burst.set(burst)
+        host_limits.configure(rate, burst)
+        await ctx.send(
+            f"Each site will get {rate:g} requests per second, "
+            f"in bursts of up to {burst:,}."
+        )
+
+    @checks.is_owner()
+    @commands.group(name="ffpool", invoke_without_command=True)
+    async def pool(self, ctx):
+        """
+        Show the pool that parses story pages off the event loop
+        """
+        if self.parse_pool.workers:
+            desc = (
+                f"Story pages are parsed in a {self.parse_pool.kind} pool "
+                f"with {self.parse_pool.workers:,} worker(s)."
+            )
+        else:
+            desc = "Story pages are parsed on the event loop."
+        await ctx.send(desc)
+
+    @checks.is_owner()
+    @pool.command(name="set")
+    async def pool_set(self, ctx, kind: str, workers: int):
+        """
+        Set the parse pool kind (thread or process) and size
+
+        A size of 0 parses pages on the event loop.
+        """
+        kind = kind.lower()
+        try:
+            self.parse_pool.configure(kind, workers)
+        except ValueError:
+            await ctx.send(
+                "Pool kind must be thread or process, and size cannot be "
+                "negative. No changes were made."
+            )
+            return
+        await self.config.pool_kind.set(kind)
+        await self.config.pool_workers.set(workers)
+        await ctx.invoke(self.pool)
+
+    @checks.is_owner()
+    @commands.group(name="ffhttp", invoke_without_command=True)
+    async def http_info(self, ctx):
+        """
+        Show the HTTP client settings shared by FFEmbed and FFPicker
+        """
+        em = discord.Embed(color=0x7289DA)
+        for name, value in self.http.settings.items():
+            em.add_field(name=name, value=f"{value:,}")
+        em.set_author(name="FFEmbed HTTP Client", icon_url=self.bot.user.avatar_url)
+        await ctx.send(embed=em)
+
+    @checks.is_owner()
+    @http_info.command(name="set")
+    async def http_set(self, ctx, setting: str, value: int):
+        """
+        Change an HTTP client setting
+
+        Timeouts, keepalive and dns_ttl are in seconds, limits are open
+        connections. Requests already running finish on the old settings.
+        """
+        try:
+            self.http.configure(**{setting: value})
+        except ValueError as e:
+            await ctx.send(f"{e} No changes were made.")
+            return
+        async with self.config.http_settings() as settings:
+            settings[setting] = value
+        await ctx.invoke(self.http_info)
+
+    @checks.is_owner()
+    @http_info.command(name="strategy")
+    async def http_strategy(self, ctx, site: str = None, strategy: str = None):
+        """
+        Show or choose how each site's story info is fetched
+
+        The mobile strategy reads FanFiction's lighter mobile pages, and
+        fetches the desktop page instead whenever one is missing anything.
+        Compare fetch times, page sizes and fallbacks here before choosing.
+        """
+        if site is None:
+            lines = [
+                f"{'Site':<12}{'Strategy':<10}{'Fetches':>8}{'p50 ms':>9}"
+                f"{'Avg KiB':>9}{'Fallbacks':>11}"
+            ]
+            for site, strategies in STRATEGIES.items():
+                for name in strategies:
+                    count, p50, size, fallbacks = strategy_stats(site, name)
+                    label = f"{name}*" if name == get_strategy(site) else name
+                    p50 = "-" if p50 is None else f"{p50:.1f}"
+                    size = "-" if size is None else f"{size / 1024:.1f}"
+                    lines.append(
+                        f"{site:<12}{label:<10}{count:>8,}{p50:>9}{size:>9}"
+                        f"{fallbacks:>11,}"
+                    )
+            lines += ["", "* In use"]
+            await ctx.send(box("\n".join(lines)))
+            return
+        site = site.lower()
+        strategy = (strategy or "").lower()
+        try:
+            set_strategy(site, strategy)
+        except ValueError:
+            options = ", ".join(STRATEGIES.get(site, ())) or "none"
+            await ctx.send(
+                f"Strategies for {site}: {options}. Sites: "
+                f"{', '.join(STRATEGIES)}. No changes were made."
+            )
+            return
+        async with self.config.fetch_strategies() as strategies:
+            strategies[site] = strategy
+        await ctx.invoke(self.http_strategy)
+
+    @checks.is_owner()
+    @commands.group(name="ffcache", invoke_without_command=True)
+    async def cache_info(self, ctx):
+        """
+        Show the story metadata cache shared by FFEmbed and FFPicker
+        """
+        info = self.cache.info()
+        em = discord.Embed(
+            description=(
+                f"{info['entries']:,} stories cached "
+                f"({info['bytes'] / 1024:,.1f} KiB) ∙ "
+                f"Hit ratio: {info['hit_ratio']:.1%}\n"
+                f"Shared with other bots: {info['shared'] or 'no'}"
+            ),
+            color=0x7289DA,
+        )
+        for field in (
+            "hits",
+            "stale_hits",
+            "negative_hits",
+            "misses",
+            "coalesced",
+            "evictions",
+            "expirations",
+            "shared_hits",
+            "shared_errors",
+        ):
+            name = field.replace("_", " ").title()
+            em.add_field(name=name, value=f"{info[field]:,}")
+        em.set_author(name="FFEmbed Cache", icon_url=self.bot.user.avatar_url)
+        await ctx.send(embed=em)
+
+    @checks.is_owner()
+    @cache_info.command(name="clear")
+    async def cache_clear(self, ctx):
+        """
+        Drop every cached story, including those shared with other bots
+        """
+        self.cache.clear()
+        if self.cache.shared is not None:
+            try:
+                await self.cache.shared.clear()
+            except Exception as e:
+                await ctx.send(f"Clearing the shared cache failed: {e}")
+                return
+        await ctx.send("The story cache has been cleared.")
+
+    @checks.is_owner()
+    @cache_info.command(name="shared")
+    async def cache_shared(self, ctx, kind: str, location: str = None):
+        """
+        Share cached stories with other bots on this host
+
+        Kind is sqlite, redis or off. SQLite takes a file path and Redis a
+        redis:// URL, both with a default. Bots using the same file or
+        server show stories any of them fetched without fetching again.
+        """
+        kind = kind.lower()
+        if kind == "off":
+            self.cache.use_shared(None)
+            await self.config.shared_cache.set({})
+            await ctx.send("Cached stories will no longer be shared.")
+            return
+        try:
+            backend = open_backend(kind, location)
+        except (ValueError, OSError, sqlite3.Error) as e:
+            await ctx.send(f"{e} No changes were made.")
+            return
+        try:
+            await backend.count()
+        except Exception as e:
+            backend.close()
+            await ctx.send(f"Could not reach {backend.location}: {e}")
+            return
+        self.cache.use_shared(backend)
+        await self.config.shared_cache.set({"kind": kind, "location": location})
+        await ctx.send(f"Cached stories are now shared through {backend.location}.")
+
+    @checks.is_owner()
+    @commands.group(name="ffstats", invoke_without_command=True)
+    async def stats(self, ctx, stage: str = None):
+        """
+        Show latency percentiles per stage and site, and error counts
+
+        Stages are throttle, dns, connect, download, fetch (also split into
+        desktop and mobile), parse, format, send and message, plus skeleton
+        and complete for progressive embeds: the time until the placeholders
+        are posted and until they are all filled in. Times are in
+        milliseconds.
+        """
+        rows = metrics.summary(stage and stage.lower())
+        if not rows:
+            await ctx.send("Nothing has been measured yet.")
+            return
+        since = humanize_timedelta(seconds=max(time.time() - metrics.started, 1))
+        lines = [
+            f"Since {since} ago ∙ Cache hit ratio: "
+            f"{self.cache.info()['hit_ratio']:.1%}",
+            "",
+            f"{'Stage':<10}{'Site':<12}{'Count':>8}{'p50':>9}{'p95':>9}{'p99':>9}",
+        ]
+        for name, site, count, p50, p95, p99 in rows:
+            lines.append(
+                f"{name:<10}{site:<12}{count:>8,}{p50:>9.1f}{p95:>9.1f}{p99:>9.1f}"
+            )
+        counters = sorted(metrics.counters.items(), key=lambda item: str(item[0]))
+        if counters:
+            lines += ["", f"{'Counter':<14}{'Site':<12}{'Detail':<22}{'Total':>10}"]
+        for (name, site, detail), total in counters:
+            lines.append(f"{name:<14}{site or '-':<12}{detail or '-':<22}{total:>10,}")
+        for page in pagify("\n".join(lines), page_length=1900):
+            await ctx.send(box(page))
+
+    @checks.is_owner()
+    @stats.command(name="reset")
+    async def stats_reset(self, ctx):
+        """
+        Start measuring from scratch
+        """
+        metrics.reset()
+        await ctx.send("The stats have been reset.")
+
+    @checks.is_owner()
+    @stats.command(name="export")
+    async def stats_export(self, ctx):
+        """
+        Send every measurement in Prometheus' text format
+        """
+        data = io.BytesIO(metrics.prometheus().encode())
+        await ctx.send(file=discord.File(data, filename="ffstats.prom"))
+
+    async def load_settings(self, guild):
+        """
+        Read a server's settings into the in-memory copy used by on_message
+        """
+        conf = await self.config.guild(guild).all()
+        windows = {int(ch): sec for ch, sec in conf["repeat_channels"].items()}
+        settings = (
+            conf["enabled"],
+            frozenset(conf["disabled_channels"]),
+            (conf["repeat_window"], windows, conf["repeat_mode"]),
+            conf["progressive"],
+        )
+        self._settings[guild.id] = settings
+        return settings
+
+    async def host_slot(self, url):
+        host = urlparse(url).netloc
+        if host not in self._host_slots:
+            slot = asyncio.Semaphore(await self.config.host_concurrency())
+            self._host_slots.setdefault(host, slot)
+        return self._host_slots[host]
+
+    async def get_metadata(self, ref):
+        async def load():
+            async with await self.host_slot(ref.url):
+                return await fetch_story(self.http.session, ref.url)
+
+        metadata = await self.cache.get_or_load(ref.key, load)
+        # Other chapter links of the same story share one cache entry
+        return dict(metadata, link=ref.url if metadata["link"] else None)
+
+    async def get_listing(self, ref):
+        """
+        Return the works on the first page of a listing, caching each of them
+        so later links to a work are answered without a fetch
+        """
+
+        async def load():
+            async with await self.host_slot(ref.url):
+                works, more = await fetch_listing(self.http.session, ref.url, 1)
+            if not works:
+                raise StoryNotFound(ref.url)
+            for work in works:
+                await self.cache.put(story_key(work["link"]), work)
+            return {"works": works, "more": more}
+
+        return await self.cache.get_or_load(ref.key, load)
 
     def format_embed(self, metadata):
         em = discord.Embed(
@@ -252,35 +671,264 @@ class FFEmbed(BaseCog):
             em.set_thumbnail(url=metadata["thumbnail"])
         return em
 
+    def skeleton_embed(self, ref, desc="Fetching story info…"):
+        """
+        Return a placeholder embed for a link, built from the link itself and
+        the story's title if it is cached
+        """
+        cached = self.cache.peek(ref.key) or {}
+        site = SITE_NAMES[ref.site]
+        em = discord.Embed(
+            title=cached.get("title") or f"{site} {ref.kind} {ref.id}",
+            url=ref.url,
+            description=desc,
+            color=0x7289DA,
+        )
+        em.set_author(name=site, icon_url=SITE_ICONS[ref.site])
+        return em
+
+    @staticmethod
+    def more_embed(ref, hidden, more):
+        """
+        Return an embed pointing at the rest of a listing's works
+        """
+        desc = f"{hidden:,} more works are listed on this page"
+        desc += ", with more on later pages." if more else "."
+        return discord.Embed(
+            title="More works", url=ref.url, description=desc, color=0x7289DA
+        )
+
+    @staticmethod
+    def batch_embeds(embeds):
+        batch, size = [], 0
+        for em in embeds:
+            if batch and (
+                len(batch) == MAX_EMBEDS or size + len(em) > MAX_EMBED_CHARS
+            ):
+                yield batch
+                batch, size = [], 0
+            batch.append(em)
+            size += len(em)
+        if batch:
+            yield batch
+
+    async def send_embeds(self, channel, embeds):
+        """
+        Send embeds in as few messages as possible
+
+        Returns the ID of the message each embed was sent in.
+        """
+        ids = []
+        for batch in self.batch_embeds(embeds):
+            with metrics.timer("send", "discord"):
+                if len(batch) == 1:
+                    message_id = (await channel.send(embed=batch[0])).id
+                elif MULTI_EMBED_SEND:
+                    message_id = (await channel.send(embeds=batch)).id
+                else:
+                    route = Route(
+                        "POST",
+                        "/channels/{channel_id}/messages",
+                        channel_id=channel.id,
+                    )
+                    payload = {"embeds": [em.to_dict() for em in batch]}
+                    data = await self.bot.http.request(route, json=payload)
+                    message_id = int(data["id"])
+            ids += [message_id] * len(batch)
+        return ids
+
+    async def edit_embeds(self, channel, message_id, embeds):
+        """
+        Replace the embeds of a message sent by send_embeds
+        """
+        route = Route(
+            "PATCH",
+            "/channels/{channel_id}/messages/{message_id}",
+            channel_id=channel.id,
+            message_id=message_id,
+        )
+        payload = {"embeds": [em.to_dict() for em in embeds]}
+        with metrics.timer("edit", "discord"):
+            await self.bot.http.request(route, json=payload)
+
+    async def resolve_embeds(self, refs):
+        """
+        Resolve story links concurrently, keeping the original link order
+
+        Each link gets a list of embeds, several for a listing, or None if
+        it failed.
+        """
+        return await asyncio.gather(*await self.start_resolving(refs))
+
+    async def start_resolving(self, refs):
+        """
+        Start resolving story links concurrently, returning a task for each
+        that gives what resolve_embeds would
+        """
+        fanout = asyncio.Semaphore(await self.config.link_concurrency())
+
+        async def resolve(ref):
+            site = ref.key[0]
+            async with fanout:
+                try:
+                    if ref.listing:
+                        listing = await self.get_listing(ref)
+                        works = listing["works"][:LISTING_EMBEDS]
+                    else:
+                        works = [await self.get_metadata(ref)]
+                except Exception as e:
+                    log.info("Failed to retrieve %s: %r", ref.url, e)
+                    metrics.incr("failed_links", site, type(e).__name__)
+                    return None
+            with metrics.timer("format", site):
+                embeds = [self.format_embed(metadata) for metadata in works]
+                if ref.listing:
+                    hidden = len(listing["works"]) - len(works)
+                    if hidden or listing["more"]:
+                        embeds.append(self.more_embed(ref, hidden, listing["more"]))
+                return embeds
+
+        return [asyncio.ensure_future(resolve(ref)) for ref in refs]
+
     @commands.Cog.listener()
     async def on_message(self, message):
+        # Ordinary chat leaves here before anything is awaited
+        content = message.content
+        if "://" not in content or not any(host in content for host in HOSTS):
+            return
+        if not message.guild or message.author.bot:
+            return
+
+        settings = self._settings.get(message.guild.id)
+        if settings is None:
+            settings = await self.load_settings(message.guild)
+        enabled, disabled_ch, repeats, progressive = settings
+        if not enabled or message.channel.id in disabled_ch:
+            return
+
         try:
             prefixes = tuple(await self.bot.get_valid_prefixes(message.guild))
         except AttributeError:
             # Maintain compatibility for Red <3.2
             prefixes = tuple(await self.bot.db.guild(message.guild).prefix())
+        if content.startswith(prefixes):
+            return
 
-        if (
-            not message.guild
-            or message.author.bot
-            or message.content.startswith(prefixes)
-        ):
+        refs = find_stories(content)
+        if not refs:
             return
-        else:
-            enabled = await self.config.guild(message.guild).enabled()
-            disabled_ch = await self.config.guild(message.guild).disabled_channels()
+        with metrics.timer("message", "ffembed"):
+            refs, earlier = self.skip_repeats(message.channel, refs, repeats)
+            if refs:
+                await self.show_stories(message.channel, refs, progressive)
+            if earlier and repeats[2] == "link":
+                links = "\n".join(
+                    f"https://discord.com/channels/{message.guild.id}/"
+                    f"{message.channel.id}/{message_id}"
+                    for message_id in earlier
+                )
+                await message.channel.send(f"Already shown recently:\n{links}")
 
-        if not enabled or message.channel.id in disabled_ch:
-            pass
-        else:
-            urls = self.parse_url(message.content)
-            for url in urls:
-                try:
-                    page = await self.fetch_url(url)
-                    metadata = self.parse(page, url)
-                except Exception as e:
-                    print(e)
-                    await message.channel.send("Failed to retrieve story.")
-                else:
-                    em = self.format_embed(metadata)
-                    await message.channel.send(embed=em)
+    def skip_repeats(self, channel, refs, repeats):
+        """
+        Split off links to stories already shown in the channel within the
+        repeat window
+
+        Returns the links still to show, and the IDs of the messages that
+        showed the others.
+        """
+        default, windows, _ = repeats
+        window = windows.get(channel.id, default)
+        if not window:
+            return refs, []
+        fresh, earlier = [], []
+        for ref in refs:
+            message_id = self.recent.get(channel.id, ref.key, window)
+            if message_id is False:
+                self.recent.claim(channel.id, ref.key)
+                fresh.append(ref)
+                continue
+            metrics.incr("repeat_links", ref.key[0])
+            if message_id and message_id not in earlier:
+                earlier.append(message_id)
+        return fresh, earlier
+
+    async def show_stories(self, channel, refs, progressive=False):
+        # Placeholders would only delay stories that are already cached
+        if progressive and not all(self.cache.peek(ref.key) for ref in refs):
+            await self.show_progressive(channel, refs)
+            return
+        results = await self.resolve_embeds(refs)
+        shown = [(ref, ems) for ref, ems in zip(refs, results) if ems is not None]
+        failed = len(results) - len(shown)
+        for ref, ems in zip(refs, results):
+            if ems is None:
+                self.recent.forget(channel.id, ref.key)
+        if shown:
+            try:
+                ids = await self.send_queue.put(
+                    channel, [em for _, ems in shown for em in ems]
+                )
+            except Exception:
+                # Unclaim them, or they would be skipped as repeats
+                for ref, _ in shown:
+                    self.recent.forget(channel.id, ref.key)
+                raise
+            pos = 0
+            for ref, ems in shown:
+                # A listing links back to the message with its first work
+                self.recent.shown(channel.id, ref.key, ids[pos])
+                pos += len(ems)
+        if failed == 1:
+            await channel.send("Failed to retrieve story.")
+        elif failed:
+            await channel.send(f"Failed to retrieve {failed} stories.")
+
+    async def show_progressive(self, channel, refs):
+        """
+        Post a placeholder embed for each link straight away, then edit each
+        message in place once every link in it is resolved
+
+        The placeholders bypass the send queue, which could merge them into
+        a message with other links' embeds that the edit would overwrite.
+        """
+        start = time.perf_counter()
+        tasks = await self.start_resolving(refs)
+        skeletons = [self.skeleton_embed(ref) for ref in refs]
+        try:
+            ids = await self.send_embeds(channel, skeletons)
+        except Exception:
+            for ref in refs:
+                self.recent.forget(channel.id, ref.key)
+            raise
+        metrics.observe("skeleton", "ffembed", time.perf_counter() - start)
+        messages = OrderedDict()
+        for ref, task, message_id in zip(refs, tasks, ids):
+            self.recent.shown(channel.id, ref.key, message_id)
+            messages.setdefault(message_id, []).append((ref, task))
+        await asyncio.gather(
+            *(
+                self.finish_message(channel, message_id, links)
+                for message_id, links in messages.items()
+            )
+        )
+        metrics.observe("complete", "ffembed", time.perf_counter() - start)
+
+    async def finish_message(self, channel, message_id, links):
+        """
+        Replace a message's placeholders with the resolved embeds, or say in
+        the placeholder that the story could not be retrieved
+        """
+        embeds = []
+        for ref, task in links:
+            result = await task
+            if result is None:
+                self.recent.forget(channel.id, ref.key)
+                embeds.append(self.skeleton_embed(ref, "Failed to retrieve story."))
+            else:
+                embeds += result
+        # A listing can resolve to more embeds than fit in the message
+        first, *rest = self.batch_embeds(embeds)
+        await self.edit_embeds(channel, message_id, first)
+        if rest:
+            await self.send_embeds(channel, [em for batch in rest for em in batch])
@@ -0,0 +1,34 @@
+from .cache import CachedFailure, MetadataCache, StoryNotFound, metadata_cache
+from .executor import ParsePool, parse_pool
+from .fetch import (
+    MAX_LISTING_PAGES,
+    STRATEGIES,
+    fetch_html,
+    fetch_listing,
+    fetch_story,
+    get_strategy,
+    set_strategy,
+    strategy_stats,
+)
+from .http import HttpClient, http_client
+from .metrics import Histogram, Metrics, metrics
+from .parsers import (
+    SITE_ICONS,
+    get_backend,
+    make_soup,
+    parse_listing,
+    parse_story,
+    set_backend,
+)
+from .ratelimit import CircuitBreaker, HostUnavailable, TokenBucket, host_limits
+from .shared import RedisBackend, SQLiteBackend, open_backend
+from .singleflight import SingleFlight
+from .urls import (
+    SITE_NAMES,
+    StoryRef,
+    find_stories,
+    site_of,
+    story_id,
+    story_key,
+    story_ref,
+)
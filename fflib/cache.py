@@ -0,0 +1,325 @@
+import logging
+import sys
+import time
+
+from collections import OrderedDict
+from functools import partial
+
+from .parsers import PARSE_ERRORS
+from .shared import shared_key
+from .singleflight import SingleFlight
+
+log = logging.getLogger("red.fflib")
+
+# Seconds an entry is served as fresh, per site
+DEFAULT_TTLS = {"ffn": 3600, "ffn-author": 3600, "ao3": 1800, "siye": 21600}
+
+FRESH = "fresh"
+STALE = "stale"
+NEGATIVE = "negative"
+MISS = "miss"
+
+
+class StoryNotFound(Exception):
+    """
+    Raised when a story page no longer exists upstream
+    """
+
+
+class CachedFailure(Exception):
+    """
+    Raised when the same story failed to resolve moments ago
+    """
+
+
+# Failures caused by the page itself rather than the network
+NEGATIVE_ERRORS = (StoryNotFound,) + PARSE_ERRORS
+
+
+def _sizeof(value):
+    if isinstance(value, dict):
+        return sys.getsizeof(value) + sum(
+            _sizeof(k) + _sizeof(v) for k, v in value.items()
+        )
+    elif isinstance(value, (list, tuple)):
+        return sys.getsizeof(value) + sum(_sizeof(item) for item in value)
+    return sys.getsizeof(value)
+
+
+class _Entry:
+    __slots__ = ("value", "size", "negative", "fresh_until", "stale_until")
+
+    def __init__(self, value, size, negative, fresh_until, stale_until):
+        self.value = value
+        self.size = size
+        self.negative = negative
+        self.fresh_until = fresh_until
+        self.stale_until = stale_until
+
+
+class MetadataCache:
+    """
+    Bounded LRU cache of parsed story metadata keyed by (site, story ID)
+
+    Entries are fresh for their site's TTL, then served stale for up to
+    stale_ttl seconds while a background refresh runs. 404s and parse
+    failures are remembered for negative_ttl seconds.
+
+    With a shared backend (see use_shared), a miss is looked up there
+    before loading, and whatever is loaded is written there, so other
+    processes on the host can serve it.
+    """
+
+    def __init__(
+        self,
+        ttls=None,
+        default_ttl=3600,
+        stale_ttl=86400,
+        negative_ttl=120,
+        max_entries=2048,
+        max_bytes=8 * 1024 * 1024,
+        clock=time.monotonic,
+    ):
+        self.ttls = dict(DEFAULT_TTLS if ttls is None else ttls)
+        self.default_ttl = default_ttl
+        self.stale_ttl = stale_ttl
+        self.negative_ttl = negative_ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._clock = clock
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._inflight = SingleFlight()
+        self._retry_at = {}  # Keys whose refresh failed, until when to wait
+        self.shared = None
+        self.stats = dict.fromkeys(
+            (
+                "hits",
+                "stale_hits",
+                "negative_hits",
+                "misses",
+                "evictions",
+                "expirations",
+                "shared_hits",
+                "shared_errors",
+            ),
+            0,
+        )
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    @property
+    def nbytes(self):
+        return self._bytes
+
+    def ttl_for(self, key):
+        return self.ttls.get(key[0], self.default_ttl)
+
+    def get(self, key):
+        """
+        Look up a key and return a (value, state) pair
+        """
+        entry = self._entries.get(key)
+        now = self._clock()
+        if entry is not None and now >= entry.stale_until:
+            self._discard(key)
+            self.stats["expirations"] += 1
+            entry = None
+        if entry is None:
+            self.stats["misses"] += 1
+            return None, MISS
+
+        self._entries.move_to_end(key)
+        if entry.negative:
+            self.stats["negative_hits"] += 1
+            return entry.value, NEGATIVE
+        elif now < entry.fresh_until:
+            self.stats["hits"] += 1
+            return entry.value, FRESH
+        else:
+            self.stats["stale_hits"] += 1
+            return entry.value, STALE
+
+    def peek(self, key):
+        """
+        Return a cached value without touching LRU order or stats
+        """
+        entry = self._entries.get(key)
+        if entry is None or entry.negative or self._clock() >= entry.stale_until:
+            return None
+        return entry.value
+
+    def set(self, key, metadata):
+        now = self._clock()
+        fresh_until = now + self.ttl_for(key)
+        entry = _Entry(
+            metadata,
+            _sizeof(metadata),
+            False,
+            fresh_until,
+            fresh_until + self.stale_ttl,
+        )
+        self._store(key, entry)
+
+    async def put(self, key, metadata):
+        """
+        Store metadata found without loading its own page, such as a work
+        read off an AO3 listing, and share it like a loaded entry
+        """
+        self.set(key, metadata)
+        await self._shared_set(key)
+
+    def set_negative(self, key, reason):
+        expires = self._clock() + self.negative_ttl
+        self._store(key, _Entry(reason, _sizeof(reason), True, expires, expires))
+
+    def invalidate(self, key):
+        self._discard(key)
+
+    def use_shared(self, backend):
+        """
+        Share entries through backend, or only keep them in this process if
+        it is None
+        """
+        old, self.shared = self.shared, backend
+        if old is not None:
+            old.close()
+
+    def clear(self):
+        self._entries.clear()
+        self._retry_at.clear()
+        self._bytes = 0
+
+    def info(self):
+        lookups = sum(
+            self.stats[k] for k in ("hits", "stale_hits", "negative_hits", "misses")
+        )
+        served = lookups - self.stats["misses"] + self.stats["shared_hits"]
+        return {
+            **self.stats,
+            "shared": self.shared and f"{self.shared.kind} ({self.shared.location})",
+            "entries": len(self._entries),
+            "bytes": self._bytes,
+            "coalesced": self._inflight.stats["coalesced"],
+            "hit_ratio": served / lookups if lookups else 0.0,
+        }
+
+    async def get_or_load(self, key, loader):
+        """
+        Return the metadata for key, awaiting loader() on a miss
+
+        Concurrent misses for the same key share a single loader() call.
+        Stale entries are returned straight away and refreshed in the
+        background; a failed refresh keeps the stale copy, and is retried
+        after negative_ttl seconds, unless the story is gone. A recent
+        failure is re-raised as CachedFailure.
+        """
+        if key is None:
+            return await loader()
+        value, state = self.get(key)
+        if state == FRESH:
+            return value
+        elif state == NEGATIVE:
+            raise CachedFailure(value)
+        elif state == STALE:
+            # A failed refresh keeps serving the stale copy until it runs out
+            if self._retry_at.get(key, 0) <= self._clock():
+                self._inflight.start(key, partial(self._load, key, loader, True))
+            return value
+        return await self._inflight.run(key, partial(self._load, key, loader))
+
+    async def _load(self, key, loader, refresh=False):
+        entry = await self._shared_get(key)
+        if entry is not None and entry.negative:
+            raise CachedFailure(entry.value)
+        elif entry is not None:
+            return entry.value
+        try:
+            value = await loader()
+        except Exception as e:
+            # Only a 404 replaces a stale copy; a page that stopped parsing
+            # may be a challenge page or a passing markup change
+            if isinstance(e, StoryNotFound) or (
+                not refresh and isinstance(e, NEGATIVE_ERRORS)
+            ):
+                self.set_negative(key, f"{type(e).__name__}: {e}")
+                await self._shared_set(key)
+            elif refresh:
+                self._retry_at[key] = self._clock() + self.negative_ttl
+            raise
+        self.set(key, value)
+        await self._shared_set(key)
+        return value
+
+    async def _shared_get(self, key):
+        """
+        Copy a fresh entry from the shared backend into this cache
+        """
+        if self.shared is None:
+            return None
+        try:
+            record = await self.shared.get(shared_key(key))
+        except Exception:
+            self.stats["shared_errors"] += 1
+            log.debug("Reading from the shared cache failed", exc_info=True)
+            return None
+        if record is None:
+            return None
+        value, negative, fresh_until, stale_until = record
+        # Deadlines are shared as wall clock times
+        offset = self._clock() - time.time()
+        if not negative and fresh_until + offset <= self._clock():
+            return None
+        entry = _Entry(
+            value,
+            _sizeof(value),
+            negative,
+            fresh_until + offset,
+            stale_until + offset,
+        )
+        self._store(key, entry)
+        self.stats["shared_hits"] += 1
+        return entry
+
+    async def _shared_set(self, key):
+        entry = self._entries.get(key)
+        if self.shared is None or entry is None:
+            return
+        offset = time.time() - self._clock()
+        record = (
+            entry.value,
+            entry.negative,
+            entry.fresh_until + offset,
+            entry.stale_until + offset,
+        )
+        try:
+            await self.shared.set(shared_key(key), record)
+        except Exception:
+            self.stats["shared_errors"] += 1
+            log.debug("Writing to the shared cache failed", exc_info=True)
+
+    def _store(self, key, entry):
+        self._discard(key)
+        self._entries[key] = entry
+        self._bytes += entry.size
+        while self._entries and (
+            len(self._entries) > self.max_entries or self._bytes > self.max_bytes
+        ):
+            evicted_key, evicted = self._entries.popitem(last=False)
+            self._retry_at.pop(evicted_key, None)
+            self._bytes -= evicted.size
+            self.stats["evictions"] += 1
+
+    def _discard(self, key):
+        self._retry_at.pop(key, None)
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._bytes -= entry.size
+
+
+# One cache per process, shared by every cog that imports fflib
+metadata_cache = MetadataCache()
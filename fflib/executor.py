@@ -0,0 +1,57 @@
+import asyncio
+
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from functools import partial
+
+KINDS = {"thread": ThreadPoolExecutor, "process": ProcessPoolExecutor}
+
+
+class ParsePool:
+    """
+    Executor that keeps page parsing off the event loop
+
+    Only plain data (page bytes in, metadata dicts out) crosses into the
+    pool, so it works as a thread or a process pool. With zero workers,
+    jobs run inline on the loop. The executor is created on first use and
+    shut down when the last cog using it releases it.
+    """
+
+    def __init__(self, kind="thread", workers=2):
+        self.kind = kind
+        self.workers = workers
+        self._executor = None
+        self._users = 0
+
+    def configure(self, kind, workers):
+        if kind not in KINDS:
+            raise ValueError(f"Unknown pool kind {kind!r}.")
+        if workers < 0:
+            raise ValueError("Worker count cannot be negative.")
+        if (kind, workers) != (self.kind, self.workers):
+            self.shutdown()
+            self.kind, self.workers = kind, workers
+
+    def acquire(self):
+        self._users += 1
+
+    def release(self):
+        self._users = max(self._users - 1, 0)
+        if not self._users:
+            self.shutdown()
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
+
+    async def run(self, func, *args):
+        if not self.workers:
+            return func(*args)
+        if self._executor is None:
+            self._executor = KINDS[self.kind](max_workers=self.workers)
+        loop = asyncio.get_event_loop()
+        return await loop.run_in_executor(self._executor, partial(func, *args))
+
+
+# One pool per process, shared by every cog that imports fflib
+parse_pool = ParsePool()
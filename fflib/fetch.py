@@ -0,0 +1,331 @@
+import aiohttp
+import asyncio
+import re
+import time
+
+from urllib.parse import urlparse
+from .cache import StoryNotFound
+from .executor import parse_pool
+from .metrics import metrics
+from .parsers import PARSE_ERRORS, get_backend, make_soup, parse_listing, parse_story
+from .ratelimit import HostUnavailable, backoff, host_limits, retry_after
+from .urls import site_of, story_key
+
+CHUNK_SIZE = 16 * 1024
+
+MAX_ATTEMPTS = 3
+MAX_RETRY_AFTER = 30  # Give up rather than wait longer than this on a retry
+MAX_FETCH_TIME = 30  # Seconds one page may take, retries and waits included
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+MAX_LISTING_PAGES = 10  # Pages of a series, collection or user's works read
+
+# Patterns that, once seen in order, mean the story info is behind us
+END_MARKERS = {
+    "ffn": (re.compile(rb"id=['\"]?storytext"),),
+    "ffn-author": (re.compile(rb"id=['\"]?st_inside"),),
+    "ao3": (re.compile(rb"id=['\"]?chapters['\"\s>]"),),
+    "siye": (re.compile(rb"Summary:"), re.compile(rb"</table>", re.I)),
+}
+
+# The same for the lighter pages of the mobile strategy
+MOBILE_END_MARKERS = {
+    "ffn": (re.compile(rb"id=['\"]?storycontent"),),
+    "ffn-author": (re.compile(rb"id=['\"]?bio"), re.compile(rb"</div>")),
+}
+
+# Ways to fetch each site's story info; desktop is the usual page
+STRATEGIES = {
+    "ffn": ("desktop", "mobile"),
+    "ffn-author": ("desktop", "mobile"),
+    "ao3": ("desktop",),
+    "siye": ("desktop",),
+}
+
+# Errors after which a lighter page is given up on for the usual one
+FALLBACK_ERRORS = PARSE_ERRORS + (
+    aiohttp.ClientError,
+    asyncio.TimeoutError,
+    HostUnavailable,
+)
+
+_strategies = {}
+
+# How far back to rescan so a marker split across two chunks is still found
+_OVERLAP = 64
+
+
+def get_strategy(site):
+    return _strategies.get(site, "desktop")
+
+
+def set_strategy(site, name):
+    """
+    Choose how a site's story info is fetched, see STRATEGIES
+    """
+    if name not in STRATEGIES.get(site, ()):
+        raise ValueError(f"{site} cannot be fetched with the {name} strategy.")
+    _strategies[site] = name
+
+
+def mobile_url(url):
+    return url.replace("//www.fanfiction.net/", "//m.fanfiction.net/", 1)
+
+
+def strategy_stats(site, strategy):
+    """
+    Return how many pages a strategy fetched for a site, their median time
+    in milliseconds and mean size in bytes, and how often it fell back
+    """
+    fallbacks = sum(
+        n
+        for (name, s, detail), n in metrics.counters.items()
+        if name == "fallbacks" and s == site and detail.startswith(strategy + ":")
+    )
+    h = metrics.histograms.get((strategy, site))
+    if h is None or not h.count:
+        return 0, None, None, fallbacks
+    size = metrics.counters["page_bytes", site, strategy] / h.count
+    return h.count, h.percentile(50) * 1000, size, fallbacks
+
+
+async def read_until(content, markers, chunk_size=CHUNK_SIZE):
+    """
+    Read a response body until every marker has matched, in order
+
+    Returns the bytes read so far and whether that is the whole body.
+    """
+    body = bytearray()
+    pos = 0
+    remaining = list(markers)
+    async for chunk in content.iter_chunked(chunk_size):
+        start = max(pos, len(body) - _OVERLAP)
+        body += chunk
+        while remaining:
+            match = remaining[0].search(body, start)
+            if match is None:
+                break
+            pos = start = match.end()
+            remaining.pop(0)
+        if not remaining:
+            return bytes(body), False
+    return bytes(body), True
+
+
+def _challenged(r):
+    """
+    Return whether a response is a Cloudflare challenge rather than the page
+    """
+    return r.headers.get("cf-mitigated") == "challenge" or (
+        r.status in (403, 503) and r.headers.get("Server", "").startswith("cloudflare")
+    )
+
+
+async def _get(session, url, markers):
+    """
+    Download a page, retrying throttled and failed requests
+
+    Every attempt, wait and retry shares one deadline, MAX_FETCH_TIME
+    seconds away, so a later attempt only gets the time left.
+    """
+    deadline = asyncio.get_event_loop().time() + MAX_FETCH_TIME
+    return await asyncio.wait_for(
+        _attempts(session, url, markers, deadline), MAX_FETCH_TIME
+    )
+
+
+async def _attempts(session, url, markers, deadline):
+    loop = asyncio.get_event_loop()
+    host = urlparse(url).netloc
+    site = site_of(url)
+    breaker = host_limits.breaker(host)
+    bucket = host_limits.bucket(host)
+    for attempt in range(MAX_ATTEMPTS):
+        if not breaker.allow():
+            metrics.incr("errors", site, "circuit open")
+            raise HostUnavailable(f"{host} is failing, not trying for now")
+        # Whether the host looked healthy, so the breaker hears about every
+        # attempt, even one that raises; None if the attempt was abandoned
+        healthy = False
+        try:
+            with metrics.timer("throttle", site):
+                await bucket.acquire()
+            if attempt:
+                metrics.incr("retries", site)
+            delay = None
+            start = time.perf_counter()
+            async with session.get(url) as r:
+                if r.status == 404:
+                    healthy = True
+                    metrics.incr("errors", site, "HTTP 404")
+                    raise StoryNotFound(url)
+                if r.status in RETRY_STATUSES:
+                    metrics.incr("errors", site, f"HTTP {r.status}")
+                    delay = retry_after(r.headers.get("Retry-After"))
+                    if delay is not None:
+                        bucket.hold(delay)  # Applies to every caller
+                    error = HostUnavailable(f"{host} returned {r.status}")
+                elif _challenged(r):
+                    metrics.incr("errors", site, "challenge")
+                    raise HostUnavailable(f"{host} answered with a challenge page")
+                else:
+                    if r.status >= 400:
+                        metrics.incr("errors", site, f"HTTP {r.status}")
+                    r.raise_for_status()
+                    if markers:
+                        body, complete = await read_until(r.content, markers)
+                        if not complete:
+                            r.close()  # Don't download the rest of the chapter
+                    else:
+                        body, complete = await r.read(), True
+                    healthy = True
+                    metrics.observe("download", site, time.perf_counter() - start)
+                    metrics.incr("bytes", site, n=len(body))
+                    return body, r.charset, complete
+        except (aiohttp.ClientConnectionError, asyncio.TimeoutError) as e:
+            metrics.incr("errors", site, type(e).__name__)
+            error = e
+        except asyncio.CancelledError:
+            healthy = None
+            raise
+        finally:
+            if healthy:
+                breaker.success()
+            elif healthy is None:
+                breaker.release()
+            else:
+                breaker.failure()
+        wait = backoff(attempt) if delay is None else delay
+        if attempt + 1 == MAX_ATTEMPTS or (delay or 0) > MAX_RETRY_AFTER:
+            break
+        elif loop.time() + wait >= deadline:
+            break  # Out of time before the retry could start
+        await asyncio.sleep(wait)
+    raise error
+
+
+def parse_body(body, encoding, url, backend, strategy="desktop"):
+    """
+    Turn a downloaded page into story metadata
+
+    This runs in the parse pool, so it takes and returns only plain data.
+    """
+    return parse_story(make_soup(body, backend, encoding), url, strategy)
+
+
+def parse_listing_body(body, encoding, url, backend):
+    return parse_listing(make_soup(body, backend, encoding), url)
+
+
+def interstitial_link(body, encoding, backend):
+    page = make_soup(body, backend, encoding)
+    if page.select("p[class='message footnote']"):
+        return page.select("ul[class='actions']")[0].find("a")["href"]
+    return None
+
+
+async def fetch_html(session, url, partial=True, strategy="desktop"):
+    """
+    Download a story page
+
+    With partial, the download stops once the site's end marker for the
+    story info has been seen. Returns the body, its declared encoding and
+    whether the body is complete.
+    """
+    key = story_key(url)
+    markers = MOBILE_END_MARKERS if strategy == "mobile" else END_MARKERS
+    markers = markers.get(key[0]) if partial and key else None
+    if strategy == "mobile":
+        url = mobile_url(url)
+    ao3 = key is not None and key[0] == "ao3"
+    # AO3 presents warning page for NSFW-tagged stories
+    if ao3:
+        url = url + "?view_adult=true"
+    body, encoding, complete = await _get(session, url, markers)
+    if ao3 and b"message footnote" in body:
+        chapter = await parse_pool.run(
+            interstitial_link, body, encoding, get_backend()
+        )
+        if chapter:
+            url = "https://archiveofourown.org" + chapter
+            body, encoding, complete = await _get(session, url, markers)
+    return body, encoding, complete
+
+
+async def _parse(body, encoding, url, strategy):
+    site = site_of(url)
+    try:
+        with metrics.timer("parse", site):
+            return await parse_pool.run(
+                parse_body, body, encoding, url, get_backend(), strategy
+            )
+    except PARSE_ERRORS as e:
+        metrics.incr("errors", site, type(e).__name__)
+        raise
+
+
+async def fetch_story(session, url):
+    """
+    Fetch a story page and return its metadata
+
+    If the site is set to a lighter strategy and that page is missing
+    anything, the usual page is fetched instead.
+    """
+    site = site_of(url)
+    strategy = get_strategy(site)
+    if strategy != "desktop":
+        try:
+            return await _fetch_story(session, url, site, strategy)
+        except FALLBACK_ERRORS as e:
+            metrics.incr("fallbacks", site, f"{strategy}: {type(e).__name__}")
+    return await _fetch_story(session, url, site, "desktop")
+
+
+async def _fetch_story(session, url, site, strategy):
+    # Time and bytes per strategy show which is cheaper for each site
+    with metrics.timer("fetch", site), metrics.timer(strategy, site):
+        body, encoding, complete = await fetch_html(session, url, strategy=strategy)
+    metrics.incr("page_bytes", site, strategy, len(body))
+    try:
+        return await _parse(body, encoding, url, strategy)
+    except PARSE_ERRORS:
+        if complete:
+            raise
+    # The marker matched before the story info did, so read the whole page
+    metrics.incr("full_reads", site, strategy)
+    with metrics.timer("fetch", site), metrics.timer(strategy, site):
+        body, encoding, _ = await fetch_html(session, url, False, strategy)
+    metrics.incr("page_bytes", site, strategy, len(body))
+    return await _parse(body, encoding, url, strategy)
+
+
+async def fetch_listing(session, url, max_pages=MAX_LISTING_PAGES):
+    """
+    Fetch the metadata of every work on an AO3 series, collection or user's
+    works page, following the listing across up to max_pages pages
+
+    Each page lists 20 works, so a whole series usually takes one or two
+    requests instead of one per work. Returns the works in listing order
+    and whether the listing has pages left unread.
+    """
+    site = site_of(url)
+    works, seen = [], set()
+    for _ in range(max_pages):
+        with metrics.timer("fetch", site):
+            body, encoding, _ = await _get(session, url, None)
+        try:
+            with metrics.timer("parse", site):
+                page, url = await parse_pool.run(
+                    parse_listing_body, body, encoding, url, get_backend()
+                )
+        except PARSE_ERRORS as e:
+            metrics.incr("errors", site, type(e).__name__)
+            raise
+        # A work can move to the next page while the listing is read
+        new = [work for work in page if work["link"] not in seen]
+        seen.update(work["link"] for work in new)
+        works += new
+        metrics.incr("listing_works", site, n=len(new))
+        if url is None:
+            break
+    return works, url is not None
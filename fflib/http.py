@@ -0,0 +1,134 @@
+import aiohttp
+import asyncio
+import time
+
+from .metrics import metrics
+from .urls import site_of
+
+# aiohttp decodes br responses when one of these is installed
+try:
+    import brotli
+except ImportError:
+    try:
+        import brotlicffi as brotli
+    except ImportError:
+        brotli = None
+
+ACCEPT_ENCODING = "gzip, deflate, br" if brotli else "gzip, deflate"
+
+DEFAULTS = {
+    "limit": 32,  # Open connections in total
+    "limit_per_host": 4,  # Open connections to one site
+    "dns_ttl": 300,  # Seconds a resolved address is reused
+    "keepalive": 30,  # Seconds an idle connection is kept for reuse
+    "connect_timeout": 5,
+    "read_timeout": 8,  # Seconds to wait for the next bytes of a response
+}
+
+
+async def _on_request_start(session, ctx, params):
+    ctx.site = site_of(str(params.url))
+
+
+def _stage(stage):
+    async def on_start(session, ctx, params):
+        setattr(ctx, stage, time.perf_counter())
+
+    async def on_end(session, ctx, params):
+        metrics.observe(stage, ctx.site, time.perf_counter() - getattr(ctx, stage))
+
+    return on_start, on_end
+
+
+def _trace_config():
+    """
+    Record how long DNS lookups and new connections take, per site
+    """
+    trace = aiohttp.TraceConfig()
+    trace.on_request_start.append(_on_request_start)
+    on_start, on_end = _stage("dns")
+    trace.on_dns_resolvehost_start.append(on_start)
+    trace.on_dns_resolvehost_end.append(on_end)
+    on_start, on_end = _stage("connect")
+    trace.on_connection_create_start.append(on_start)
+    trace.on_connection_create_end.append(on_end)
+    return trace
+
+
+class HttpClient:
+    """
+    One aiohttp session shared by every cog, so connections and TLS
+    sessions to a site are reused across links and cogs
+
+    The session is created on first use and closed when the last cog using
+    it releases it. Changing the settings swaps in a new session and closes
+    the old one once its requests have had time to finish.
+    """
+
+    def __init__(self, **settings):
+        self.settings = dict(DEFAULTS, **settings)
+        self._session = None
+        self._users = 0
+
+    @property
+    def session(self):
+        if self._session is None or self._session.closed:
+            self._session = self._create()
+        return self._session
+
+    def _create(self):
+        s = self.settings
+        connector = aiohttp.TCPConnector(
+            limit=s["limit"],
+            limit_per_host=s["limit_per_host"],
+            ttl_dns_cache=s["dns_ttl"],
+            keepalive_timeout=s["keepalive"],
+            enable_cleanup_closed=True,
+        )
+        timeout = aiohttp.ClientTimeout(
+            total=self._session_timeout(),
+            connect=s["connect_timeout"],
+            sock_read=s["read_timeout"],
+        )
+        return aiohttp.ClientSession(
+            connector=connector,
+            timeout=timeout,
+            headers={"Accept-Encoding": ACCEPT_ENCODING},
+            trace_configs=[_trace_config()],
+        )
+
+    def _session_timeout(self):
+        return self.settings["connect_timeout"] + 2 * self.settings["read_timeout"]
+
+    def configure(self, **settings):
+        unknown = set(settings) - set(DEFAULTS)
+        if unknown:
+            raise ValueError(f"Unknown HTTP setting {', '.join(sorted(unknown))}.")
+        if any(value < 0 for value in settings.values()):
+            raise ValueError("HTTP settings cannot be negative.")
+        settings = dict(self.settings, **settings)
+        if settings != self.settings:
+            self.settings = settings
+            self._close(delay=self._session_timeout())
+
+    def acquire(self):
+        self._users += 1
+
+    def release(self):
+        self._users = max(self._users - 1, 0)
+        if not self._users:
+            self._close()
+
+    def _close(self, delay=0):
+        session, self._session = self._session, None
+        if session is not None and not session.closed:
+            asyncio.ensure_future(self._close_later(session, delay))
+
+    @staticmethod
+    async def _close_later(session, delay):
+        await asyncio.sleep(delay)
+        await session.close()
+
+
+# One client per process, shared by every cog that imports fflib
+http_client = HttpClient()
@@ -0,0 +1,150 @@
+import logging
+import time
+
+from bisect import bisect_left
+from collections import Counter
+from contextlib import contextmanager
+
+log = logging.getLogger("red.fflib")
+
+# Histogram bucket upper bounds in seconds, 0.5 ms to ~260 s, 25% apart
+BOUNDS = tuple(0.0005 * 1.25 ** i for i in range(60))
+
+
+class Histogram:
+    """
+    Latency histogram with fixed, logarithmic buckets
+
+    Memory stays constant however many samples are recorded, and
+    percentiles are accurate to within one bucket.
+    """
+
+    __slots__ = ("buckets", "count", "total", "max")
+
+    def __init__(self):
+        self.buckets = [0] * (len(BOUNDS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def observe(self, seconds):
+        self.buckets[bisect_left(BOUNDS, seconds)] += 1
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+
+    def percentile(self, q):
+        """
+        Return the upper bound of the bucket holding the q-th percentile
+        """
+        if not self.count:
+            return 0.0
+        rank = q / 100 * self.count
+        seen = 0
+        for idx, n in enumerate(self.buckets):
+            seen += n
+            if seen >= rank and n:
+                return min(BOUNDS[idx], self.max) if idx < len(BOUNDS) else self.max
+        return self.max
+
+
+class Metrics:
+    """
+    Latency histograms per (stage, site) and counters per (name, site,
+    detail), shared by both cogs
+
+    Exporters registered with add_exporter are called with each sample as
+    (kind, name, site, detail, value), where kind is "histogram" or
+    "counter", so the numbers can be forwarded to outside monitoring.
+    """
+
+    def __init__(self):
+        self.histograms = {}
+        self.counters = Counter()
+        self.started = time.time()
+        self._exporters = []
+
+    def observe(self, stage, site, seconds):
+        key = (stage, site)
+        if key not in self.histograms:
+            self.histograms[key] = Histogram()
+        self.histograms[key].observe(seconds)
+        if self._exporters:
+            self._export("histogram", stage, site, None, seconds)
+
+    def incr(self, name, site=None, detail=None, n=1):
+        self.counters[name, site, detail] += n
+        if self._exporters:
+            self._export("counter", name, site, detail, n)
+
+    @contextmanager
+    def timer(self, stage, site):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(stage, site, time.perf_counter() - start)
+
+    def add_exporter(self, func):
+        self._exporters.append(func)
+
+    def remove_exporter(self, func):
+        if func in self._exporters:
+            self._exporters.remove(func)
+
+    def _export(self, *sample):
+        for func in list(self._exporters):
+            try:
+                func(*sample)
+            except Exception:
+                log.exception("Metrics exporter %r failed", func)
+
+    def reset(self):
+        self.histograms.clear()
+        self.counters.clear()
+        self.started = time.time()
+
+    def summary(self, stage=None):
+        """
+        Return (stage, site, count, p50, p95, p99) rows, in milliseconds
+        """
+        return [
+            (s, site, h.count) + tuple(h.percentile(q) * 1000 for q in (50, 95, 99))
+            for (s, site), h in sorted(
+                self.histograms.items(), key=lambda item: str(item[0])
+            )
+            if stage is None or s == stage
+        ]
+
+    def prometheus(self, prefix="fflib"):
+        """
+        Render every histogram and counter in Prometheus' text format
+        """
+        lines = [f"# TYPE {prefix}_seconds histogram"] if self.histograms else []
+        for (stage, site), h in sorted(
+            self.histograms.items(), key=lambda item: str(item[0])
+        ):
+            labels = f'stage="{stage}",site="{site or ""}"'
+            seen = 0
+            for bound, n in zip(BOUNDS, h.buckets):
+                seen += n
+                lines.append(
+                    f'{prefix}_seconds_bucket{{{labels},le="{bound:.6g}"}} {seen}'
+                )
+            lines.append(f'{prefix}_seconds_bucket{{{labels},le="+Inf"}} {h.count}')
+            lines.append(f"{prefix}_seconds_sum{{{labels}}} {h.total}")
+            lines.append(f"{prefix}_seconds_count{{{labels}}} {h.count}")
+        typed = set()
+        for (name, site, detail), n in sorted(
+            self.counters.items(), key=lambda item: str(item[0])
+        ):
+            if name not in typed:
+                lines.append(f"# TYPE {prefix}_{name}_total counter")
+                typed.add(name)
+            labels = f'site="{site or ""}",detail="{detail or ""}"'
+            lines.append(f"{prefix}_{name}_total{{{labels}}} {n}")
+        return "\n".join(lines) + "\n"
+
+
+# One registry per process, shared by every cog that imports fflib
+metrics = Metrics()
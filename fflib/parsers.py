@@ -0,0 +1,365 @@
+from bs4 import BeautifulSoup, Tag
+from datetime import datetime
+
+from .urls import story_key
+
+try:
+    import lxml  # noqa: F401
+except ImportError:
+    BACKENDS = ("html.parser",)
+else:
+    BACKENDS = ("lxml", "html.parser")
+
+# Fastest tree builder installed; lxml is C-backed, html.parser is pure Python
+_backend = BACKENDS[0]
+
+# What a site extractor raises when a page is missing the story info
+PARSE_ERRORS = (AttributeError, IndexError, KeyError, TypeError, ValueError)
+
+AO3_STATS = ("published", "status", "chapters", "words", "kudos", "hits")
+
+# Shown next to the author in each site's embeds
+SITE_ICONS = {
+    "ffn": "https://i.imgur.com/0eUBQHu.png",
+    "ao3": "https://i.imgur.com/oJtk1Gp.png",
+    "siye": "https://i.imgur.com/TXRYIBN.jpg",
+}
+
+
+def get_backend():
+    return _backend
+
+
+def set_backend(name):
+    global _backend
+    if name not in BACKENDS:
+        raise ValueError(f"Parser backend {name!r} is not installed.")
+    _backend = name
+
+
+def make_soup(html, backend=None, encoding=None):
+    return BeautifulSoup(html, backend or _backend, from_encoding=encoding)
+
+
+def walk(root):
+    """
+    Yield the tags under root in document order, lazily so callers can stop
+    as soon as they have every field they need
+    """
+    for node in root.descendants:
+        if isinstance(node, Tag):
+            yield node
+
+
+def parse_FanFiction_author(page, url):
+    div = page.find(id="content_wrapper_inner")
+    author = bio = None
+    cells = []
+    for tag in walk(div):
+        if author is None and tag.name == "span":
+            author = tag
+        if bio is None and tag.get("id") == "bio":
+            bio = tag
+        if tag.name == "td" and tag.get("colspan") == "2":
+            cells.append(tag)
+        if author is not None and bio is not None and len(cells) > 2:
+            break
+    thumbnail = bio.img
+    desc = page.find("meta", attrs={"name": "description"})["content"]
+    return {
+        "link": None,
+        "icon": SITE_ICONS["ffn"],
+        "thumbnail": "https:" + thumbnail["data-original"] if thumbnail else None,
+        "author": author.get_text(strip=True),
+        "author_link": url,
+        "title": None,
+        "desc": desc,
+        "footer": _author_footer(cells[2].get_text()),
+    }
+
+
+def parse_FanFiction(page, url):
+    base = "https://fanfiction.net"
+    div = page.find(id="profile_top")
+    thumbnail = author = title = desc = footer = None
+    for tag in walk(div):
+        classes = tag.get("class") or ()
+        if thumbnail is None and tag.name == "img" and "cimage" in classes:
+            thumbnail = tag
+        if "xcontrast_txt" not in classes:
+            continue
+        if author is None and tag.name == "a":
+            author = tag
+        elif title is None and tag.name == "b":
+            title = tag
+        elif desc is None and tag.name == "div":
+            desc = tag
+        elif footer is None and tag.name == "span":
+            if classes == ["xgray", "xcontrast_txt"]:
+                footer = tag
+    return {
+        "link": url,
+        "icon": SITE_ICONS["ffn"],
+        "thumbnail": "https:" + thumbnail["src"] if thumbnail else None,
+        "author": author.get_text(strip=True),
+        "author_link": base + author["href"],
+        "title": title.get_text(strip=True),
+        "desc": desc.get_text(strip=True),
+        "footer": _story_footer(footer.get_text()),
+    }
+
+
+def _author_footer(text):
+    footer = text.replace("id", "ID")
+    footer = footer[:6] + ":" + footer[6:]
+    return " ∙ ".join(footer.split(", "))
+
+
+def _story_footer(text):
+    footer = ": ".join(x.strip() for x in text.split(":"))
+    # The last field is the story ID
+    return " ∙ ".join(footer.split("-")[:-1])
+
+
+def _require(metadata, *fields):
+    """
+    Return metadata, or raise ValueError if any of fields is empty
+    """
+    missing = [field for field in fields if not metadata[field]]
+    if missing:
+        raise ValueError(f"Page has no {', '.join(missing)}")
+    return metadata
+
+
+def parse_FanFiction_author_mobile(page, url):
+    """
+    Read an author's info from FanFiction's mobile profile, which is much
+    smaller than the desktop one
+    """
+    div = page.find(id="content")
+    author = joined = thumbnail = None
+    for tag in walk(div):
+        classes = tag.get("class") or ()
+        if author is None and tag.name == "b":
+            author = tag
+        elif joined is None and tag.name == "div" and "gray" in classes:
+            joined = tag
+        elif thumbnail is None and tag.name == "img" and "cimage" in classes:
+            thumbnail = tag
+        if author is not None and joined is not None and thumbnail is not None:
+            break
+    desc = page.find("meta", attrs={"name": "description"})["content"]
+    metadata = {
+        "link": None,
+        "icon": SITE_ICONS["ffn"],
+        "thumbnail": "https:" + thumbnail["src"] if thumbnail else None,
+        "author": author.get_text(strip=True),
+        "author_link": url,
+        "title": None,
+        "desc": desc,
+        "footer": _author_footer(joined.get_text(strip=True)),
+    }
+    return _require(metadata, "author", "desc", "footer")
+
+
+def parse_FanFiction_mobile(page, url):
+    """
+    Read a story's info from FanFiction's mobile chapter page, which is
+    much smaller than the desktop one
+    """
+    base = "https://fanfiction.net"
+    div = page.find(id="content")
+    thumbnail = author = title = desc = footer = None
+    for tag in walk(div):
+        classes = tag.get("class") or ()
+        if tag.get("id") == "storycontent":
+            break
+        if thumbnail is None and tag.name == "img" and "cimage" in classes:
+            thumbnail = tag
+        elif author is None and tag.name == "a":
+            if tag.get("href", "").startswith("/u/"):
+                author = tag
+        elif title is None and tag.name == "b":
+            title = tag
+        elif desc is None and tag.name == "div" and not tag.attrs:
+            desc = tag
+        elif footer is None and tag.name == "div" and "gray" in classes:
+            footer = tag
+    metadata = {
+        "link": url,
+        "icon": SITE_ICONS["ffn"],
+        "thumbnail": "https:" + thumbnail["src"] if thumbnail else None,
+        "author": author.get_text(strip=True),
+        "author_link": base + author["href"],
+        "title": title.get_text(strip=True),
+        "desc": desc.get_text(strip=True),
+        "footer": _story_footer(footer.get_text()),
+    }
+    return _require(metadata, "author", "title", "desc", "footer")
+
+
+def parse_AO3(page, url):
+    base = "https://archiveofourown.org"
+    author = title = desc = None
+    stats = {name: [] for name in AO3_STATS}
+    for tag in walk(page):
+        if tag.get("id") == "chapters":
+            break  # Nothing past the work text is used
+        classes = tag.get("class") or ()
+        for name in classes:
+            if name in stats:
+                stats[name].append(tag)
+        if author is None and tag.name == "a" and "author" in tag.get("rel", ()):
+            author = tag
+        elif title is None and tag.name == "h2" and classes == ["title", "heading"]:
+            title = tag
+        elif desc is None and tag.name == "div" and classes == ["summary", "module"]:
+            desc = tag
+
+    def joined(name):
+        return " ".join(x.get_text() for x in stats[name])
+
+    def count(name):
+        return f"{int(stats[name][1].get_text().replace(',', '')):,}"
+
+    desc = "Summary not specified." if desc is None else desc.p.get_text(strip=True)
+    date, status, chapters = joined("published"), joined("status"), joined("chapters")
+    words = f"Words: {count('words')}"
+    kudos = f"Kudos: {count('kudos')}"
+    hits = f"Hits: {count('hits')}"
+    return {
+        "link": url,
+        "icon": SITE_ICONS["ao3"],
+        "thumbnail": None,
+        "author": author.get_text(strip=True),
+        "author_link": base + author["href"],
+        "title": title.get_text(strip=True),
+        "desc": desc,
+        "footer": f"{date} ∙ {status} ∙ {chapters} ∙ {words} ∙ {kudos} ∙ {hits}",
+    }
+
+
+def _blurb_count(stats, name):
+    dd = stats.find("dd", class_=name)
+    # AO3 leaves out counts that are still zero
+    return f"{int(dd.get_text().replace(',', '')) if dd else 0:,}"
+
+
+def parse_AO3_blurb(blurb):
+    """
+    Read a work's info from its blurb on an AO3 listing page, in the shape
+    parse_AO3 returns
+
+    Blurbs have no publishing date, so the footer starts with the date the
+    work was completed or last updated instead.
+    """
+    base = "https://archiveofourown.org"
+    heading = blurb.find("h4", class_="heading")
+    title = heading.a
+    author = heading.find("a", rel="author")
+    summary = blurb.find("blockquote", class_="summary")
+    if summary is None:
+        desc = "Summary not specified."
+    else:
+        desc = (summary.p or summary).get_text(strip=True)
+    status = "Completed" if blurb.find(class_="complete-yes") else "Updated"
+    date = blurb.find("p", class_="datetime").get_text(strip=True)
+    date = datetime.strptime(date, "%d %b %Y").date().isoformat()
+    stats = blurb.find("dl", class_="stats")
+    chapters = stats.find("dd", class_="chapters").get_text(strip=True)
+    chapters = f"Chapters: {chapters}"
+    words = f"Words: {_blurb_count(stats, 'words')}"
+    kudos = f"Kudos: {_blurb_count(stats, 'kudos')}"
+    hits = f"Hits: {_blurb_count(stats, 'hits')}"
+    return {
+        "link": base + title["href"],
+        "icon": SITE_ICONS["ao3"],
+        "thumbnail": None,
+        "author": author.get_text(strip=True) if author else "Anonymous",
+        "author_link": base + author["href"] if author else None,
+        "title": title.get_text(strip=True),
+        "desc": desc,
+        "footer": f"{status}: {date} ∙ {chapters} ∙ {words} ∙ {kudos} ∙ {hits}",
+    }
+
+
+def parse_AO3_listing(page, url):
+    """
+    Read every work on a page of an AO3 series, collection or user's works
+
+    Returns each work's metadata, in listing order, and the link to the
+    next page of the listing, or None on the last page.
+    """
+    works = [parse_AO3_blurb(blurb) for blurb in page.select("li.work.blurb")]
+    next_page = page.select_one("ol.pagination li.next a[href]")
+    if next_page is not None:
+        next_page = "https://archiveofourown.org" + next_page["href"]
+    return works, next_page
+
+
+def parse_SIYE(page, url):
+    base = "http://siye.co.uk"
+    font = title = None
+    cells = []
+    for tag in walk(page):
+        if tag.name == "td":
+            if tag.get("align") == "left":
+                cells.append(tag)
+        elif tag.name == "font" and font is None:
+            font = tag
+        elif tag.name == "h3" and title is None:
+            title = tag
+        if font is not None and title is not None and len(cells) > 1:
+            break
+    rows = cells[1].get_text().strip().split("\n")
+    rows = [row for row in rows if ":" in row]  # Handle completed story
+    author = font.next_sibling.next_sibling
+    desc = rows[6][9:]
+    category = rows[0]
+    characters = rows[1][:11] + " " + rows[1][11:]
+    genres = rows[2]
+    rating = rows[4]
+    return {
+        "link": url,
+        "icon": SITE_ICONS["siye"],
+        "thumbnail": None,
+        "author": author.get_text(strip=True),
+        "author_link": base + "/" + author["href"],
+        "title": title.get_text(strip=True),
+        "desc": desc,
+        "footer": f"{category} ∙ {characters} ∙ {genres} ∙ {rating}",
+    }
+
+
+PARSERS = {
+    "ffn": parse_FanFiction,
+    "ffn-author": parse_FanFiction_author,
+    "ao3": parse_AO3,
+    "siye": parse_SIYE,
+}
+
+# Extractors for the lighter pages some sites also serve, see fetch.STRATEGIES
+MOBILE_PARSERS = {
+    "ffn": parse_FanFiction_mobile,
+    "ffn-author": parse_FanFiction_author_mobile,
+}
+
+
+def parse_listing(page, url):
+    """
+    Extract every work's metadata from a page of a listing, see
+    urls.LISTING_KINDS, and the link to its next page
+    """
+    return parse_AO3_listing(page, url)
+
+
+def parse_story(page, url, strategy="desktop"):
+    """
+    Extract story metadata from a page fetched with the given strategy
+
+    The url is the story's usual link, whichever page was downloaded.
+    """
+    key = story_key(url)
+    if key is not None:
+        parsers = MOBILE_PARSERS if strategy == "mobile" else PARSERS
+        return parsers[key[0]](page, url)
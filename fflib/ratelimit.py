@@ -0,0 +1,186 @@
+import asyncio
+import random
+import time
+
+from email.utils import parsedate_to_datetime
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half-open"
+
+
+class HostUnavailable(Exception):
+    """
+    Raised when a site is throttling us, failing, or its circuit is open
+    """
+
+
+class TokenBucket:
+    """
+    Token bucket that hands out reservations, so concurrent callers queue
+    up behind each other without a lock
+    """
+
+    def __init__(self, rate, burst, clock=time.monotonic):
+        self.rate = rate
+        self.burst = burst
+        self._clock = clock
+        self._tokens = burst
+        self._updated = clock()
+        self._held_until = 0
+
+    def _refill(self):
+        now = self._clock()
+        elapsed = now - self._updated
+        self._tokens = min(self.burst, self._tokens + elapsed * self.rate)
+        self._updated = now
+        return now
+
+    def available(self):
+        """
+        Return how many tokens could be taken right now without waiting
+        """
+        now = self._refill()
+        return 0 if self._held_until > now else max(self._tokens, 0)
+
+    def take(self):
+        """
+        Take a token if one is available right now, without waiting
+        """
+        if self.available() < 1:
+            return False
+        self._tokens -= 1
+        return True
+
+    def reserve(self):
+        """
+        Take a token and return how many seconds to wait before using it
+        """
+        now = self._refill()
+        self._tokens -= 1
+        wait = -self._tokens / self.rate if self._tokens < 0 else 0
+        return max(wait, self._held_until - now)
+
+    def hold(self, seconds):
+        """
+        Stop handing out usable tokens for a while, e.g. after a 429
+        """
+        self._held_until = max(self._held_until, self._clock() + seconds)
+
+    async def acquire(self):
+        wait = self.reserve()
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+
+class CircuitBreaker:
+    """
+    Opens after threshold failures in a row and fails fast for cooldown
+    seconds, then lets a single trial request through to probe the site
+    """
+
+    def __init__(self, threshold=5, cooldown=60, clock=time.monotonic):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self._clock = clock
+        self._failures = 0
+        self._opened_at = None
+        self._trial = False
+
+    @property
+    def state(self):
+        if self._opened_at is None:
+            return CLOSED
+        elif self._clock() - self._opened_at < self.cooldown:
+            return OPEN
+        return HALF_OPEN
+
+    def allow(self):
+        state = self.state
+        if state == CLOSED:
+            return True
+        elif state == HALF_OPEN and not self._trial:
+            self._trial = True
+            return True
+        return False
+
+    def success(self):
+        self._failures = 0
+        self._opened_at = None
+        self._trial = False
+
+    def failure(self):
+        self._failures += 1
+        if self._trial or self._failures >= self.threshold:
+            self._opened_at = self._clock()
+        self._trial = False
+
+    def release(self):
+        """
+        Give back the trial request without judging the host, e.g. when it
+        was cancelled
+        """
+        self._trial = False
+
+
+class HostLimits:
+    """
+    Per-host token buckets and circuit breakers, shared by both cogs
+    """
+
+    def __init__(self, rate=2.0, burst=5, threshold=5, cooldown=60):
+        self.rate = rate
+        self.burst = burst
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.buckets = {}
+        self.breakers = {}
+
+    def configure(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.buckets.clear()
+
+    def bucket(self, host):
+        if host not in self.buckets:
+            self.buckets[host] = TokenBucket(self.rate, self.burst)
+        return self.buckets[host]
+
+    def breaker(self, host):
+        if host not in self.breakers:
+            self.breakers[host] = CircuitBreaker(self.threshold, self.cooldown)
+        return self.breakers[host]
+
+    def unhealthy(self):
+        return {
+            host: breaker.state
+            for host, breaker in self.breakers.items()
+            if breaker.state != CLOSED
+        }
+
+
+def retry_after(value):
+    """
+    Parse a Retry-After header into seconds, or None if it is unusable
+    """
+    if not value:
+        return None
+    try:
+        return max(float(value), 0)
+    except ValueError:
+        pass
+    try:
+        return max(parsedate_to_datetime(value).timestamp() - time.time(), 0)
+    except (TypeError, ValueError):
+        return None
+
+
+def backoff(attempt, base=0.5, cap=8):
+    """
+    Full-jitter exponential backoff delay for a zero-based attempt number
+    """
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+
+# One set of limits per process, shared by every cog that imports fflib
+host_limits = HostLimits()
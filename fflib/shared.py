@@ -0,0 +1,248 @@
+import asyncio
+import json
+import logging
+import math
+import os
+import sqlite3
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from pathlib import Path
+
+try:
+    from redis import asyncio as aioredis
+except ImportError:
+    aioredis = None
+
+KINDS = ("sqlite", "redis")
+
+DEFAULT_PATH = (
+    Path(os.environ.get("XDG_CACHE_HOME") or Path.home() / ".cache")
+    / "fflib"
+    / "metadata.db"
+)
+DEFAULT_URL = "redis://localhost:6379/0"
+
+log = logging.getLogger("red.fflib")
+
+MAX_ENTRIES = 20000  # Stories kept in the SQLite file
+COMPACT_EVERY = 256  # Writes between compactions of the SQLite file
+BUSY_TIMEOUT = 0.2  # Seconds to wait while another process is writing
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL,
+    negative INTEGER NOT NULL,
+    fresh_until REAL NOT NULL,
+    stale_until REAL NOT NULL
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS entries_expiry ON entries (stale_until);
+"""
+
+
+def shared_key(key):
+    """
+    Turn a (site, story ID) cache key into a string every process agrees on
+    """
+    return ":".join(str(part) for part in key)
+
+
+class SQLiteBackend:
+    """
+    Cache entries kept in a SQLite file that every process on the host opens
+
+    WAL mode lets processes read while another one writes. Opening the
+    file, lookups and writes run on a thread of their own, so waiting on
+    another process's write never holds up the event loop. Every COMPACT_EVERY writes, a
+    second thread with its own connection deletes expired entries and trims
+    the file to max_entries, dropping those closest to expiry.
+    """
+
+    kind = "sqlite"
+
+    def __init__(self, path=DEFAULT_PATH, max_entries=MAX_ENTRIES, clock=time.time):
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self.location = str(path)
+        self.max_entries = max_entries
+        self._clock = clock
+        self._writes = 0
+        self._compacting = False
+        self.db = None
+        self._executor = ThreadPoolExecutor(1, thread_name_prefix="fflib-shared")
+        self._compactor = ThreadPoolExecutor(1, thread_name_prefix="fflib-compact")
+        # Queued first, so every later call finds the connection open
+        self._opened = self._executor.submit(self._open)
+
+    def _open(self):
+        self.db = self._connect()
+        # Only takes effect on a new file, so it has to come first
+        self.db.execute("PRAGMA auto_vacuum=INCREMENTAL")
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.executescript(SCHEMA)
+
+    def _connect(self):
+        return sqlite3.connect(
+            self.location,
+            timeout=BUSY_TIMEOUT,
+            isolation_level=None,
+            check_same_thread=False,
+        )
+
+    def _call(self, func, *args):
+        self._opened.result()  # Raises whatever stopped the file opening
+        return func(*args)
+
+    async def _run(self, func, *args):
+        loop = asyncio.get_event_loop()
+        return await loop.run_in_executor(
+            self._executor, partial(self._call, func, *args)
+        )
+
+    def _execute(self, sql, params=()):
+        return self.db.execute(sql, params).fetchall()
+
+    async def get(self, key):
+        rows = await self._run(
+            self._execute,
+            "SELECT value, negative, fresh_until, stale_until FROM entries "
+            "WHERE key = ? AND stale_until > ?",
+            (key, self._clock()),
+        )
+        if not rows:
+            return None
+        value, negative, fresh_until, stale_until = rows[0]
+        return json.loads(value), bool(negative), fresh_until, stale_until
+
+    async def set(self, key, record):
+        value, negative, fresh_until, stale_until = record
+        row = (key, json.dumps(value), int(negative), fresh_until, stale_until)
+        await self._run(self._set, row)
+
+    def _set(self, row):
+        self.db.execute("INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?)", row)
+        self._writes += 1
+        if self._writes % COMPACT_EVERY == 0 and not self._compacting:
+            self._compacting = True
+            self._compactor.submit(self._compact_in_background)
+
+    async def delete(self, key):
+        await self._run(self._execute, "DELETE FROM entries WHERE key = ?", (key,))
+
+    async def clear(self):
+        await self._run(self._execute, "DELETE FROM entries")
+        await self._run(self._execute, "PRAGMA incremental_vacuum")
+
+    def _compact_in_background(self):
+        try:
+            self.compact()
+        except sqlite3.Error:
+            # Most likely another process was writing; the next round will do
+            log.debug("Compacting the shared cache failed", exc_info=True)
+        finally:
+            self._compacting = False
+
+    def compact(self):
+        """
+        Delete expired entries and any over max_entries, returning how many
+
+        This blocks, so the backend only calls it on its compaction thread.
+        """
+        db = self._connect()
+        try:
+            expired = db.execute(
+                "DELETE FROM entries WHERE stale_until <= ?", (self._clock(),)
+            ).rowcount
+            trimmed = db.execute(
+                "DELETE FROM entries WHERE key IN (SELECT key FROM entries "
+                "ORDER BY stale_until DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,),
+            ).rowcount
+            db.execute("PRAGMA incremental_vacuum").fetchall()
+        finally:
+            db.close()
+        return expired + trimmed
+
+    async def count(self):
+        rows = await self._run(self._execute, "SELECT COUNT(*) FROM entries")
+        return rows[0][0]
+
+    def _close(self):
+        if self.db is not None:
+            self.db.close()
+
+    def close(self):
+        self._executor.submit(self._close)
+        self._executor.shutdown(wait=False)
+        self._compactor.shutdown(wait=False)
+
+
+class RedisBackend:
+    """
+    Cache entries kept in Redis, or a server that speaks its protocol
+
+    Each entry expires in Redis once it can no longer be served, and the
+    server's maxmemory policy sizes the cache, so there is nothing to
+    compact here.
+    """
+
+    kind = "redis"
+
+    def __init__(
+        self, url=DEFAULT_URL, client=None, prefix="fflib:story:", clock=time.time
+    ):
+        if client is None:
+            if aioredis is None:
+                raise ValueError("Redis needs the redis package installed.")
+            client = aioredis.from_url(url)
+        self.location = url
+        self.client = client
+        self.prefix = prefix
+        self._clock = clock
+
+    async def get(self, key):
+        raw = await self.client.get(self.prefix + key)
+        if raw is None:
+            return None
+        value, negative, fresh_until, stale_until = json.loads(raw)
+        return value, negative, fresh_until, stale_until
+
+    async def set(self, key, record):
+        ttl = math.ceil(record[3] - self._clock())
+        if ttl > 0:
+            await self.client.set(self.prefix + key, json.dumps(record), ex=ttl)
+
+    async def delete(self, key):
+        await self.client.delete(self.prefix + key)
+
+    async def clear(self):
+        keys = [key async for key in self.client.scan_iter(match=self.prefix + "*")]
+        if keys:
+            await self.client.delete(*keys)
+
+    def compact(self):
+        return 0
+
+    async def count(self):
+        n = 0
+        async for _ in self.client.scan_iter(match=self.prefix + "*"):
+            n += 1
+        return n
+
+    def close(self):
+        close = getattr(self.client, "aclose", None) or self.client.close
+        asyncio.ensure_future(close())
+
+
+def open_backend(kind, location=None):
+    """
+    Open a shared cache backend, at its default location unless given one
+    """
+    if kind == "sqlite":
+        return SQLiteBackend(location or DEFAULT_PATH)
+    elif kind == "redis":
+        return RedisBackend(location or DEFAULT_URL)
+    raise ValueError(f"Unknown shared cache kind {kind!r}.")
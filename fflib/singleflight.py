@@ -0,0 +1,45 @@
+import asyncio
+
+from functools import partial
+
+
+class SingleFlight:
+    """
+    Collapse concurrent calls that share a key into one running task
+
+    Every caller awaits the task through asyncio.shield, so cancelling one
+    caller never cancels the work the other callers are waiting on.
+    """
+
+    def __init__(self):
+        self._tasks = {}
+        self.stats = {"flights": 0, "coalesced": 0}
+
+    def __contains__(self, key):
+        return key in self._tasks
+
+    def __len__(self):
+        return len(self._tasks)
+
+    def start(self, key, factory):
+        """
+        Return the task running for key, starting factory() if there is none
+        """
+        task = self._tasks.get(key)
+        if task is None:
+            task = asyncio.ensure_future(factory())
+            self._tasks[key] = task
+            task.add_done_callback(partial(self._done, key))
+            self.stats["flights"] += 1
+        else:
+            self.stats["coalesced"] += 1
+        return task
+
+    async def run(self, key, factory):
+        return await asyncio.shield(self.start(key, factory))
+
+    def _done(self, key, task):
+        if self._tasks.get(key) is task:
+            del self._tasks[key]
+        if not task.cancelled():
+            task.exception()  # Retrieve it in case every caller went away
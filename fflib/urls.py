@@ -0,0 +1,157 @@
+import re
+
+from collections import namedtuple
+from functools import lru_cache
+from urllib.parse import urlparse
+
+# A path segment, so a link ends at a space, quote or bracket, such as the >
+# of a Discord <link> without a preview, and never on sentence punctuation
+_SEGMENT = r"(?:[\w$&+,:;=?@.!*()'%-]*[\w-])?"
+
+# Every supported link, with one named group holding each site's story ID,
+# and AO3 pages that list many works
+LINK_RE = re.compile(
+    r"https?://(?:www\.)?(?:"
+    rf"(?:m\.)?fanfiction\.net/(?:"
+    rf"s/(?P<ffn>\d+)(?:/(?P<ffn_chapter>\d+)?(?P<ffn_slug>/{_SEGMENT})?)?|"
+    rf"u/(?P<ffn_author>\d+)(?P<ffn_author_slug>(?:/{_SEGMENT})*)|"
+    r"(?P<ffn_vanity>~[\w-]+))|"
+    r"archiveofourown\.org/(?:"
+    r"(?:collections/\w+/)?works/(?P<ao3>\d+)(?:/chapters/(?P<ao3_chapter>\d+))?|"
+    r"series/(?P<ao3_series>\d+)|"
+    r"collections/(?P<ao3_collection>\w+)\b(?:/works)?(?!/\w)|"
+    r"users/(?P<ao3_user>[\w-]+)(?:/pseuds/(?P<ao3_pseud>[\w%-]+))?/works)|"
+    r"siye\.co\.uk/(?P<siye_dir>(?:siye/)?)viewstory\.php\?sid=(?P<siye>\d+)"
+    r"(?:&chapter=(?P<siye_chapter>\d+))?)",
+    re.ASCII,
+)
+
+# The same pattern without capturing groups, which scans long messages about
+# as fast as a plain search; each link found is then parsed by LINK_RE once
+_SCAN_RE = re.compile(re.sub(r"\(\?P<\w+>", "(?:", LINK_RE.pattern), re.ASCII)
+
+SITE_NAMES = {"ffn": "FanFiction", "ao3": "AO3", "siye": "SIYE"}
+
+# Kinds of link to a page listing works rather than to a single story
+LISTING_KINDS = ("series", "collection", "user")
+
+_StoryRef = namedtuple("_StoryRef", ("site", "id", "chapter", "kind", "url"))
+
+
+class StoryRef(_StoryRef):
+    """
+    A link to a story or author page, with the canonical link to fetch
+
+    Site is ffn, ao3 or siye, kind is story, work or author, or one of
+    LISTING_KINDS for AO3 series, collections and a user's works, and
+    chapter is the chapter linked to, if any. FanFiction links always
+    point at chapter 1, where the story info is shown.
+    """
+
+    __slots__ = ()
+
+    @property
+    def key(self):
+        """
+        The (site, story ID) pair the metadata cache and collections use
+        """
+        # Author pages and listings have ID spaces of their own
+        if self.kind == "author":
+            return "ffn-author", self.id
+        elif self.listing:
+            return f"{self.site}-{self.kind}", self.id
+        return self.site, self.id
+
+    @property
+    def listing(self):
+        return self.kind in LISTING_KINDS
+
+
+@lru_cache(maxsize=4096)
+def _ref(link):
+    (
+        ffn,
+        ffn_chapter,
+        ffn_slug,
+        author,
+        author_slug,
+        vanity,
+        ao3,
+        ao3_chapter,
+        series,
+        collection,
+        user,
+        pseud,
+        siye_dir,
+        siye,
+        siye_chapter,
+    ) = LINK_RE.match(link).groups()
+    if ffn:
+        url = f"https://www.fanfiction.net/s/{ffn}/1{ffn_slug or ''}"
+        return StoryRef("ffn", ffn, ffn_chapter and int(ffn_chapter), "story", url)
+    elif ao3:
+        url = f"https://archiveofourown.org/works/{ao3}"
+        if ao3_chapter:
+            url += f"/chapters/{ao3_chapter}"
+        return StoryRef("ao3", ao3, ao3_chapter and int(ao3_chapter), "work", url)
+    elif series:
+        url = f"https://archiveofourown.org/series/{series}"
+        return StoryRef("ao3", series, None, "series", url)
+    elif collection:
+        url = f"https://archiveofourown.org/collections/{collection}/works"
+        return StoryRef("ao3", collection, None, "collection", url)
+    elif user:
+        name = f"{user}/pseuds/{pseud}" if pseud else user
+        url = f"https://archiveofourown.org/users/{name}/works"
+        return StoryRef("ao3", name, None, "user", url)
+    elif siye:
+        # SIYE's certificate is invalid, so it is fetched over plain HTTP
+        url = f"http://siye.co.uk/{siye_dir}viewstory.php?sid={siye}"
+        if siye_chapter:
+            url += f"&chapter={siye_chapter}"
+        chapter = siye_chapter and int(siye_chapter)
+        return StoryRef("siye", siye, chapter, "story", url)
+    elif author:
+        url = f"https://www.fanfiction.net/u/{author}{author_slug}"
+        return StoryRef("ffn", author, None, "author", url)
+    url = f"https://www.fanfiction.net/{vanity}"
+    return StoryRef("ffn", vanity, None, "author", url)
+
+
+def find_stories(text):
+    """
+    Return a StoryRef for every supported link in text, in order
+    """
+    return [_ref(link) for link in _SCAN_RE.findall(text)]
+
+
+def story_ref(url):
+    """
+    Return the StoryRef for the first supported link in url, or None
+    """
+    match = _SCAN_RE.search(url)
+    return _ref(match.group()) if match else None
+
+
+def story_key(url):
+    """
+    Return the (site, story ID) pair identifying the story behind a link
+    """
+    ref = story_ref(url)
+    return ref.key if ref else None
+
+
+def story_id(url):
+    """
+    Return the story key as a "site:ID" string, for storing in Config
+    """
+    key = story_key(url)
+    return ":".join(key) if key else None
+
+
+def site_of(url):
+    """
+    Return the site a link belongs to, for labelling metrics
+    """
+    key = story_key(url)
+    return key[0] if key else urlparse(url).netloc
@@ -1,5 +1,6 @@
 from .ffpicker import FFPicker
 
-def setup(bot):
+async def setup(bot):
     cog = FFPicker(bot)
+    await cog.initialize()
     bot.add_cog(cog)
@@ -1,15 +1,52 @@
-import aiohttp
 import asyncio
 import discord
-import re
+import logging
+import tempfile
+import time
 
-from bs4 import BeautifulSoup
+from datetime import datetime, timezone
+from fflib import (
+    MAX_LISTING_PAGES,
+    SITE_ICONS,
+    SITE_NAMES,
+    fetch_listing,
+    fetch_story,
+    find_stories,
+    http_client,
+    metadata_cache,
+    metrics,
+    parse_pool,
+    site_of,
+    story_id,
+    story_key,
+    story_ref,
+)
 from random import randint
 from redbot.core import checks, commands, Config
-from redbot.core.utils.menus import menu, DEFAULT_CONTROLS
+from redbot.core.data_manager import cog_data_path
 
+from .pages import StoryPages, page_menu
+from .prefetch import Prefetcher
+from .search import SearchIndex
+from .snapshots import SnapshotRefresher, apply_snapshot, has_snapshot
+from .stats import CollectionStats
+from .store import ENGINES, ConfigStore, SQLiteStore
+from .transfer import (
+    EXPORT_FORMATS,
+    IMPORT_BATCH,
+    IMPORT_CONCURRENCY,
+    IMPORT_MAX_BYTES,
+    PROGRESS_INTERVAL,
+    chunked,
+    write_export,
+)
 
-__version__ = "1.1.16"
+
+__version__ = "1.12.10"
+
+log = logging.getLogger("red.ffpicker")
+
+TOP_ADDERS = 5  # Members shown in ffpicker stats
 
 BaseCog = getattr(commands, "Cog", object)
 
@@ -22,14 +59,167 @@ class FFPicker(BaseCog):
 
     def __init__(self, bot):
         self.bot = bot
-        self.session = aiohttp.ClientSession()
+        self.http = http_client
+        self.http.acquire()
+        self.cache = metadata_cache
+        self.parse_pool = parse_pool
+        self.parse_pool.acquire()
         self.config = Config.get_conf(
             self, identifier=482071529, force_registration=True
         )
-        self.config.register_guild(stories=[])
+        self.config.register_global(storage="config")
+        self.config.register_guild(stories=[], progressive=False)
+        self.store = ConfigStore(self.config)
+        self._index = {}
+        self._pages = {}
+        self._search = {}
+        self._stats = {}
+        self.refresher = SnapshotRefresher(self)
+        self.prefetcher = Prefetcher(self)
+
+    async def initialize(self):
+        """
+        Give stories saved before canonical keys existed their key
+        """
+        for guild_id, data in (await self.config.all_guilds()).items():
+            stories = data.get("stories", [])
+            missing = [story for story in stories if "key" not in story]
+            for story in missing:
+                story["key"] = story_id(story["link"])
+            if missing:
+                guild = discord.Object(id=guild_id)
+                await self.config.guild(guild).stories.set(stories)
+        self.store = self.open_store(await self.config.storage())
+        self.refresher.start()
+
+    def open_store(self, engine):
+        if engine == "sqlite":
+            return SQLiteStore(cog_data_path(self) / "stories.db")
+        return ConfigStore(self.config)
+
+    async def story_index(self, guild):
+        """
+        Return the canonical keys of a server's stories, counted
+        """
+        if guild.id not in self._index:
+            self._index[guild.id] = await self.store.keys(guild)
+        return self._index[guild.id]
+
+    async def listing_pages(self, guild):
+        """
+        Return the server's listing pages, reusing pages already rendered
+        """
+        if guild.id not in self._pages:
+            stories = await self.store.stories(guild)
+            self._pages[guild.id] = StoryPages(guild, stories)
+        return self._pages[guild.id]
+
+    def prefetch_page(self, guild, pages):
+        """
+        Return a page_menu callback that warms the stories on each page shown
+        """
+        return lambda idx: self.prefetcher.warm(guild, pages.page_stories(idx))
+
+    def cached_metadata(self, key):
+        return self.cache.peek(tuple(key.split(":", 1))) if key else None
+
+    async def search_index(self, guild):
+        """
+        Return the server's search index, building it on first use
+        """
+        if guild.id not in self._search:
+            stories = await self.store.all_stories(guild)
+            index = SearchIndex()
+            index.build(
+                (story.get("key"), story, self.cached_metadata(story.get("key")))
+                for story in stories
+            )
+            self._search[guild.id] = index
+        return self._search[guild.id]
+
+    async def collection_stats(self, guild):
+        """
+        Return the server's collection stats, building them on first use
+        """
+        if guild.id not in self._stats:
+            stats = CollectionStats()
+            stats.build(await self.store.index_rows(guild))
+            self._stats[guild.id] = stats
+        return self._stats[guild.id]
+
+    async def save_snapshots(self, guild, snapshots, dead=()):
+        """
+        Write refreshed snapshots, dead link flags and view counts in one go
+        """
+        views = self.refresher.views.pop(guild.id, {})
+        refreshed = await self.store.update(guild, snapshots, dead, views, time.time())
+        # The listing only has to be built again if a title or author changed
+        pages = self._pages.get(guild.id)
+        changes = refreshed + [{"key": key, "dead": True} for key in dead]
+        if pages is not None and not await pages.update(changes):
+            del self._pages[guild.id]
+        if guild.id in self._search:
+            for story in refreshed:
+                self._search[guild.id].add(story["key"], story)
+
+    @staticmethod
+    def log_failure(url, error):
+        log.info("Failed to retrieve %s: %r", url, error)
+        metrics.incr("failed_links", site_of(url), type(error).__name__)
+
+    def new_story(self, key, metadata, user):
+        story = {
+            "title": metadata["title"],
+            "author": metadata["author"],
+            "link": metadata["link"],
+            "user_id": user.id,
+            "key": key,
+            "added_at": time.time(),
+        }
+        apply_snapshot(story, metadata)
+        return story
+
+    async def append_stories(self, guild, new):
+        """
+        Append stories in a single write, skipping duplicates
+
+        Returns the stories that were added and the new collection size.
+        """
+        index = await self.story_index(guild)
+        added = []
+        for story in new:
+            if not index[story["key"]]:
+                index[story["key"]] += 1
+                added.append(story)
+        if not added:
+            return added, sum(index.values())
+        total = await self.store.append(guild, added)
+        self._pages.pop(guild.id, None)
+        if guild.id in self._search:
+            for story in added:
+                self._search[guild.id].add(story["key"], story)
+        if guild.id in self._stats:
+            for story in added:
+                self._stats[guild.id].add(
+                    story["key"], story["user_id"], story["added_at"]
+                )
+        return added, total
 
     def cog_unload(self):
-        self.bot.loop.create_task(self.session.close())
+        self.refresher.stop()
+        self.prefetcher.stop()
+        self.bot.loop.create_task(self.close_store())
+        self.http.release()
+        self.parse_pool.release()
+
+    async def close_store(self):
+        """
+        Write out the view counts not saved yet, then close the story store
+        """
+        try:
+            await self.refresher.flush_views()
+        finally:
+            self.store.close()
 
     @commands.guild_only()
     @commands.group(name="ffpicker", invoke_without_command=True)
@@ -46,32 +236,16 @@ class FFPicker(BaseCog):
         else:
             page_num = int(page_num)
 
-        listing = ""
-        stories = await self.config.guild(ctx.guild).stories()
-        if not stories:
+        pages = await self.listing_pages(ctx.guild)
+        if not pages.stories:
             await ctx.send("There are no stories to show, add some!")
             return
-        for idx, story in enumerate(stories, 1):
-            listing += (
-                f"**{idx}** [{story['title']}]({story['link']}) "
-                f"by {story['author']}\n"
-            )
-            if idx % 10 == 0:
-                listing += "\n"
-
-        embeds = []
-        pages = listing.strip().split("\n\n")
-        for idx, page in enumerate(pages, 1):
-            em = discord.Embed(description=page, color=0x7289DA)
-            em.set_author(
-                name=f"{ctx.guild.name}'s Story Collection", icon_url=ctx.guild.icon_url
-            )
-            em.set_footer(
-                text=f"Page {idx:,} of {len(pages):,} • Total stories: {len(stories):,}"
-            )
-            embeds.append(em)
-
-        await menu(ctx, embeds, DEFAULT_CONTROLS, page=page_num - 1)
+        await page_menu(
+            ctx,
+            pages,
+            page=min(page_num, len(pages)) - 1,
+            on_page=self.prefetch_page(ctx.guild, pages),
+        )
 
     @commands.guild_only()
     @picker.command(hidden=True)
@@ -101,116 +275,38 @@ class FFPicker(BaseCog):
         except asyncio.TimeoutError:
             await ctx.send("No confirmation received. No changes were made.")
         else:
-            await self.config.guild(ctx.guild).clear()
+            await self.store.clear(ctx.guild)
+            self._index.pop(ctx.guild.id, None)
+            self._pages.pop(ctx.guild.id, None)
+            self._search.pop(ctx.guild.id, None)
+            self._stats.pop(ctx.guild.id, None)
+            self.prefetcher.forget(ctx.guild.id)
             await ctx.send("All the stories have been removed.")
 
-    def parse_url(self, message):
-        url_regex = (
-            r"https?://(?:www.)?(?:(?:m.)?fanfiction.net/"
-            r"s/\d+/?(?:[a-zA-Z]|[0-9]|[$-_@.&+]|[!*\(\),])*|"
-            r"archiveofourown.org/works/\d+(?:/chapters/\d+)?|"
-            r"siye.co.uk/(?:siye/)?viewstory.php\?sid=\d+(?:&chapter=\d+)?)"
-        )
-        urls = re.findall(url_regex, message)
-        for i, url in enumerate(urls):
-            url = url.replace("//m.", "//")
-            # Handle invalid certificate for SIYE
-            url = url.replace("https", "http") if "siye" in url else url
-            # Redirect FanFiction stories to chapter 1
-            if re.search(r"fanfiction.net/s/\d+", url):
-                sp = url.split("/")
-                url = "/".join(sp[:5] + ["1"] + sp[6:])
-            urls[i] = url
-        return urls
-
-    async def fetch_url(self, url):
-        # AO3 presents warning page for NSFW-tagged stories
-        if "archiveofourown" in url:
-            url = url + "?view_adult=true"
-        async with self.session.get(url, timeout=8) as r:
-            html = await r.text()
-            page = BeautifulSoup(html, "html.parser")
-        if "archiveofourown" in url and page.select("p[class='message footnote']"):
-            chapter = page.select("ul[class='actions']")[0].find("a")["href"]
-            url = "https://archiveofourown.org" + chapter
-            async with self.session.get(url, timeout=8) as r:
-                html = await r.text()
-                page = BeautifulSoup(html, "html.parser")
-        return page
-
-    def parse_FanFiction(self, page, url):
-        base = "https://fanfiction.net"
-        div = page.find(id="profile_top")
-        thumbnail = div.find("img", attrs={"class": "cimage"})
-        author = div.find("a", attrs={"class": "xcontrast_txt"})
-        title = div.find("b", attrs={"class": "xcontrast_txt"})
-        desc = div.find("div", attrs={"class": "xcontrast_txt"})
-        footer = div.find("span", attrs={"class": "xgray xcontrast_txt"})
-        footer = ": ".join(x.strip() for x in footer.get_text().split(":"))
-        return {
-            "link": url,
-            "icon": "https://i.imgur.com/0eUBQHu.png",
-            "thumbnail": "https:" + thumbnail["src"] if thumbnail else None,
-            "author": author.get_text(strip=True),
-            "author_link": base + author["href"],
-            "title": title.get_text(strip=True),
-            "desc": desc.get_text(strip=True),
-            "footer": " ∙ ".join(footer.split("-")[:-1]),
-        }
+    @staticmethod
+    def story_links(text):
+        """
+        Return the story links in text, leaving out author pages and AO3
+        listings
+        """
+        return [
+            ref
+            for ref in find_stories(text)
+            if ref.kind != "author" and not ref.listing
+        ]
 
-    def parse_AO3(self, page, url):
-        base = "https://archiveofourown.org"
-        author = page.find("a", attrs={"rel": "author"})
-        title = page.find("h2", attrs={"class": "title heading"})
-        desc = page.find("div", attrs={"class": "summary module"})
-        desc = "Summary not specified." if desc is None else desc.p.get_text(strip=True)
-        date = " ".join(x.get_text() for x in page.find_all(class_="published"))
-        status = " ".join(x.get_text() for x in page.find_all(class_="status"))
-        chapters = " ".join(x.get_text() for x in page.find_all(class_="chapters"))
-        words = f"Words: {int(page.find_all(class_='words')[1].get_text()):,}"
-        kudos = f"Kudos: {int(page.find_all(class_='kudos')[1].get_text()):,}"
-        hits = f"Hits: {int(page.find_all(class_='hits')[1].get_text()):,}"
-        return {
-            "link": url,
-            "icon": "https://i.imgur.com/oJtk1Gp.png",
-            "thumbnail": None,
-            "author": author.get_text(strip=True),
-            "author_link": base + author["href"],
-            "title": title.get_text(strip=True),
-            "desc": desc,
-            "footer": f"{date} ∙ {status} ∙ {chapters} ∙ {words} ∙ {kudos} ∙ {hits}",
-        }
+    async def get_metadata(self, url):
+        # Stored links may predate canonical links, e.g. FanFiction links
+        # without www., which the mobile strategy can't rewrite
+        ref = story_ref(url)
+        canonical = ref.url if ref is not None else url
 
-    def parse_SIYE(self, page, url):
-        base = "http://siye.co.uk"
-        table_cell = page.find_all("td", attrs={"align": "left"})[1].get_text()
-        rows = table_cell.strip().split("\n")
-        rows = [row for row in rows if ":" in row]  # Handle completed story
-        author = page.find("font").next_sibling.next_sibling
-        title = page.find("h3")
-        desc = rows[6][9:]
-        category = rows[0]
-        characters = rows[1][:11] + " " + rows[1][11:]
-        genres = rows[2]
-        rating = rows[4]
-        return {
-            "link": url,
-            "icon": "https://i.imgur.com/TXRYIBN.jpg",
-            "thumbnail": None,
-            "author": author.get_text(strip=True),
-            "author_link": base + "/" + author["href"],
-            "title": title.get_text(strip=True),
-            "desc": desc,
-            "footer": f"{category} ∙ {characters} ∙ {genres} ∙ {rating}",
-        }
+        async def load():
+            return await fetch_story(self.http.session, canonical)
 
-    def parse(self, page, url):
-        if "fanfiction" in url:
-            return self.parse_FanFiction(page, url)
-        elif "archiveofourown" in url:
-            return self.parse_AO3(page, url)
-        elif "siye" in url:
-            return self.parse_SIYE(page, url)
+        metadata = await self.cache.get_or_load(story_key(url), load)
+        # Other chapter links of the same story share one cache entry
+        return dict(metadata, link=url if metadata["link"] else None)
 
     def format_embed(self, metadata):
         em = discord.Embed(
@@ -229,53 +325,349 @@ class FFPicker(BaseCog):
             em.set_thumbnail(url=metadata["thumbnail"])
         return em
 
+    def skeleton_embed(self, story, desc="Fetching story info…"):
+        """
+        Return a placeholder embed from what the collection already holds
+        for a story
+        """
+        em = discord.Embed(
+            title=story["title"], url=story["link"], description=desc, color=0x7289DA
+        )
+        icon = SITE_ICONS.get(site_of(story["link"]))
+        if icon is None:
+            # A stored link to a site fflib no longer recognises
+            em.set_author(name=story["author"])
+        else:
+            em.set_author(name=story["author"], icon_url=icon)
+        return em
+
     @commands.guild_only()
     @picker.command(name="add")
     async def addfic(self, ctx, url):
         """
         Add a story to the collection
+
+        A link to an AO3 series, collection or user's works adds every work
+        listed there.
         """
         await ctx.trigger_typing()
-        url = self.parse_url(url)
-        if not url:
+        ref = story_ref(url)
+        if ref is not None and ref.listing:
+            await self.add_listing(ctx, ref)
+            return
+        refs = self.story_links(url)
+        if not refs:
             await ctx.send("Invalid link. No story added.")
             return
 
+        url = refs[0].url
+        key = ":".join(refs[0].key)
+        index = await self.story_index(ctx.guild)
+        duplicate = (
+            "That story already exists in the collection. "
+            "Duplicate stories will not be added."
+        )
+        if index[key]:
+            await ctx.send(duplicate)
+            return
+
         try:
-            url = url[0]
-            page = await self.fetch_url(url)
-            metadata = self.parse(page, url)
+            metadata = await self.get_metadata(url)
         except Exception as e:
-            print(e)
+            self.log_failure(url, e)
             await ctx.send("Failed to retrieve and add story.")
             return
 
-        guild_conf = self.config.guild(ctx.guild)
-        if any(
-            story["title"] == metadata["title"]
-            and story["author"] == metadata["author"]
-            for story in await guild_conf.stories()
-        ):
+        story = self.new_story(key, metadata, ctx.author)
+        added, stories_len = await self.append_stories(ctx.guild, [story])
+        if not added:
+            # Someone added it while the story was being fetched
+            await ctx.send(duplicate)
+            return
+        msg = (
+            f"**{metadata['title']}** by **{metadata['author']}** "
+            f"has been added to the collection as story #{stories_len:,}."
+        )
+        with metrics.timer("format", site_of(url)):
+            em = self.format_embed(metadata)
+        with metrics.timer("send", "discord"):
+            await ctx.send(msg, embed=em)
+
+    async def add_listing(self, ctx, ref):
+        """
+        Add every work on an AO3 listing, reading each work's info off the
+        listing pages rather than fetching the works one by one
+        """
+        try:
+            works, more = await fetch_listing(self.http.session, ref.url)
+        except Exception as e:
+            self.log_failure(ref.url, e)
+            await ctx.send("Failed to retrieve the listed works. No stories added.")
+            return
+        if not works:
+            await ctx.send("No works are listed there. No stories added.")
+            return
+
+        new = []
+        for metadata in works:
+            key = story_key(metadata["link"])
+            await self.cache.put(key, metadata)
+            new.append(self.new_story(":".join(key), metadata, ctx.author))
+        added, stories_len = await self.append_stories(ctx.guild, new)
+        msg = (
+            f"Added {len(added):,} of the {len(works):,} listed works to the "
+            f"collection, which now has {stories_len:,} stories."
+        )
+        if len(added) < len(works):
+            msg += " The rest were already in it."
+        if more:
+            msg += (
+                f" Only the first {MAX_LISTING_PAGES} pages of the listing "
+                "were read."
+            )
+        await ctx.send(msg)
+
+    @checks.admin_or_permissions(administrator=True)
+    @commands.guild_only()
+    @picker.command(name="import")
+    async def importfic(self, ctx):
+        """
+        Add every story linked in an attached text or CSV file
+        """
+        if not ctx.message.attachments:
+            await ctx.send("Attach a text or CSV file of story links to import.")
+            return
+        attachment = ctx.message.attachments[0]
+        if attachment.size > IMPORT_MAX_BYTES:
+            await ctx.send("That file is too large to import. No stories added.")
+            return
+
+        text = (await attachment.read()).decode("utf-8", errors="replace")
+        index = await self.story_index(ctx.guild)
+        todo = {}
+        refs = self.story_links(text)
+        for ref in refs:
+            key = ":".join(ref.key)
+            if not index[key]:
+                todo.setdefault(key, ref.url)
+        skipped = len(refs) - len(todo)
+        listings = sum(ref.listing for ref in find_stories(text))
+        note = (
+            f" {listings:,} AO3 series, collection or user link(s) left out, "
+            "add those with `ffpicker add`."
+            if listings
+            else ""
+        )
+        if not refs:
+            await ctx.send(f"Found no story links. No stories added.{note}")
+            return
+        elif not todo:
             await ctx.send(
-                "That story already exists in the collection. "
-                "Duplicate stories will not be added."
+                f"Found {len(refs):,} links, but all of them are already in the "
+                f"collection. No stories added.{note}"
             )
-        else:
-            async with guild_conf.stories() as stories:
-                story = {
-                    "title": metadata["title"],
-                    "author": metadata["author"],
-                    "link": metadata["link"],
-                    "user_id": ctx.author.id,
-                }
-                stories.append(story)
-                stories_len = len(stories)
-            msg = (
-                f"**{metadata['title']}** by **{metadata['author']}** "
-                f"has been added to the collection as story #{stories_len:,}."
+            return
+
+        progress = await ctx.send(f"Importing {len(todo):,} stories...")
+        slots = asyncio.Semaphore(IMPORT_CONCURRENCY)
+        added = failed = done = 0
+        last_edit = time.monotonic()
+
+        async def resolve(key, url):
+            nonlocal done
+            async with slots:
+                try:
+                    metadata = await self.get_metadata(url)
+                except Exception as e:
+                    self.log_failure(url, e)
+                    metadata = None
+            done += 1
+            return key, metadata
+
+        for batch in chunked(list(todo.items()), IMPORT_BATCH):
+            results = await asyncio.gather(*(resolve(k, u) for k, u in batch))
+            new = [
+                self.new_story(key, metadata, ctx.author)
+                for key, metadata in results
+                if metadata is not None
+            ]
+            failed += len(results) - len(new)
+            added += len((await self.append_stories(ctx.guild, new))[0])
+            if time.monotonic() - last_edit > PROGRESS_INTERVAL:
+                last_edit = time.monotonic()
+                await progress.edit(
+                    content=f"Importing stories... {done:,} of {len(todo):,} done."
+                )
+
+        await progress.edit(
+            content=(
+                f"Imported {added:,} stories. {skipped:,} duplicate link(s) "
+                f"skipped, {failed:,} failed to retrieve.{note}"
             )
-            em = self.format_embed(metadata)
-            await ctx.send(msg, embed=em)
+        )
+
+    @commands.guild_only()
+    @picker.command(name="export")
+    async def exportfic(self, ctx, fmt="jsonl"):
+        """
+        Export the collection as a JSONL or CSV file
+        """
+        fmt = fmt.lower()
+        if fmt not in EXPORT_FORMATS:
+            await self.bot.send_help_for(ctx, ctx.command)
+            return
+        pages = await self.listing_pages(ctx.guild)
+        if not pages.stories:
+            await ctx.send("There are no stories to export, add some!")
+            return
+
+        with tempfile.TemporaryFile() as fp:
+            write_export(fp, await self.store.all_stories(ctx.guild), fmt)
+            if fp.tell() > ctx.guild.filesize_limit:
+                await ctx.send("The collection is too large to upload as a file.")
+                return
+            fp.seek(0)
+            await ctx.send(file=discord.File(fp, filename=f"stories.{fmt}"))
+
+    @commands.guild_only()
+    @picker.command(name="search")
+    async def searchfic(self, ctx, *, query):
+        """
+        Search the collection by title, author, site, summary or details
+
+        Every word has to match the start of a word in the story, so
+        `ffpicker search harr ao3` finds AO3 stories mentioning Harry.
+        """
+        index = await self.search_index(ctx.guild)
+        await self.show_matches(
+            ctx,
+            index.search(query),
+            title=f"Stories matching “{query[:200]}”",
+            empty="No stories match that search.",
+        )
+
+    async def show_matches(self, ctx, keys, title, empty):
+        """
+        Page through the stories with the given keys, numbered as in the
+        whole collection
+        """
+        pages = await self.listing_pages(ctx.guild)
+        found = [await pages.position(key) for key in keys]
+        found = sorted(pos for pos in found if pos is not None)
+        if not found:
+            await ctx.send(empty)
+            return
+        results = StoryPages(
+            ctx.guild,
+            [await pages.story(pos) for pos in found],
+            numbers=[pos + 1 for pos in found],
+            title=title,
+        )
+        await page_menu(ctx, results, on_page=self.prefetch_page(ctx.guild, results))
+
+    @commands.guild_only()
+    @picker.command(name="stats")
+    async def statsfic(self, ctx):
+        """
+        Show how many stories each site and member account for
+        """
+        stats = await self.collection_stats(ctx.guild)
+        if not stats.total:
+            await ctx.send("There are no stories to show, add some!")
+            return
+        now = time.time()
+        week = stats.count_added(now - 7 * 86400)
+        month = stats.count_added(now - 30 * 86400)
+        em = discord.Embed(color=0x7289DA)
+        em.set_author(
+            name=f"{ctx.guild.name}'s Story Collection", icon_url=ctx.guild.icon_url
+        )
+        em.add_field(name="Stories", value=f"{stats.total:,}")
+        em.add_field(name="Added This Week", value=f"{week:,}")
+        em.add_field(name="Added This Month", value=f"{month:,}")
+        em.add_field(
+            name="Sites",
+            value="\n".join(
+                f"{SITE_NAMES.get(site, site)}: {n:,}"
+                for site, n in stats.sites.most_common()
+            ),
+        )
+        adders = []
+        for user_id, n in stats.top_users(TOP_ADDERS):
+            member = ctx.guild.get_member(user_id)
+            name = member.display_name if member else "Unknown Member"
+            adders.append(f"{name}: {n:,}")
+        em.add_field(name="Top Adders", value="\n".join(adders))
+        em.set_footer(text=f"{len(stats.users):,} member(s) have added stories.")
+        await ctx.send(embed=em)
+
+    @commands.guild_only()
+    @picker.group(name="list", invoke_without_command=True)
+    async def listfic(self, ctx):
+        """
+        List only the stories added by a member, from a site or in a period
+        """
+        await self.bot.send_help_for(ctx, ctx.command)
+
+    @commands.guild_only()
+    @listfic.command(name="by")
+    async def listfic_by(self, ctx, member: discord.Member):
+        """
+        List the stories a member added
+        """
+        stats = await self.collection_stats(ctx.guild)
+        await self.show_matches(
+            ctx,
+            stats.by_user(member.id),
+            title=f"Stories added by {member.display_name}",
+            empty=f"{member.display_name} has not added any stories.",
+        )
+
+    @commands.guild_only()
+    @listfic.command(name="site")
+    async def listfic_site(self, ctx, site: str):
+        """
+        List the stories from a site (ffn, ao3 or siye)
+        """
+        site = site.lower()
+        if site not in SITE_NAMES:
+            await ctx.send(f"Site must be one of {', '.join(SITE_NAMES)}.")
+            return
+        stats = await self.collection_stats(ctx.guild)
+        await self.show_matches(
+            ctx,
+            stats.by_site(site),
+            title=f"{SITE_NAMES[site]} Stories",
+            empty=f"There are no {SITE_NAMES[site]} stories in the collection.",
+        )
+
+    @commands.guild_only()
+    @listfic.command(name="added")
+    async def listfic_added(self, ctx, start: str, end: str = None):
+        """
+        List the stories added from one date to another, inclusive
+
+        Dates are in UTC and written as YYYY-MM-DD. Leave out the end date
+        to list everything added since the start date.
+        """
+        try:
+            since = datetime.strptime(start, "%Y-%m-%d")
+            until = datetime.strptime(end, "%Y-%m-%d") if end else None
+        except ValueError:
+            await ctx.send("Dates must be written as YYYY-MM-DD.")
+            return
+        period = f"since {start}" if end is None else f"from {start} to {end}"
+        stats = await self.collection_stats(ctx.guild)
+        keys = stats.added_between(
+            since.replace(tzinfo=timezone.utc).timestamp(),
+            until and until.replace(tzinfo=timezone.utc).timestamp() + 86400,
+        )
+        await self.show_matches(
+            ctx,
+            keys,
+            title=f"Stories added {period}",
+            empty=f"No stories were added {period}.",
+        )
 
     @commands.guild_only()
     @picker.command(name="remove")
@@ -293,33 +685,41 @@ class FFPicker(BaseCog):
             num = int(num)
 
         await ctx.trigger_typing()
-        guild_conf = self.config.guild(ctx.guild)
-        async with guild_conf.stories() as stories:
-            try:
-                idx = num - 1
-                story = stories[idx]
-                user = ctx.guild.get_member(story["user_id"])
-            except IndexError:
-                await ctx.send(
-                    "No story found with that index number. No story removed."
-                )
-                return
+        idx = num - 1
+        not_found = "No story found with that index number. No story removed."
+        try:
+            story = await self.store.story(ctx.guild, idx)
+        except IndexError:
+            await ctx.send(not_found)
+            return
 
-            if (
-                user.id == ctx.author.id
-                or await self.bot.is_owner(ctx.author)
-                or ctx.guild.permissions_for(ctx.author).administrator
-            ):
-                stories.pop(idx)
-                user = "Unknown Member" if not user else user.display_name
-                await ctx.send(
-                    f"**{story['title']}** by **{story['author']}** "
-                    f"(story #{num:,} added by {user}) has been removed."
-                )
-            else:
-                await ctx.send(
-                    "You can only remove stories you added. No story removed."
-                )
+        if not (
+            story["user_id"] == ctx.author.id
+            or await self.bot.is_owner(ctx.author)
+            or ctx.guild.permissions_for(ctx.author).administrator
+        ):
+            await ctx.send("You can only remove stories you added. No story removed.")
+            return
+
+        key = story.get("key")
+        if await self.store.remove(ctx.guild, idx, key) is None:
+            await ctx.send(not_found)
+            return
+        index = await self.story_index(ctx.guild)
+        index[key] -= 1
+        self._pages.pop(ctx.guild.id, None)
+        if ctx.guild.id in self._search and index[key] < 1:
+            self._search[ctx.guild.id].remove(key)
+        if ctx.guild.id in self._stats:
+            self._stats[ctx.guild.id].remove(
+                key, story["user_id"], story.get("added_at")
+            )
+        user = ctx.guild.get_member(story["user_id"])
+        user = "Unknown Member" if not user else user.display_name
+        await ctx.send(
+            f"**{story['title']}** by **{story['author']}** "
+            f"(story #{num:,} added by {user}) has been removed."
+        )
 
     @commands.guild_only()
     @picker.command(name="show")
@@ -336,28 +736,74 @@ class FFPicker(BaseCog):
         else:
             num = int(num)
 
-        await ctx.trigger_typing()
-        stories = await self.config.guild(ctx.guild).stories()
+        pages = await self.listing_pages(ctx.guild)
         try:
             idx = num - 1
-            story = stories[idx]
+            story = await pages.story(idx)
             url = story["link"]
         except IndexError:
             await ctx.send("No story found with that index number. Nothing to show.")
             return
 
-        try:
-            page = await self.fetch_url(url)
-            metadata = self.parse(page, url)
-        except Exception as e:
-            print(e)
-            await ctx.send(f"Failed to retrieve and show story #{num:,}.")
+        user = ctx.guild.get_member(story["user_id"])
+        user = "Unknown Member" if not user else user.display_name
+        msg = f"Showing story #{num:,} added by {user}."
+        if story.get("dead"):
+            msg += " This link may no longer work."
+
+        fetched = not has_snapshot(story)
+        placeholder = None
+        if not fetched:
+            metadata = story
         else:
-            user = ctx.guild.get_member(story["user_id"])
-            user = "Unknown Member" if not user else user.display_name
-            msg = f"Showing story #{num:,} added by {user}."
+            start = time.perf_counter()
+            if (
+                await self.config.guild(ctx.guild).progressive()
+                and self.cached_metadata(story.get("key")) is None
+            ):
+                placeholder = await ctx.send(msg, embed=self.skeleton_embed(story))
+                metrics.observe("skeleton", "ffpicker", time.perf_counter() - start)
+            else:
+                await ctx.trigger_typing()
+            try:
+                metadata = await self.get_metadata(url)
+            except Exception as e:
+                self.log_failure(url, e)
+                failed = f"Failed to retrieve and show story #{num:,}."
+                if placeholder is None:
+                    await ctx.send(failed)
+                else:
+                    em = self.skeleton_embed(story, "Failed to retrieve story.")
+                    await placeholder.edit(content=failed, embed=em)
+                return
+            await self.save_snapshots(ctx.guild, {story.get("key"): metadata})
+
+        self.refresher.record_view(ctx.guild.id, story.get("key"))
+        self.prefetcher.record_show(ctx.guild.id, story, fetched)
+        with metrics.timer("format", site_of(url)):
             em = self.format_embed(metadata)
-            await ctx.send(msg, embed=em)
+        if placeholder is None:
+            with metrics.timer("send", "discord"):
+                await ctx.send(msg, embed=em)
+            return
+        with metrics.timer("edit", "discord"):
+            await placeholder.edit(content=msg, embed=em)
+        metrics.observe("complete", "ffpicker", time.perf_counter() - start)
+
+    @checks.admin_or_permissions(administrator=True)
+    @commands.guild_only()
+    @picker.command(name="progressive")
+    async def progressive(self, ctx):
+        """
+        Toggle showing a story's saved title straight away while its info is
+        fetched, filled in once it arrives
+        """
+        toggle = not await self.config.guild(ctx.guild).progressive()
+        await self.config.guild(ctx.guild).progressive.set(toggle)
+        if toggle:
+            await ctx.send("Progressive embeds are now on in this server.")
+        else:
+            await ctx.send("Progressive embeds are now off in this server.")
 
     @commands.guild_only()
     @picker.command(name="random")
@@ -365,7 +811,86 @@ class FFPicker(BaseCog):
         """
         Show a random story from the collection
         """
-        stories = await self.config.guild(ctx.guild).stories()
+        pages = await self.listing_pages(ctx.guild)
+        if not pages.stories:
+            await ctx.send("There are no stories to show, add some!")
+            return
+        # Picks are drawn ahead of time so they can be fetched before use
+        key = await self.prefetcher.draw(ctx.guild, pages)
+        pos = await pages.position(key) if key else None
+        if pos is None:
+            pos = randint(0, len(pages.stories) - 1)
         cmd = self.bot.get_command("ffpicker show")
-        random_num = randint(1, len(stories))
-        await ctx.invoke(cmd, num=str(random_num))
+        await ctx.invoke(cmd, num=str(pos + 1))
+
+    @checks.is_owner()
+    @picker.command(name="prefetch")
+    async def prefetch_stats(self, ctx):
+        """
+        Show how often stories were ready before they were asked for
+        """
+        stats = self.prefetcher.stats
+        em = discord.Embed(
+            description=(
+                f"Stories shown straight from a prefetch: "
+                f"{self.prefetcher.hit_ratio():.1%}"
+            ),
+            color=0x7289DA,
+        )
+        em.add_field(name="Hits", value=f"{stats['hit']:,}")
+        em.add_field(name="Misses", value=f"{stats['miss']:,}")
+        em.add_field(name="Fetched", value=f"{stats['fetched']:,}")
+        em.add_field(name="Failed", value=f"{stats['failed']:,}")
+        em.add_field(
+            name="Skipped",
+            value=(
+                f"{stats['skipped (budget)']:,} over budget, "
+                f"{stats['skipped (site busy)']:,} site busy"
+            ),
+        )
+        em.add_field(name="Random From Pool", value=f"{stats['random from pool']:,}")
+        em.set_author(name="FFPicker Prefetch", icon_url=self.bot.user.avatar_url)
+        await ctx.send(embed=em)
+
+    @checks.is_owner()
+    @picker.command(name="storage")
+    async def storage(self, ctx, engine: str = None):
+        """
+        Show or change where stories are stored (config or sqlite)
+
+        Changing it copies every server's stories to the new storage and
+        uses it from then on. The old copy is left as it was, and is
+        replaced if you switch back.
+        """
+        if engine is None:
+            await ctx.send(f"Stories are stored in {self.store.engine}.")
+            return
+        engine = engine.lower()
+        if engine not in ENGINES:
+            await ctx.send("Storage must be config or sqlite. No changes were made.")
+            return
+        elif engine == self.store.engine:
+            await ctx.send(f"Stories are already stored in {engine}.")
+            return
+
+        await ctx.trigger_typing()
+        guilds = await self.store.dump()
+        target = self.open_store(engine)
+        try:
+            await target.load(guilds)
+        except Exception:
+            target.close()
+            log.exception("Moving stories to %s failed", engine)
+            await ctx.send(f"Moving stories to {engine} failed. No changes were made.")
+            return
+        await self.config.storage.set(engine)
+        self.store, old = target, self.store
+        old.close()
+        self._index.clear()
+        self._pages.clear()
+        self._search.clear()
+        self._stats.clear()
+        total = sum(len(stories) for stories in guilds.values())
+        await ctx.send(
+            f"Moved {total:,} stories in {len(guilds):,} server(s) to {engine}."
+        )
@@ -0,0 +1,165 @@
+import asyncio
+import discord
+import random
+
+from collections.abc import Sequence
+from redbot.core.utils.menus import start_adding_reactions
+
+PAGE_SIZE = 10
+LISTED_FIELDS = ("title", "author", "link")  # What a listing line shows
+
+PREV = "\N{LEFTWARDS BLACK ARROW}"
+CLOSE = "\N{CROSS MARK}"
+NEXT = "\N{BLACK RIGHTWARDS ARROW}"
+
+
+class StoryPages(Sequence):
+    """
+    Listing pages for a list of stories, each rendered the first time it is
+    shown and kept until the collection changes
+    """
+
+    def __init__(self, guild, stories, numbers=None, title=None):
+        self.guild = guild
+        self.stories = stories
+        self.numbers = numbers
+        self.title = title or f"{guild.name}'s Story Collection"
+        self._rendered = {}
+        self._positions = None
+
+    def __len__(self):
+        return max(-(-len(self.stories) // PAGE_SIZE), 1)
+
+    def __getitem__(self, idx):
+        if not 0 <= idx < len(self):
+            raise IndexError(idx)
+        if idx not in self._rendered:
+            self._rendered[idx] = self.render(idx)
+        return self._rendered[idx]
+
+    async def load(self, start, stop):
+        """
+        Make sure the stories from start up to stop can be read without
+        waiting on the store
+        """
+        if hasattr(self.stories, "load"):
+            await self.stories.load(start, stop)
+
+    async def load_page(self, idx):
+        await self.load(idx * PAGE_SIZE, (idx + 1) * PAGE_SIZE)
+
+    async def story(self, pos):
+        await self.load(pos, pos + 1)
+        return self.stories[pos]
+
+    async def sample(self, k):
+        """
+        Return up to k different stories picked at random
+        """
+        picks = random.sample(range(len(self.stories)), min(k, len(self.stories)))
+        return [await self.story(pos) for pos in picks]
+
+    async def position(self, key):
+        """
+        Return where the story with the given canonical key sits in the list
+        """
+        if self._positions is None:
+            if hasattr(self.stories, "positions"):
+                self._positions = await self.stories.positions()
+            else:
+                self._positions = {
+                    story.get("key"): pos for pos, story in enumerate(self.stories)
+                }
+        return self._positions.get(key)
+
+    async def update(self, changes):
+        """
+        Copy changed fields into the listed stories
+
+        Returns False, changing nothing, if any change would show on a page,
+        in which case the pages have to be built again.
+        """
+        found = []
+        for change in changes:
+            pos = await self.position(change.get("key"))
+            if pos is None:
+                continue
+            story = await self.story(pos)
+            if any(f in change and change[f] != story.get(f) for f in LISTED_FIELDS):
+                return False
+            found.append((story, change))
+        for story, change in found:
+            story.update(change)
+        return True
+
+    def page_stories(self, idx):
+        start = idx * PAGE_SIZE
+        return self.stories[start : start + PAGE_SIZE]
+
+    def number(self, pos):
+        return self.numbers[pos] if self.numbers is not None else pos + 1
+
+    def render(self, idx):
+        start = idx * PAGE_SIZE
+        lines = []
+        for pos, story in enumerate(self.page_stories(idx), start):
+            lines.append(
+                f"**{self.number(pos)}** [{story['title']}]({story['link']}) "
+                f"by {story['author']}"
+            )
+        em = discord.Embed(description="\n".join(lines), color=0x7289DA)
+        em.set_author(name=self.title, icon_url=self.guild.icon_url)
+        em.set_footer(
+            text=(
+                f"Page {idx + 1:,} of {len(self):,} • "
+                f"Total stories: {len(self.stories):,}"
+            )
+        )
+        return em
+
+
+async def page_menu(ctx, pages, page=0, timeout=30.0, on_page=None):
+    """
+    Reaction menu that behaves like Red's default menu, but only asks for
+    the pages it actually shows
+
+    on_page, if given, is called with each page index as it is shown.
+    """
+    await pages.load_page(page)
+    if on_page:
+        on_page(page)
+    message = await ctx.send(embed=pages[page])
+    start_adding_reactions(message, (PREV, CLOSE, NEXT))
+
+    def check(reaction, user):
+        return (
+            reaction.message.id == message.id
+            and user == ctx.author
+            and str(reaction.emoji) in (PREV, CLOSE, NEXT)
+        )
+
+    while True:
+        try:
+            reaction, user = await ctx.bot.wait_for(
+                "reaction_add", check=check, timeout=timeout
+            )
+        except asyncio.TimeoutError:
+            try:
+                await message.clear_reactions()
+            except (discord.Forbidden, discord.NotFound):
+                pass
+            return
+
+        emoji = str(reaction.emoji)
+        if emoji == CLOSE:
+            await message.delete()
+            return
+        page = (page + (1 if emoji == NEXT else -1)) % len(pages)
+        try:
+            await message.remove_reaction(emoji, user)
+        except discord.Forbidden:
+            pass
+        await pages.load_page(page)
+        if on_page:
+            on_page(page)
+        await message.edit(embed=pages[page])
@@ -0,0 +1,162 @@
+import asyncio
+import logging
+import random
+
+from collections import Counter, defaultdict, deque
+from fflib import TokenBucket, host_limits, metrics
+from urllib.parse import urlparse
+
+from .snapshots import has_snapshot
+
+PREFETCH_BUDGET = 30  # Story fetches per server per hour
+HOST_HEADROOM = 2  # Requests per site left for people who are waiting
+RANDOM_POOL = 3  # Random picks drawn ahead of time per server
+
+log = logging.getLogger("red.ffpicker")
+
+
+class Prefetcher:
+    """
+    Fetches stories without a snapshot before anyone asks for them: the
+    rest of the menu page being viewed, and a few random picks drawn ahead
+    of time
+
+    Each server gets a fixed hourly budget, and only spare capacity in a
+    site's rate limit is used, so prefetching never slows down a story
+    someone is waiting for.
+    """
+
+    def __init__(self, cog):
+        self.cog = cog
+        self.pools = defaultdict(deque)
+        self.warmed = defaultdict(set)
+        self.stats = Counter()
+        self._budgets = {}
+        self._queued = defaultdict(list)
+        self._tasks = {}
+
+    def budget(self, guild_id):
+        if guild_id not in self._budgets:
+            self._budgets[guild_id] = TokenBucket(
+                PREFETCH_BUDGET / 3600, PREFETCH_BUDGET
+            )
+        return self._budgets[guild_id]
+
+    def warm(self, guild, stories):
+        """
+        Fetch the given stories in the background if they need it
+        """
+        self._queued[guild.id].extend(stories)
+        task = self._tasks.get(guild.id)
+        if task is None or task.done():
+            self._tasks[guild.id] = asyncio.ensure_future(self._run(guild))
+
+    def select(self, guild_id, stories):
+        """
+        Pick the stories worth fetching now, within the server's budget
+        and each site's spare capacity
+        """
+        budget = self.budget(guild_id)
+        spare = {}
+        todo = []
+        for story in stories:
+            if has_snapshot(story) or story.get("key") in self.warmed[guild_id]:
+                continue
+            host = urlparse(story["link"]).netloc
+            if host not in spare:
+                bucket = host_limits.bucket(host)
+                spare[host] = int(bucket.available()) - HOST_HEADROOM
+                if host_limits.breaker(host).state != "closed":
+                    spare[host] = 0
+            if spare[host] < 1:
+                self.count("skipped (site busy)")
+                continue
+            if not budget.take():
+                self.count("skipped (budget)")
+                break
+            spare[host] -= 1
+            todo.append(story)
+        return todo
+
+    async def _run(self, guild):
+        while self._queued.get(guild.id):
+            stories = self._queued.pop(guild.id)
+            try:
+                await self._warm(guild, stories)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                log.exception("Prefetching stories failed")
+
+    async def _warm(self, guild, stories):
+        todo = self.select(guild.id, stories)
+        if not todo:
+            return
+        results = await asyncio.gather(
+            *(self.cog.get_metadata(story["link"]) for story in todo),
+            return_exceptions=True,
+        )
+        snapshots = {}
+        for story, metadata in zip(todo, results):
+            if isinstance(metadata, Exception):
+                self.count("failed")
+            else:
+                snapshots[story["key"]] = metadata
+        if snapshots:
+            self.count("fetched", len(snapshots))
+            self.warmed[guild.id].update(snapshots)
+            await self.cog.save_snapshots(guild, snapshots)
+
+    async def draw(self, guild, pages):
+        """
+        Return the key of the next random pick from the listing pages,
+        drawing and warming the ones after it
+        """
+        pool = self.pools[guild.id]
+        key = pool.popleft() if pool else None
+        if key is not None:
+            self.count("random from pool")
+        wanted = min(RANDOM_POOL, len(pages.stories)) - len(pool)
+        drawn = []
+        if wanted > 0:
+            # A few spares, in case some picks are in the pool already
+            for story in await pages.sample(wanted + 2):
+                if len(drawn) == wanted:
+                    break
+                if story.get("key") not in pool:
+                    pool.append(story.get("key"))
+                    drawn.append(story)
+        if drawn:
+            self.warm(guild, drawn)
+        return key
+
+    def record_show(self, guild_id, story, fetched):
+        """
+        Count whether a story shown was ready thanks to prefetching, or had
+        to be fetched while the user waited
+        """
+        key = story.get("key")
+        if key in self.warmed[guild_id]:
+            self.warmed[guild_id].discard(key)
+            self.count("hit")
+        elif fetched:
+            self.count("miss")
+
+    def count(self, outcome, n=1):
+        self.stats[outcome] += n
+        metrics.incr("prefetch", "ffpicker", outcome, n)
+
+    def hit_ratio(self):
+        shown = self.stats["hit"] + self.stats["miss"]
+        return self.stats["hit"] / shown if shown else 0.0
+
+    def forget(self, guild_id):
+        self.pools.pop(guild_id, None)
+        self.warmed.pop(guild_id, None)
+        self._queued.pop(guild_id, None)
+
+    def stop(self):
+        for task in self._tasks.values():
+            task.cancel()
+        self._tasks.clear()
+        self._queued.clear()
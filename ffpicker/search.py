@@ -0,0 +1,92 @@
+import re
+
+from bisect import bisect_left, insort
+
+TOKEN_RE = re.compile(r"\w+")
+
+# Extra words a story can be found by, per site
+SITE_WORDS = {
+    "ffn": "ffn fanfiction",
+    "ffn-author": "ffn fanfiction",
+    "ao3": "ao3 archiveofourown",
+    "siye": "siye",
+}
+
+
+def tokenize(text):
+    return set(TOKEN_RE.findall(text.lower()))
+
+
+class SearchIndex:
+    """
+    Inverted index from words to the canonical keys of stories
+
+    Query terms match any indexed word they are a prefix of, and every term
+    has to match for a story to be returned.
+    """
+
+    def __init__(self):
+        self._postings = {}
+        self._docs = {}
+        self._vocab = []
+        self._dirty = False
+
+    def __len__(self):
+        return len(self._docs)
+
+    def build(self, entries):
+        """
+        Index many (key, story, metadata) entries at once
+        """
+        self._dirty = True  # Sort the vocabulary once, on the next search
+        for key, story, metadata in entries:
+            self.add(key, story, metadata)
+
+    def add(self, key, story, metadata=None):
+        self.remove(key)
+        site = key.split(":", 1)[0] if key else None
+        fields = [story["title"], story["author"], SITE_WORDS.get(site)]
+        for source in (story, metadata or {}):
+            fields += [source.get("desc"), source.get("footer")]
+        tokens = tokenize(" ".join(field for field in fields if field))
+        self._docs[key] = tokens
+        for token in tokens:
+            keys = self._postings.get(token)
+            if keys is None:
+                keys = self._postings[token] = set()
+                if not self._dirty:
+                    insort(self._vocab, token)
+            keys.add(key)
+
+    def remove(self, key):
+        for token in self._docs.pop(key, ()):
+            keys = self._postings[token]
+            keys.discard(key)
+            if not keys:
+                del self._postings[token]
+                if not self._dirty:
+                    del self._vocab[bisect_left(self._vocab, token)]
+
+    def _expand(self, prefix):
+        if self._dirty:
+            self._vocab = sorted(self._postings)
+            self._dirty = False
+        keys = set()
+        idx = bisect_left(self._vocab, prefix)
+        while idx < len(self._vocab) and self._vocab[idx].startswith(prefix):
+            keys |= self._postings[self._vocab[idx]]
+            idx += 1
+        return keys
+
+    def search(self, query):
+        """
+        Return the keys of every story matching all words in query
+        """
+        result = None
+        # Longer terms tend to match fewer stories, so narrow with them first
+        for term in sorted(tokenize(query), key=len, reverse=True):
+            keys = self._expand(term)
+            result = keys if result is None else result & keys
+            if not result:
+                break
+        return result or set()
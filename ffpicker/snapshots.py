@@ -0,0 +1,128 @@
+import asyncio
+import discord
+import heapq
+import logging
+import time
+
+from collections import Counter, defaultdict
+from fflib import CachedFailure, StoryNotFound
+
+# Story fields copied from the parsed metadata, enough to render an embed
+SNAPSHOT_FIELDS = (
+    "title",
+    "author",
+    "author_link",
+    "icon",
+    "thumbnail",
+    "desc",
+    "footer",
+)
+
+REFRESH_AGE = 7 * 86400  # Seconds before a snapshot counts as stale
+REFRESH_INTERVAL = 60  # Seconds between refresh rounds
+REFRESH_BATCH = 5  # Stories refreshed per round
+RETRY_AFTER = 3600  # Seconds to wait after a failed refresh
+CANDIDATES = 20 * REFRESH_BATCH  # Stale stories considered per round
+VIEWS_INTERVAL = 15 * 60  # Seconds between writes of view counts alone
+
+log = logging.getLogger("red.ffpicker")
+
+
+def has_snapshot(story):
+    return "desc" in story
+
+
+def apply_snapshot(story, metadata, now=None):
+    for field in SNAPSHOT_FIELDS:
+        story[field] = metadata[field]
+    story["fetched_at"] = now or time.time()
+    story["dead"] = False
+
+
+class SnapshotRefresher:
+    """
+    Background task that refreshes the stalest, most viewed snapshots first,
+    a few stories per round, and flags links that no longer resolve
+
+    View counts are kept in memory and written out with the next snapshot
+    saved for their server, or every VIEWS_INTERVAL seconds.
+    """
+
+    def __init__(self, cog):
+        self.cog = cog
+        self.views = defaultdict(Counter)
+        self._retry = {}
+        self._views_saved = 0
+        self._task = None
+
+    def start(self):
+        self._task = asyncio.ensure_future(self.run())
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    def record_view(self, guild_id, key):
+        self.views[guild_id][key] += 1
+
+    async def run(self):
+        await self.cog.bot.wait_until_ready()
+        while True:
+            await asyncio.sleep(REFRESH_INTERVAL)
+            try:
+                await self.refresh_round()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                log.exception("Snapshot refresh round failed")
+
+    def pick(self, candidates, now):
+        """
+        Return the (guild ID, story) pairs most in need of a refresh
+        """
+        scored = []
+        for guild_id, story in candidates:
+            key = story.get("key")
+            if self._retry.get(key, 0) > now:
+                continue
+            age = now - story.get("fetched_at", 0)
+            seen = story.get("views", 0) + self.views.get(guild_id, {}).get(key, 0)
+            scored.append((age * (1 + seen), guild_id, story))
+        best = heapq.nlargest(REFRESH_BATCH, scored, key=lambda c: c[0])
+        return [(guild_id, story) for _, guild_id, story in best]
+
+    async def flush_views(self):
+        for guild_id in list(self.views):
+            await self.cog.save_snapshots(discord.Object(id=guild_id), {})
+
+    async def refresh_round(self):
+        now = time.time()
+        self._retry = {key: t for key, t in self._retry.items() if t > now}
+        snapshots = defaultdict(dict)
+        dead = defaultdict(set)
+        candidates = await self.cog.store.stale(now - REFRESH_AGE, CANDIDATES)
+        for guild_id, story in self.pick(candidates, now):
+            key = story.get("key")
+            try:
+                snapshots[guild_id][key] = await self.cog.get_metadata(story["link"])
+            except StoryNotFound:
+                dead[guild_id].add(key)
+            except CachedFailure as e:
+                if str(e).startswith(StoryNotFound.__name__):
+                    dead[guild_id].add(key)
+                else:
+                    self._retry[key] = now + RETRY_AFTER
+            except Exception:
+                self._retry[key] = now + RETRY_AFTER
+
+        guilds = set(snapshots) | set(dead)
+        # Servers with only new views wait, since Config rewrites a server's
+        # whole list to save them; pick counts the unsaved views meanwhile
+        if now - self._views_saved >= VIEWS_INTERVAL:
+            self._views_saved = now
+            guilds |= set(self.views)
+        for guild_id in guilds:
+            await self.cog.save_snapshots(
+                discord.Object(id=guild_id), snapshots[guild_id], dead[guild_id]
+            )
@@ -0,0 +1,107 @@
+from bisect import bisect_left, insort
+from collections import Counter, defaultdict
+
+
+def site_of_key(key):
+    return key.split(":", 1)[0] if key else None
+
+
+class CollectionStats:
+    """
+    Counters and secondary indexes over a server's stories, from canonical
+    key to who added each story, its site and when it was added
+
+    Adds and removals update them in place, so nothing is recounted. Stories
+    saved before add dates were recorded count as undated.
+    """
+
+    def __init__(self):
+        self.total = 0
+        self.undated = 0
+        self.sites = Counter()
+        self.users = Counter()
+        self._by_site = defaultdict(Counter)
+        self._by_user = defaultdict(Counter)
+        self._dated = []  # Sorted (added_at, key) pairs
+        self._dirty = False
+
+    def build(self, rows):
+        """
+        Index many (key, user ID, added_at) rows at once
+        """
+        self._dirty = True  # Sort the dates once, on the next date lookup
+        for key, user_id, added_at in rows:
+            self.add(key, user_id, added_at)
+
+    def add(self, key, user_id, added_at=None):
+        site = site_of_key(key)
+        self.total += 1
+        self.sites[site] += 1
+        self.users[user_id] += 1
+        self._by_site[site][key] += 1
+        self._by_user[user_id][key] += 1
+        if added_at is None:
+            self.undated += 1
+        elif self._dirty:
+            self._dated.append((added_at, key or ""))
+        else:
+            insort(self._dated, (added_at, key or ""))
+
+    def remove(self, key, user_id, added_at=None):
+        site = site_of_key(key)
+        self.total -= 1
+        for counts, index, name in (
+            (self.sites, self._by_site, site),
+            (self.users, self._by_user, user_id),
+        ):
+            counts[name] -= 1
+            index[name][key] -= 1
+            if counts[name] < 1:
+                del counts[name], index[name]
+            elif index[name][key] < 1:
+                del index[name][key]
+        if added_at is None:
+            self.undated -= 1
+            return
+        self._sort()
+        pos = bisect_left(self._dated, (added_at, key or ""))
+        if pos < len(self._dated) and self._dated[pos] == (added_at, key or ""):
+            del self._dated[pos]
+
+    def _sort(self):
+        if self._dirty:
+            self._dated.sort()
+            self._dirty = False
+
+    def by_site(self, site):
+        """
+        Return the keys of the stories from a site
+        """
+        return list(self._by_site.get(site, ()))
+
+    def by_user(self, user_id):
+        """
+        Return the keys of the stories a member added
+        """
+        return list(self._by_user.get(user_id, ()))
+
+    def _date_range(self, start, end):
+        self._sort()
+        lo = bisect_left(self._dated, (start,))
+        hi = len(self._dated) if end is None else bisect_left(self._dated, (end,))
+        return lo, hi
+
+    def added_between(self, start, end=None):
+        """
+        Return the keys of the stories added from start until end, as Unix
+        times, or since start if end is None
+        """
+        lo, hi = self._date_range(start, end)
+        return [key for _, key in self._dated[lo:hi]]
+
+    def count_added(self, start, end=None):
+        lo, hi = self._date_range(start, end)
+        return hi - lo
+
+    def top_users(self, n):
+        return self.users.most_common(n)
@@ -0,0 +1,454 @@
+import asyncio
+import discord
+import heapq
+import json
+import sqlite3
+
+from collections import Counter, OrderedDict, defaultdict
+from collections.abc import Sequence
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+from .snapshots import apply_snapshot
+
+ENGINES = ("config", "sqlite")
+
+CHUNK_SIZE = 100  # Stories read from SQLite at a time
+MAX_CHUNKS = 64  # Chunks kept in memory per listing
+STALE_POOL = 10  # Oldest snapshots ranked per stale story wanted
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS stories (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    guild_id INTEGER NOT NULL,
+    key TEXT,
+    user_id INTEGER,
+    added_at REAL,
+    fetched_at REAL NOT NULL DEFAULT 0,
+    views INTEGER NOT NULL DEFAULT 0,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS stories_guild ON stories (guild_id);
+CREATE INDEX IF NOT EXISTS stories_key ON stories (guild_id, key);
+CREATE INDEX IF NOT EXISTS stories_user ON stories (guild_id, user_id);
+CREATE INDEX IF NOT EXISTS stories_fetched ON stories (fetched_at);
+"""
+
+
+def apply_changes(story, snapshots, dead, views, now):
+    """
+    Apply a refreshed snapshot, dead link flag and new views to a story
+
+    Returns whether the story got a new snapshot.
+    """
+    key = story.get("key")
+    refreshed = key in snapshots
+    if refreshed:
+        apply_snapshot(story, snapshots[key], now)
+    elif key in dead:
+        story["dead"] = True
+        story["fetched_at"] = now
+    if views.get(key):
+        story["views"] = story.get("views", 0) + views[key]
+    return refreshed
+
+
+class ConfigStore:
+    """
+    Stories kept as one list per server in Red's Config
+
+    Every read loads the server's whole list and every write saves it. The
+    snapshot age, views and link of every story are also kept in memory
+    once the refresher first asks for stale stories, so later rounds don't
+    load every server's list to pick a handful.
+    """
+
+    engine = "config"
+
+    def __init__(self, config):
+        self.config = config
+        self._ages = None  # {guild ID: {key: (fetched_at, views, link)}}
+
+    def _track(self, guild_id, stories):
+        if self._ages is None:
+            return
+        ages = self._ages.setdefault(guild_id, {})
+        for story in stories:
+            if story.get("key") is not None:
+                ages[story["key"]] = (
+                    story.get("fetched_at", 0),
+                    story.get("views", 0),
+                    story["link"],
+                )
+
+    async def stories(self, guild):
+        return await self.config.guild(guild).stories()
+
+    async def story(self, guild, pos):
+        return (await self.stories(guild))[pos]
+
+    async def all_stories(self, guild):
+        return await self.stories(guild)
+
+    async def keys(self, guild):
+        return Counter(story.get("key") for story in await self.stories(guild))
+
+    async def index_rows(self, guild):
+        """
+        Return the key, adder's ID and add time of every story, for building
+        the collection stats
+        """
+        return [
+            (story.get("key"), story.get("user_id"), story.get("added_at"))
+            for story in await self.stories(guild)
+        ]
+
+    async def append(self, guild, new):
+        async with self.config.guild(guild).stories() as stories:
+            stories.extend(new)
+            total = len(stories)
+        self._track(guild.id, new)
+        return total
+
+    async def remove(self, guild, pos, key):
+        """
+        Remove the story at pos if it is still the one with the given key
+        """
+        async with self.config.guild(guild).stories() as stories:
+            if pos < len(stories) and stories[pos].get("key") == key:
+                story = stories.pop(pos)
+            else:
+                return None
+        if self._ages is not None:
+            self._ages.get(guild.id, {}).pop(key, None)
+        return story
+
+    async def update(self, guild, snapshots, dead, views, now):
+        """
+        Apply snapshots, dead flags and views, returning refreshed stories
+        """
+        keys = set(snapshots) | set(dead) | {key for key, n in views.items() if n}
+        if not keys:
+            return []
+        refreshed = []
+        async with self.config.guild(guild).stories() as stories:
+            changed = [story for story in stories if story.get("key") in keys]
+            for story in changed:
+                if apply_changes(story, snapshots, dead, views, now):
+                    refreshed.append(story)
+        self._track(guild.id, changed)
+        return refreshed
+
+    async def clear(self, guild):
+        await self.config.guild(guild).stories.clear()
+        if self._ages is not None:
+            self._ages.pop(guild.id, None)
+
+    async def stale(self, before, limit):
+        """
+        Return up to limit (guild ID, story) pairs whose snapshot predates
+        before, oldest and most viewed first
+
+        The stories only hold what a refresh needs: key, link, fetched_at
+        and views.
+        """
+        if self._ages is None:
+            self._ages = {}
+            for guild_id, data in (await self.config.all_guilds()).items():
+                self._track(guild_id, data.get("stories", []))
+        stale = (
+            ((before - fetched_at) * (1 + views), guild_id, key)
+            for guild_id, ages in self._ages.items()
+            for key, (fetched_at, views, _) in ages.items()
+            if fetched_at < before
+        )
+        result = []
+        for _, guild_id, key in heapq.nlargest(limit, stale):
+            fetched_at, views, link = self._ages[guild_id][key]
+            story = dict(key=key, link=link, fetched_at=fetched_at, views=views)
+            result.append((guild_id, story))
+        return result
+
+    async def dump(self):
+        return {
+            guild_id: data.get("stories", [])
+            for guild_id, data in (await self.config.all_guilds()).items()
+        }
+
+    async def load(self, guilds):
+        """
+        Replace every stored story with the given {guild ID: stories},
+        leaving other server settings alone
+        """
+        self._ages = None
+        for guild_id in await self.config.all_guilds():
+            if guild_id not in guilds:
+                await self.config.guild(discord.Object(id=guild_id)).stories.clear()
+        for guild_id, stories in guilds.items():
+            guild = discord.Object(id=guild_id)
+            await self.config.guild(guild).stories.set(stories)
+
+    def close(self):
+        pass
+
+
+class SQLiteStore:
+    """
+    Stories kept in a local SQLite database, one row each
+
+    Adds, removals and snapshot updates touch only the rows involved, and
+    listings read the rows they show a chunk at a time. Every query runs on
+    the store's own thread, which owns the connection, so a large
+    collection never holds up the event loop.
+    """
+
+    engine = "sqlite"
+
+    def __init__(self, path):
+        self.db = None
+        self._executor = ThreadPoolExecutor(1, thread_name_prefix="ffpicker-store")
+        # Queued first, so every later call finds the connection open
+        self._opened = self._executor.submit(self._open, str(path))
+
+    def _open(self, path):
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.executescript(SCHEMA)
+
+    def _call(self, func, *args):
+        self._opened.result()  # Raises whatever stopped the database opening
+        return func(*args)
+
+    async def _run(self, func, *args):
+        loop = asyncio.get_event_loop()
+        return await loop.run_in_executor(
+            self._executor, partial(self._call, func, *args)
+        )
+
+    def _wait(self, func, *args):
+        """
+        Run func on the store's thread and block until it is done, for the
+        few callers that cannot await
+        """
+        return self._executor.submit(self._call, func, *args).result()
+
+    def _query(self, sql, params=()):
+        return self.db.execute(sql, params).fetchall()
+
+    @staticmethod
+    def _row(guild_id, story):
+        return (
+            guild_id,
+            story.get("key"),
+            story.get("user_id"),
+            story.get("added_at"),
+            story.get("fetched_at", 0),
+            story.get("views", 0),
+            json.dumps(story),
+        )
+
+    def _insert(self, guild_id, stories):
+        self.db.executemany(
+            "INSERT INTO stories "
+            "(guild_id, key, user_id, added_at, fetched_at, views, data) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (self._row(guild_id, story) for story in stories),
+        )
+
+    def _count(self, guild_id):
+        sql = "SELECT COUNT(*) FROM stories WHERE guild_id = ?"
+        return self._query(sql, (guild_id,))[0][0]
+
+    def _at(self, guild_id, pos):
+        sql = (
+            "SELECT id, data FROM stories WHERE guild_id = ? "
+            "ORDER BY id LIMIT 1 OFFSET ?"
+        )
+        rows = self._query(sql, (guild_id, pos))
+        return rows[0] if rows else None
+
+    async def stories(self, guild):
+        return StoryRows(self, guild.id, await self._run(self._count, guild.id))
+
+    async def story(self, guild, pos):
+        row = await self._run(self._at, guild.id, pos) if pos >= 0 else None
+        if row is None:
+            raise IndexError(pos)
+        return json.loads(row[1])
+
+    def _all(self, guild_id):
+        sql = "SELECT data FROM stories WHERE guild_id = ? ORDER BY id"
+        return [json.loads(data) for data, in self._query(sql, (guild_id,))]
+
+    async def all_stories(self, guild):
+        return await self._run(self._all, guild.id)
+
+    async def keys(self, guild):
+        sql = "SELECT key FROM stories WHERE guild_id = ?"
+        rows = await self._run(self._query, sql, (guild.id,))
+        return Counter(key for key, in rows)
+
+    async def index_rows(self, guild):
+        sql = "SELECT key, user_id, added_at FROM stories WHERE guild_id = ?"
+        return await self._run(self._query, sql, (guild.id,))
+
+    def _append(self, guild_id, new):
+        with self.db:
+            self._insert(guild_id, new)
+        return self._count(guild_id)
+
+    async def append(self, guild, new):
+        return await self._run(self._append, guild.id, new)
+
+    def _remove(self, guild_id, pos, key):
+        row = self._at(guild_id, pos)
+        if row is None:
+            return None
+        story = json.loads(row[1])
+        if story.get("key") != key:
+            return None
+        with self.db:
+            self.db.execute("DELETE FROM stories WHERE id = ?", (row[0],))
+        return story
+
+    async def remove(self, guild, pos, key):
+        return await self._run(self._remove, guild.id, pos, key)
+
+    def _update(self, guild_id, snapshots, dead, views, now):
+        keys = set(snapshots) | set(dead) | {key for key, n in views.items() if n}
+        refreshed = []
+        with self.db:
+            for key in keys:
+                sql = "SELECT id, data FROM stories WHERE guild_id = ? AND key = ?"
+                for row_id, data in self._query(sql, (guild_id, key)):
+                    story = json.loads(data)
+                    if apply_changes(story, snapshots, dead, views, now):
+                        refreshed.append(story)
+                    self.db.execute(
+                        "UPDATE stories SET fetched_at = ?, views = ?, data = ? "
+                        "WHERE id = ?",
+                        (
+                            story.get("fetched_at", 0),
+                            story.get("views", 0),
+                            json.dumps(story),
+                            row_id,
+                        ),
+                    )
+        return refreshed
+
+    async def update(self, guild, snapshots, dead, views, now):
+        return await self._run(self._update, guild.id, snapshots, dead, views, now)
+
+    def _clear(self, guild_id):
+        with self.db:
+            self.db.execute("DELETE FROM stories WHERE guild_id = ?", (guild_id,))
+
+    async def clear(self, guild):
+        await self._run(self._clear, guild.id)
+
+    async def stale(self, before, limit):
+        """
+        Return up to limit (guild ID, story) pairs whose snapshot predates
+        before, oldest and most viewed first
+
+        Only the STALE_POOL * limit oldest snapshots, found through the
+        fetched_at index, are ranked, so the table is never scanned whole.
+        """
+        sql = (
+            "SELECT guild_id, data FROM ("
+            "SELECT guild_id, data, fetched_at, views FROM stories "
+            "WHERE fetched_at < ? ORDER BY fetched_at LIMIT ?) "
+            "ORDER BY (? - fetched_at) * (1 + views) DESC LIMIT ?"
+        )
+        params = (before, limit * STALE_POOL, before, limit)
+        rows = await self._run(self._query, sql, params)
+        return [(guild_id, json.loads(data)) for guild_id, data in rows]
+
+    def _dump(self):
+        guilds = defaultdict(list)
+        sql = "SELECT guild_id, data FROM stories ORDER BY id"
+        for guild_id, data in self._query(sql):
+            guilds[guild_id].append(json.loads(data))
+        return dict(guilds)
+
+    async def dump(self):
+        return await self._run(self._dump)
+
+    def _load(self, guilds):
+        with self.db:
+            self.db.execute("DELETE FROM stories")
+            for guild_id, stories in guilds.items():
+                self._insert(guild_id, stories)
+
+    async def load(self, guilds):
+        await self._run(self._load, guilds)
+
+    def _close(self):
+        if self.db is not None:
+            self.db.close()
+
+    def close(self):
+        self._executor.submit(self._close)
+        self._executor.shutdown(wait=False)
+
+
+class StoryRows(Sequence):
+    """
+    A server's stories in SQLite, read a chunk at a time as they are used
+
+    load() reads chunks on the store's thread. Indexing serves the chunks
+    already read, and reads any other one on the spot, blocking.
+    """
+
+    def __init__(self, store, guild_id, count):
+        self._store = store
+        self.guild_id = guild_id
+        self._len = count
+        self._chunks = OrderedDict()
+
+    def __len__(self):
+        return self._len
+
+    def __getitem__(self, idx):
+        if isinstance(idx, slice):
+            return [self[i] for i in range(*idx.indices(len(self)))]
+        if idx < 0:
+            idx += len(self)
+        if not 0 <= idx < len(self):
+            raise IndexError(idx)
+        n = idx // CHUNK_SIZE
+        if n not in self._chunks:
+            self._keep(n, self._store._wait(self._read, n))
+        self._chunks.move_to_end(n)
+        return self._chunks[n][idx % CHUNK_SIZE]
+
+    def _read(self, n):
+        sql = (
+            "SELECT data FROM stories WHERE guild_id = ? "
+            "ORDER BY id LIMIT ? OFFSET ?"
+        )
+        rows = self._store._query(sql, (self.guild_id, CHUNK_SIZE, n * CHUNK_SIZE))
+        return [json.loads(data) for data, in rows]
+
+    def _keep(self, n, chunk):
+        self._chunks[n] = chunk
+        while len(self._chunks) > MAX_CHUNKS:
+            self._chunks.popitem(last=False)
+
+    async def load(self, start, stop):
+        """
+        Read the chunks holding the stories from start up to stop
+        """
+        stop = min(stop, len(self))
+        for n in range(start // CHUNK_SIZE, -(-stop // CHUNK_SIZE)):
+            if n not in self._chunks:
+                self._keep(n, await self._store._run(self._read, n))
+
+    async def positions(self):
+        """
+        Return where each canonical key sits in the list, reading only keys
+        """
+        sql = "SELECT key FROM stories WHERE guild_id = ? ORDER BY id"
+        rows = await self._store._run(self._store._query, sql, (self.guild_id,))
+        return {key: pos for pos, (key,) in enumerate(rows)}
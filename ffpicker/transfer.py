@@ -0,0 +1,44 @@
+import csv
+import io
+import json
+
+IMPORT_MAX_BYTES = 2 * 1024 * 1024
+IMPORT_BATCH = 50  # Stories resolved and written to Config per round
+IMPORT_CONCURRENCY = 4
+PROGRESS_INTERVAL = 5  # Seconds between progress message edits
+
+EXPORT_FORMATS = ("jsonl", "csv")
+EXPORT_FIELDS = (
+    "number",
+    "title",
+    "author",
+    "link",
+    "key",
+    "user_id",
+    "added_at",
+    "desc",
+    "footer",
+    "dead",
+)
+
+
+def chunked(items, size):
+    for start in range(0, len(items), size):
+        yield items[start : start + size]
+
+
+def write_export(fp, stories, fmt):
+    """
+    Write stories to a binary file one row at a time
+    """
+    text = io.TextIOWrapper(fp, encoding="utf-8", newline="")
+    if fmt == "csv":
+        writer = csv.DictWriter(text, EXPORT_FIELDS, extrasaction="ignore")
+        writer.writeheader()
+        for number, story in enumerate(stories, 1):
+            writer.writerow({**story, "number": number})
+    else:
+        for number, story in enumerate(stories, 1):
+            text.write(json.dumps({"number": number, **story}) + "\n")
+    text.flush()
+    text.detach()  # Leave fp open for the caller
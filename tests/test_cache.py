@@ -0,0 +1,97 @@
+"""
+Tests for the story metadata cache
+"""
+import asyncio
+import pytest
+
+from fflib import CachedFailure, MetadataCache, StoryNotFound
+
+KEY = ("ffn", "1")
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def make_cache():
+    clock = Clock()
+    return MetadataCache(ttls={"ffn": 60}, negative_ttl=10, clock=clock), clock
+
+
+def loader(result):
+    calls = []
+
+    async def load():
+        calls.append(None)
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    return load, calls
+
+
+async def refresh(cache, load):
+    """
+    Look up a stale key and let its background refresh finish
+    """
+    value = await cache.get_or_load(KEY, load)
+    await asyncio.sleep(0)
+    await asyncio.sleep(0)
+    return value
+
+
+def test_failed_refresh_keeps_stale_copy():
+    async def run():
+        cache, clock = make_cache()
+        cache.set(KEY, {"title": "Old"})
+        clock.now += 61
+        load, calls = loader(ValueError("Challenge page"))
+        assert await refresh(cache, load) == {"title": "Old"}
+        assert await refresh(cache, load) == {"title": "Old"}
+        assert len(calls) == 1  # Backing off before trying again
+        clock.now += 11
+        assert await refresh(cache, load) == {"title": "Old"}
+        assert len(calls) == 2
+        load, _ = loader({"title": "New"})
+        clock.now += 11
+        await refresh(cache, load)
+        assert cache.peek(KEY) == {"title": "New"}
+
+    asyncio.run(run())
+
+
+def test_refresh_of_deleted_story_is_negative():
+    async def run():
+        cache, clock = make_cache()
+        cache.set(KEY, {"title": "Old"})
+        clock.now += 61
+        load, _ = loader(StoryNotFound("gone"))
+        await refresh(cache, load)
+        with pytest.raises(CachedFailure):
+            await cache.get_or_load(KEY, load)
+
+    asyncio.run(run())
+
+
+def test_parse_failure_on_miss_is_negative():
+    async def run():
+        cache, _ = make_cache()
+        load, calls = loader(ValueError("Challenge page"))
+        with pytest.raises(ValueError):
+            await cache.get_or_load(KEY, load)
+        with pytest.raises(CachedFailure):
+            await cache.get_or_load(KEY, load)
+        assert len(calls) == 1
+
+    asyncio.run(run())
+
+
+def test_size_counts_nested_lists():
+    cache, _ = make_cache()
+    tags = ["a long tag name " * 4 + str(n) for n in range(50)]
+    cache.set(KEY, {"title": "One", "tags": tags, "works": [("x" * 100,)] * 5})
+    assert cache.nbytes > sum(len(tag) for tag in tags) + 500
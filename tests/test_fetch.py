@@ -0,0 +1,168 @@
+"""
+Tests for downloading story pages, against a fake session
+"""
+import asyncio
+import pytest
+import re
+
+from fflib import HostUnavailable, StoryNotFound, fetch
+from fflib.ratelimit import HostLimits
+
+URL = "https://www.fanfiction.net/s/1/1/"
+
+
+class Content:
+    def __init__(self, chunks):
+        self.chunks = chunks
+
+    async def iter_chunked(self, size):
+        for chunk in self.chunks:
+            yield chunk
+
+
+class Response:
+    charset = "utf-8"
+
+    def __init__(self, status=200, chunks=(b"<html></html>",), headers=None):
+        self.status = status
+        self.headers = headers or {}
+        self.content = Content(list(chunks))
+        self.closed = False
+
+    async def read(self):
+        return b"".join(self.content.chunks)
+
+    def raise_for_status(self):
+        if self.status >= 400:
+            raise RuntimeError(self.status)
+
+    def close(self):
+        self.closed = True
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        pass
+
+
+class Session:
+    """
+    Answers each request with the next response, or hangs once they run out
+    """
+
+    def __init__(self, *responses):
+        self.responses = list(responses)
+        self.requests = 0
+
+    def get(self, url):
+        self.requests += 1
+        if self.responses:
+            return self.responses.pop(0)
+        return Hang()
+
+
+class Hang:
+    async def __aenter__(self):
+        await asyncio.sleep(60)
+
+    async def __aexit__(self, *exc):
+        pass
+
+
+@pytest.fixture(autouse=True)
+def limits(monkeypatch):
+    limits = HostLimits(rate=1000, burst=1000)
+    monkeypatch.setattr(fetch, "host_limits", limits)
+    monkeypatch.setattr(fetch, "backoff", lambda attempt: 0)
+    return limits
+
+
+def get(session, markers=None):
+    return asyncio.run(fetch._get(session, URL, markers))
+
+
+def test_one_deadline_for_every_attempt(monkeypatch):
+    monkeypatch.setattr(fetch, "MAX_FETCH_TIME", 0.2)
+    session = Session(Response(503))
+    with pytest.raises(asyncio.TimeoutError):
+        get(session)
+    assert session.requests == 2
+
+
+def test_no_retry_past_the_deadline(monkeypatch):
+    monkeypatch.setattr(fetch, "MAX_FETCH_TIME", 1)
+    session = Session(Response(503, headers={"Retry-After": "5"}), Response())
+    with pytest.raises(HostUnavailable):
+        get(session)
+    assert session.requests == 1
+
+
+def test_retries_until_the_page_comes_back():
+    session = Session(Response(503), Response(502), Response())
+    body, charset, complete = get(session)
+    assert body == b"<html></html>" and complete and session.requests == 3
+
+
+def test_retry_after_holds_the_bucket(limits):
+    session = Session(Response(429, headers={"Retry-After": "0.01"}), Response())
+    get(session)
+    assert limits.bucket("www.fanfiction.net")._held_until > 0
+
+
+def test_gives_up_after_max_attempts(limits):
+    session = Session(*(Response(503) for _ in range(5)))
+    with pytest.raises(HostUnavailable):
+        get(session)
+    assert session.requests == fetch.MAX_ATTEMPTS
+    assert limits.breaker("www.fanfiction.net")._failures == fetch.MAX_ATTEMPTS
+
+
+def test_missing_story_is_not_retried(limits):
+    session = Session(Response(404), Response())
+    with pytest.raises(StoryNotFound):
+        get(session)
+    assert session.requests == 1
+    assert limits.breaker("www.fanfiction.net")._failures == 0
+
+
+def test_challenge_is_not_retried(limits):
+    headers = {"Server": "cloudflare"}
+    session = Session(Response(403, headers=headers), Response())
+    with pytest.raises(HostUnavailable, match="challenge"):
+        get(session)
+    assert session.requests == 1
+    assert limits.breaker("www.fanfiction.net")._failures == 1
+
+
+def test_open_circuit_skips_the_request(limits):
+    breaker = limits.breaker("www.fanfiction.net")
+    for _ in range(limits.threshold):
+        breaker.failure()
+    session = Session(Response())
+    with pytest.raises(HostUnavailable, match="failing"):
+        get(session)
+    assert session.requests == 0
+
+
+def test_download_stops_at_the_markers():
+    r = Response(chunks=[b"<div id=", b"'story", b"text'>Once", b" upon"])
+    session = Session(r)
+    body, _, complete = get(session, [re.compile(rb"id=['\"]?storytext")])
+    assert body == b"<div id='storytext'>Once" and not complete and r.closed
+
+
+def read(chunks, markers):
+    return asyncio.run(fetch.read_until(Content(chunks), markers))
+
+
+def test_read_until_marker_split_across_chunks():
+    markers = [re.compile(rb"Summary:"), re.compile(rb"</table>")]
+    chunks = [b"<td>Summ", b"ary: a story</ta", b"ble> chapter", b" text"]
+    assert read(chunks, markers) == (b"<td>Summary: a story</table> chapter", False)
+
+
+def test_read_until_needs_markers_in_order():
+    markers = [re.compile(rb"Summary:"), re.compile(rb"</table>")]
+    chunks = [b"</table>", b"Summary: none"]
+    assert read(chunks, markers) == (b"</table>Summary: none", True)
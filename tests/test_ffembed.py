@@ -0,0 +1,61 @@
+"""
+Tests for FFEmbed, run against a cog with fetching and Discord replaced
+"""
+import asyncio
+import pytest
+
+from types import SimpleNamespace
+
+pytest.importorskip("redbot.core")
+
+from fflib import MetadataCache, find_stories  # noqa: E402
+from ffembed.channels import RecentLinks  # noqa: E402
+from ffembed.ffembed import FFEmbed  # noqa: E402
+
+CHANNEL = SimpleNamespace(id=1)
+WINDOW = 300
+LINKS = "https://archiveofourown.org/works/1 https://archiveofourown.org/works/2"
+
+
+class SendFailed(Exception):
+    pass
+
+
+def embedder():
+    """
+    Return an FFEmbed whose links always resolve and whose sends all fail
+    """
+    cog = FFEmbed.__new__(FFEmbed)
+    cog.cache = MetadataCache()
+    cog.recent = RecentLinks()
+
+    async def resolve_embeds(refs):
+        return [["embed"] for _ in refs]
+
+    async def start_resolving(refs):
+        return [asyncio.ensure_future(resolve_embeds([ref])) for ref in refs]
+
+    async def fail(*args):
+        raise SendFailed()
+
+    cog.resolve_embeds = resolve_embeds
+    cog.start_resolving = start_resolving
+    cog.send_embeds = fail
+    cog.send_queue = SimpleNamespace(put=fail)
+    return cog
+
+
+@pytest.mark.parametrize("progressive", (False, True))
+def test_failed_send_unclaims_links(progressive):
+    cog = embedder()
+    refs = find_stories(LINKS)
+    fresh, _ = cog.skip_repeats(CHANNEL, refs, (WINDOW, {}, "link"))
+    assert fresh == refs
+
+    async def show():
+        with pytest.raises(SendFailed):
+            await cog.show_stories(CHANNEL, fresh, progressive)
+
+    asyncio.run(show())
+    for ref in refs:
+        assert cog.recent.get(CHANNEL.id, ref.key, WINDOW) is False
@@ -0,0 +1,140 @@
+"""
+Tests for FFPicker's commands, run against a cog with its storage and
+fetching replaced
+"""
+import asyncio
+import pytest
+
+from collections import Counter
+from types import SimpleNamespace
+
+pytest.importorskip("redbot.core")
+
+from fflib import MetadataCache  # noqa: E402
+from ffpicker.ffpicker import FFPicker  # noqa: E402
+from ffpicker.pages import StoryPages  # noqa: E402
+
+GUILD = SimpleNamespace(id=1)
+
+
+class Message:
+    def __init__(self, content):
+        self.content = content
+
+    async def edit(self, content):
+        self.content = content
+
+
+class Attachment:
+    def __init__(self, text):
+        self.data = text.encode()
+        self.size = len(self.data)
+
+    async def read(self):
+        return self.data
+
+
+class Context:
+    def __init__(self, text):
+        self.guild = GUILD
+        self.author = SimpleNamespace(id=2)
+        self.message = SimpleNamespace(attachments=[Attachment(text)])
+        self.sent = []
+
+    async def send(self, content=None, **kwargs):
+        self.sent.append(Message(content))
+        return self.sent[-1]
+
+
+def picker():
+    """
+    Return an FFPicker that keeps stories in a list and makes up metadata
+    """
+    cog = FFPicker.__new__(FFPicker)
+    cog._index = {GUILD.id: Counter()}
+    cog.fetched, cog.saved = [], []
+
+    async def get_metadata(url):
+        cog.fetched.append(url)
+        metadata = dict.fromkeys(
+            ("author", "author_link", "desc", "footer", "thumbnail", "icon"), ""
+        )
+        return dict(metadata, title=url, link=url)
+
+    async def append_stories(guild, new):
+        cog.saved += new
+        return new, len(cog.saved)
+
+    cog.get_metadata = get_metadata
+    cog.append_stories = append_stories
+    return cog
+
+
+def run_import(cog, text):
+    ctx = Context(text)
+    asyncio.run(FFPicker.importfic.callback(cog, ctx))
+    return ctx
+
+
+def test_import_leaves_out_listings():
+    cog = picker()
+    ctx = run_import(
+        cog,
+        "https://archiveofourown.org/series/424242\n"
+        "https://archiveofourown.org/works/1234567\n"
+        "https://archiveofourown.org/users/someone/works\n",
+    )
+    assert cog.fetched == ["https://archiveofourown.org/works/1234567"]
+    assert [story["key"] for story in cog.saved] == ["ao3:1234567"]
+    assert "Imported 1 stories" in ctx.sent[-1].content
+    assert "2 AO3 series, collection or user link(s) left out" in ctx.sent[-1].content
+
+
+def test_import_only_listings():
+    cog = picker()
+    ctx = run_import(cog, "see https://archiveofourown.org/series/424242")
+    assert cog.fetched == [] and cog.saved == []
+    assert ctx.sent[-1].content.startswith("Found no story links.")
+
+
+def test_listing_kept_across_snapshot_updates():
+    pages = StoryPages(
+        SimpleNamespace(name="Test"),
+        [
+            {"key": "ao3:1", "title": "One", "author": "A", "link": "l1"},
+            {"key": "ao3:2", "title": "Two", "author": "B", "link": "l2"},
+        ],
+    )
+    changes = [
+        {"key": "ao3:1", "title": "One", "desc": "New", "views": 3},
+        {"key": "ao3:2", "dead": True},
+    ]
+    assert asyncio.run(pages.update(changes))
+    assert pages.stories[0]["desc"] == "New" and pages.stories[1]["dead"]
+    assert not asyncio.run(pages.update([{"key": "ao3:1", "title": "One (Revised)"}]))
+    assert pages.stories[0]["title"] == "One"
+
+
+def test_skeleton_for_unknown_site():
+    story = {"title": "Old", "author": "A", "link": "https://example.com/s/1"}
+    em = picker().skeleton_embed(story).to_dict()
+    assert em["author"] == {"name": "A"}
+
+
+def test_legacy_links_fetched_canonically(monkeypatch):
+    from ffpicker import ffpicker
+
+    fetched = []
+
+    async def fetch_story(session, url):
+        fetched.append(url)
+        return {"link": url}
+
+    monkeypatch.setattr(ffpicker, "fetch_story", fetch_story)
+    cog = FFPicker.__new__(FFPicker)
+    cog.http = SimpleNamespace(session=None)
+    cog.cache = MetadataCache()
+    link = "https://fanfiction.net/s/5782108/1/The-Quiet-Year"
+    metadata = asyncio.run(cog.get_metadata(link))
+    assert fetched == ["https://www.fanfiction.net/s/5782108/1/The-Quiet-Year"]
+    assert metadata["link"] == link
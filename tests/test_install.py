@@ -0,0 +1,81 @@
+"""
+Check that fflib installs as a package and that the cogs import it the way
+Red loads them, with fflib from site-packages and nothing from the checkout
+"""
+import json
+import os
+import pytest
+import shutil
+import subprocess
+import sys
+
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+COGS = ("ffembed", "ffpicker")
+REQUIREMENT = "adora-fflib @ git+https://github.com/adorabilis/Adora-Cogs"
+
+
+def run(args, **kwargs):
+    return subprocess.run(
+        args, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True, **kwargs
+    )
+
+
+@pytest.fixture(scope="module")
+def installed(tmp_path_factory):
+    """
+    Install fflib into a target directory and copy the cogs into another,
+    as Downloader does, returning a PYTHONPATH with both
+    """
+    tmp = tmp_path_factory.mktemp("install")
+    src, lib, cogs = tmp / "src", tmp / "lib", tmp / "cogs"
+    # Built from a copy, so the build leaves nothing in the checkout
+    shutil.copytree(ROOT / "fflib", src / "fflib")
+    for name in ("pyproject.toml", "LICENSE"):
+        shutil.copy(ROOT / name, src / name)
+    result = run(
+        [sys.executable, "-m", "pip", "install", "--no-deps", "--target", str(lib)]
+        + [str(src)]
+    )
+    if result.returncode:
+        pytest.skip(f"fflib could not be built here:\n{result.stdout}")
+    for cog in COGS:
+        shutil.copytree(ROOT / cog, cogs / cog)
+    # Anything already on PYTHONPATH, such as Red, but never the checkout
+    paths = [str(cogs), str(lib)] + [
+        path
+        for path in os.environ.get("PYTHONPATH", "").split(os.pathsep)
+        if path and Path(path).resolve() != ROOT
+    ]
+    return os.pathsep.join(paths), tmp
+
+
+def test_cogs_require_fflib():
+    for cog in COGS:
+        info = json.loads((ROOT / cog / "info.json").read_text())
+        assert REQUIREMENT in info["requirements"]
+    assert not (ROOT / "fflib" / "info.json").exists()
+
+
+def test_fflib_installs(installed):
+    path, cwd = installed
+    env = dict(os.environ, PYTHONPATH=path)
+    result = run(
+        [sys.executable, "-c", "import fflib; print(fflib.__file__)"],
+        cwd=cwd,
+        env=env,
+    )
+    assert result.returncode == 0, result.stdout
+    assert result.stdout.strip().startswith(str(cwd / "lib"))
+
+
+def test_cogs_import(installed):
+    path, cwd = installed
+    env = dict(os.environ, PYTHONPATH=path)
+    if run([sys.executable, "-c", "import redbot.core"], cwd=cwd, env=env).returncode:
+        pytest.skip("Red is not installed")
+    code = "import fflib, ffembed, ffpicker; print(fflib.__file__)"
+    result = run([sys.executable, "-c", code], cwd=cwd, env=env)
+    assert result.returncode == 0, result.stdout
+    assert result.stdout.strip().startswith(str(cwd / "lib"))
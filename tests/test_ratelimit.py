@@ -0,0 +1,92 @@
+"""
+Tests for the per-site rate limit and circuit breaker
+"""
+import time
+
+from email.utils import formatdate
+from fflib import CircuitBreaker, TokenBucket
+from fflib.ratelimit import CLOSED, HALF_OPEN, OPEN, retry_after
+
+
+class Clock:
+    def __init__(self):
+        self.now = 100.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_bucket_spends_burst_then_reserves():
+    clock = Clock()
+    bucket = TokenBucket(rate=2, burst=3, clock=clock)
+    assert [bucket.take() for _ in range(4)] == [True, True, True, False]
+    assert bucket.reserve() == 0.5
+    assert bucket.reserve() == 1.0
+    clock.now += 1.5
+    assert bucket.available() == 1  # Both reservations are paid off
+
+
+def test_bucket_refills_up_to_burst():
+    clock = Clock()
+    bucket = TokenBucket(rate=2, burst=3, clock=clock)
+    bucket.take()
+    clock.now += 60
+    assert bucket.available() == 3
+
+
+def test_bucket_hold():
+    clock = Clock()
+    bucket = TokenBucket(rate=2, burst=3, clock=clock)
+    bucket.hold(10)
+    assert not bucket.take()
+    assert bucket.reserve() == 10
+    clock.now += 10
+    assert bucket.available() > 0
+
+
+def test_breaker_opens_after_threshold():
+    clock = Clock()
+    breaker = CircuitBreaker(threshold=3, cooldown=60, clock=clock)
+    for _ in range(2):
+        breaker.failure()
+    assert breaker.state == CLOSED and breaker.allow()
+    breaker.success()
+    for _ in range(3):
+        breaker.failure()
+    assert breaker.state == OPEN and not breaker.allow()
+
+
+def test_breaker_lets_one_trial_through_after_cooldown():
+    clock = Clock()
+    breaker = CircuitBreaker(threshold=1, cooldown=60, clock=clock)
+    breaker.failure()
+    clock.now += 59
+    assert not breaker.allow()
+    clock.now += 1
+    assert breaker.state == HALF_OPEN
+    assert breaker.allow() and not breaker.allow()
+    breaker.failure()
+    assert breaker.state == OPEN
+    clock.now += 60
+    assert breaker.allow()
+    breaker.success()
+    assert breaker.state == CLOSED and breaker.allow() and breaker.allow()
+
+
+def test_breaker_release_gives_back_the_trial():
+    clock = Clock()
+    breaker = CircuitBreaker(threshold=1, cooldown=60, clock=clock)
+    breaker.failure()
+    clock.now += 60
+    assert breaker.allow()
+    breaker.release()
+    assert breaker.state == HALF_OPEN and breaker.allow()
+
+
+def test_retry_after():
+    assert retry_after("5") == 5
+    assert retry_after("-3") == 0
+    assert retry_after("") is None and retry_after(None) is None
+    assert retry_after("soon") is None
+    assert 25 < retry_after(formatdate(time.time() + 30, usegmt=True)) <= 30
+    assert retry_after(formatdate(time.time() - 30, usegmt=True)) == 0
@@ -0,0 +1,81 @@
+"""
+Tests for the backends that share cached stories between processes
+"""
+import asyncio
+import pytest
+import threading
+import time
+
+from benchmarks.fakes import FakeRedis
+from fflib import MetadataCache, RedisBackend, SQLiteBackend
+
+KEY = ("ffn", "1")
+
+
+@pytest.fixture(params=["sqlite", "redis"])
+def backend(request, tmp_path):
+    if request.param == "sqlite":
+        backend = SQLiteBackend(tmp_path / "metadata.db")
+    else:
+        backend = RedisBackend(client=FakeRedis())
+    yield backend
+
+    async def close():
+        backend.close()
+        await asyncio.sleep(0)
+
+    asyncio.run(close())
+
+
+def test_round_trip(backend):
+    now = time.time()
+
+    async def run():
+        await backend.set("ffn:1", ({"title": "One"}, False, now + 60, now + 120))
+        await backend.set("ffn:2", ("Gone", True, now + 60, now + 60))
+        count = await backend.count()
+        await backend.set("ffn:3", ({"title": "Old"}, False, now - 20, now - 10))
+        found = await backend.get("ffn:1"), await backend.get("ffn:3")
+        await backend.delete("ffn:1")
+        deleted = await backend.get("ffn:1")
+        await backend.clear()
+        return found, count, deleted, await backend.count()
+
+    found, count, deleted, cleared = asyncio.run(run())
+    assert found == (({"title": "One"}, False, now + 60, now + 120), None)
+    assert count == 2 and deleted is None and cleared == 0
+
+
+def test_caches_share_stories(backend):
+    first, second = MetadataCache(), MetadataCache()
+    first.use_shared(backend)
+    second.use_shared(backend)
+    calls = []
+
+    async def load():
+        calls.append(None)
+        return {"title": "One"}
+
+    async def run():
+        await first.get_or_load(KEY, load)
+        return await second.get_or_load(KEY, load)
+
+    assert asyncio.run(run()) == {"title": "One"} and len(calls) == 1
+    assert second.stats["shared_hits"] == 1
+
+
+def test_sqlite_opens_off_the_event_loop(tmp_path, monkeypatch):
+    threads = []
+    connect = SQLiteBackend._connect
+
+    def record(self):
+        threads.append(threading.current_thread())
+        return connect(self)
+
+    monkeypatch.setattr(SQLiteBackend, "_connect", record)
+    backend = SQLiteBackend(tmp_path / "metadata.db")
+    try:
+        assert asyncio.run(backend.count()) == 0
+    finally:
+        backend.close()
+    assert threads and threading.current_thread() not in threads
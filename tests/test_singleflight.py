@@ -0,0 +1,64 @@
+"""
+Tests for collapsing concurrent calls into one
+"""
+import asyncio
+
+from fflib import SingleFlight
+
+
+def test_concurrent_calls_share_one_task():
+    flights = SingleFlight()
+    calls = []
+
+    async def work():
+        calls.append(None)
+        await asyncio.sleep(0.01)
+        return "done"
+
+    async def run():
+        results = await asyncio.gather(*(flights.run("k", work) for _ in range(3)))
+        return results, len(flights)
+
+    assert asyncio.run(run()) == (["done"] * 3, 0)
+    assert len(calls) == 1
+    assert flights.stats == {"flights": 1, "coalesced": 2}
+
+
+def test_cancelling_one_caller_keeps_the_task():
+    flights = SingleFlight()
+    release = None
+
+    async def work():
+        await release.wait()
+        return "done"
+
+    async def run():
+        nonlocal release
+        release = asyncio.Event()
+        first = asyncio.ensure_future(flights.run("k", work))
+        second = asyncio.ensure_future(flights.run("k", work))
+        await asyncio.sleep(0)
+        first.cancel()
+        await asyncio.sleep(0)
+        assert "k" in flights
+        release.set()
+        return first, await second
+
+    first, result = asyncio.run(run())
+    assert first.cancelled() and result == "done"
+
+
+def test_failure_reaches_every_caller_and_is_forgotten():
+    flights = SingleFlight()
+
+    async def work():
+        await asyncio.sleep(0)
+        raise ValueError("broken")
+
+    async def run():
+        calls = (flights.run("k", work) for _ in range(2))
+        return await asyncio.gather(*calls, return_exceptions=True)
+
+    results = asyncio.run(run())
+    assert [type(e) for e in results] == [ValueError, ValueError]
+    assert "k" not in flights
@@ -0,0 +1,67 @@
+"""
+Tests for FFPicker's SQLite story store
+"""
+import asyncio
+import pytest
+import threading
+
+from types import SimpleNamespace
+
+pytest.importorskip("redbot.core")
+
+from ffpicker.pages import StoryPages  # noqa: E402
+from ffpicker.store import CHUNK_SIZE, SQLiteStore  # noqa: E402
+
+GUILD = SimpleNamespace(id=1, name="Test", icon_url="")
+
+
+def story(n, **fields):
+    return dict(key=f"ao3:{n}", title=f"Story {n}", author="A", link=f"l{n}", **fields)
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = SQLiteStore(tmp_path / "stories.db")
+    yield store
+    store.close()
+
+
+def test_queries_run_off_the_event_loop(store, monkeypatch):
+    threads = []
+    query = store._query
+
+    def record(sql, params=()):
+        threads.append(threading.current_thread())
+        return query(sql, params)
+
+    monkeypatch.setattr(store, "_query", record)
+    asyncio.run(store.append(GUILD, [story(1)]))
+    asyncio.run(store.keys(GUILD))
+    assert threads and threading.current_thread() not in threads
+
+
+def test_listing_reads_pages_as_shown(store):
+    count = CHUNK_SIZE * 2 + 5
+
+    async def run():
+        await store.append(GUILD, [story(n) for n in range(count)])
+        pages = StoryPages(GUILD, await store.stories(GUILD))
+        await pages.load_page(len(pages) - 1)
+        assert list(pages.stories._chunks) == [2]
+        assert "Story 204" in pages[len(pages) - 1].to_dict()["description"]
+        assert await pages.position(f"ao3:{CHUNK_SIZE}") == CHUNK_SIZE
+        return (await pages.story(CHUNK_SIZE))["title"]
+
+    assert asyncio.run(run()) == f"Story {CHUNK_SIZE}"
+
+
+def test_stale_ranks_old_and_viewed(store):
+    stories = [
+        story(1, fetched_at=100, views=0),
+        story(2, fetched_at=200, views=10),
+        story(3, fetched_at=50, views=0),
+        story(4, fetched_at=1000, views=100),
+    ]
+    asyncio.run(store.append(GUILD, stories))
+    stale = asyncio.run(store.stale(500, 2))
+    assert [s["key"] for _, s in stale] == ["ao3:2", "ao3:3"]
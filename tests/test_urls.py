@@ -0,0 +1,152 @@
+"""
+Property and fuzz tests for the shared story link extractor
+"""
+import pytest
+
+pytest.importorskip("hypothesis")
+
+from hypothesis import given, settings, strategies as st  # noqa: E402
+
+from fflib import find_stories, story_ref  # noqa: E402
+from fflib.urls import LINK_RE  # noqa: E402
+
+SCHEMES = st.sampled_from(("http://", "https://"))
+IDS = st.integers(1, 10 ** 9).map(str)
+CHAPTERS = st.none() | st.integers(1, 10 ** 6)
+SLUGS = st.text("abcdefghijklmnopqrstuvwxyzABCXYZ0123456789-", min_size=1, max_size=40)
+NAMES = st.text("abcdefghijklmnopqrstuvwxyz0123456789_", min_size=1, max_size=20)
+
+# Characters that can end a link in chat without being part of it
+ENDINGS = st.sampled_from(("", " ", "\n", ".", ",", "!", "?", ")", ">", "'", '"'))
+
+# Chat without link syntax, so any link found must be one that was put there
+CHATTER = st.text(
+    st.characters(
+        blacklist_categories=("Cs",), blacklist_characters=":/", max_codepoint=0x2FFF
+    ),
+    max_size=80,
+)
+
+# Text that looks like a supported link but isn't one
+NEAR_MISSES = st.sampled_from(
+    (
+        "fanfiction.net/s/123/1/",
+        "www.fanfiction.net/s/123",
+        "https://fanfiction.net/s/",
+        "https://fanfiction.net/s/abc",
+        "https://www.fanfiction.org/s/123",
+        "https://fanfictionXnet/s/123",
+        "https://www.fictionpress.com/s/123/1/",
+        "https://ffanfiction.net/s/123",
+        "https://archiveofourown.org/works/",
+        "https://archiveofourown.org/works/abc",
+        "https://archiveofourownXorg/works/123",
+        "https://archiveofourown.org/tags/Harry/works",
+        "https://archiveofourown.org/users/someone",
+        "https://archiveofourown.org/collections/",
+        "https://siye.co.uk/viewstory.php?sid=",
+        "https://siye.co.uk/viewstory.phpXsid=123",
+        "https://siyeXco.uk/viewstory.php?sid=123",
+        "ftp://archiveofourown.org/works/123",
+        "https:/archiveofourown.org/works/123",
+    )
+)
+
+
+@st.composite
+def links(draw):
+    """
+    Draw a supported link and the (site, ID, chapter, kind) it stands for
+    """
+    scheme = draw(SCHEMES)
+    kind = draw(
+        st.sampled_from(
+            ("ffn", "ffn-author", "ao3", "series", "collection", "user", "siye")
+        )
+    )
+    story, chapter = draw(IDS), draw(CHAPTERS)
+    if kind == "ffn":
+        host = draw(st.sampled_from(("", "www.", "m.", "www.m.")))
+        url = f"{scheme}{host}fanfiction.net/s/{story}"
+        if chapter is not None:
+            url += f"/{chapter}"
+            if draw(st.booleans()):
+                url += "/" + draw(SLUGS)
+        return url, ("ffn", story, chapter, "story")
+    elif kind == "ffn-author":
+        url = f"{scheme}www.fanfiction.net/u/{story}"
+        if draw(st.booleans()):
+            url += "/" + draw(SLUGS)
+        return url, ("ffn", story, None, "author")
+    elif kind == "ao3":
+        host = draw(st.sampled_from(("", "www.")))
+        prefix = draw(st.none() | NAMES)
+        url = f"{scheme}{host}archiveofourown.org/"
+        if prefix:
+            url += f"collections/{prefix}/"
+        url += f"works/{story}"
+        if chapter is not None:
+            url += f"/chapters/{chapter}"
+        return url, ("ao3", story, chapter, "work")
+    elif kind == "series":
+        url = f"{scheme}archiveofourown.org/series/{story}"
+        return url, ("ao3", story, None, "series")
+    elif kind == "collection":
+        name = draw(NAMES)
+        url = f"{scheme}archiveofourown.org/collections/{name}"
+        if draw(st.booleans()):
+            url += "/works"
+        return url, ("ao3", name, None, "collection")
+    elif kind == "user":
+        name, pseud = draw(NAMES), draw(st.none() | NAMES)
+        if pseud:
+            name += f"/pseuds/{pseud}"
+        url = f"{scheme}archiveofourown.org/users/{name}/works"
+        return url, ("ao3", name, None, "user")
+    directory = draw(st.sampled_from(("", "siye/")))
+    url = f"{scheme}siye.co.uk/{directory}viewstory.php?sid={story}"
+    if chapter is not None:
+        url += f"&chapter={chapter}"
+    return url, ("siye", story, chapter, "story")
+
+
+@given(links())
+def test_link_parts(link):
+    url, expected = link
+    ref = story_ref(url)
+    assert ref is not None
+    assert (ref.site, ref.id, ref.chapter, ref.kind) == expected
+
+
+@given(links())
+def test_canonical_round_trip(link):
+    ref = story_ref(link[0])
+    again = story_ref(ref.url)
+    assert again.url == ref.url
+    assert again.key == ref.key
+    assert again.kind == ref.kind
+    assert LINK_RE.fullmatch(ref.url)
+
+
+@settings(max_examples=300)
+@given(st.lists(st.tuples(CHATTER, links(), ENDINGS), max_size=6), CHATTER)
+def test_links_in_chat(parts, tail):
+    text = "".join(f"{before} {url}{end} " for before, (url, _), end in parts)
+    found = find_stories(text + tail)
+    assert [(ref.site, ref.id, ref.chapter, ref.kind) for ref in found] == [
+        expected for _, (_, expected), _ in parts
+    ]
+
+
+@settings(max_examples=300)
+@given(st.lists(CHATTER | NEAR_MISSES, max_size=12))
+def test_no_false_positives(words):
+    text = " ".join(words)
+    assert find_stories(text) == []
+    assert story_ref(text) is None
+
+
+@given(st.text(max_size=300))
+def test_arbitrary_text(text):
+    for ref in find_stories(text):
+        assert story_ref(ref.url).key == ref.key